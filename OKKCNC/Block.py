@@ -18,9 +18,25 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import re
+from array import array
+
 import Unicode
 
 import OCV
+import ParseCache
+
+
+def _changed(name):
+    """list method that rebuilds the records after changing the lines"""
+    change = getattr(list, name)
+
+    def method(self, *args, **kwargs):
+        result = change(self, *args, **kwargs)
+        self.lines_changed()
+        return result
+
+    method.__name__ = name
+    return method
 
 
 class Block(list):
@@ -32,8 +48,29 @@ class Block(list):
     -
      Inherits from list and contains:
         - a list list of gcode lines - (imported shape)
+
+     Alongside the lines a Block keeps the parsed records of them, built
+     lazily by records() and stored as flat arrays:
+        - _rec_kind     array('b') REC_EMPTY, REC_WORDS, REC_OTHER per line
+        - _rec_start    array('I') offset of the first word of each line,
+                        plus a final one, words of line i are in
+                        [start[i], start[i+1])
+        - _rec_letter   str of the word letters (uppercase)
+        - _rec_value    array('d') of the word values
+     The record of a line set by index is rebuilt alone, other changes to
+     the lines rebuild the whole records when they are needed again, the
+     list methods changing the lines are overridden for it.
+
+     Memory cost measured on the tests/*.ngc files (3.3 words per line):
+     about 35 bytes per line, 1 for the kind, 4 for the offset and 9 for
+     each word, against about 72 bytes of the line string itself.
     """
 
+    REC_EMPTY = 0   # empty line or comment
+    REC_WORDS = 1   # only GCode words, the record has the values
+    REC_OTHER = 2   # expressions, assignments, % lines or malformed
+                    # lines, the text has to be parsed
+
     def __init__(self, name=None):
         # Copy constructor
         if isinstance(name, Block):
@@ -49,6 +86,7 @@ class Block(list):
 
         self.ex = self.ey = self.ez = 0  # ending coordinates
         self.resetPath()
+        self.lines_changed()
 
     def copy(self, src):
         """Copy a Block"""
@@ -64,6 +102,7 @@ class Block(list):
         self.ex = src.ex
         self.ey = src.ey
         self.ez = src.ez
+        self.lines_changed()
 
     def name(self):
         """return Block Name or None"""
@@ -215,6 +254,47 @@ class Block(list):
         return block
 
     def append(self, line):
+        line = self.parse_meta(line)
+
+        if line is not None:
+            list.append(self, line)
+
+            # nothing to rebuild while the block is loaded
+            if self._rec_kind is not None:
+                self.lines_changed()
+            else:
+                self.dirty = True
+
+    def __setitem__(self, item, line):
+        list.__setitem__(self, item, line)
+
+        if isinstance(item, slice):
+            self.lines_changed()
+        elif item < 0:
+            self.line_changed(item + len(self))
+        else:
+            self.line_changed(item)
+
+    __delitem__ = _changed("__delitem__")
+    __iadd__ = _changed("__iadd__")
+    __imul__ = _changed("__imul__")
+    extend = _changed("extend")
+    insert = _changed("insert")
+    pop = _changed("pop")
+    remove = _changed("remove")
+    reverse = _changed("reverse")
+    sort = _changed("sort")
+
+    def append_line(self, line, rng=None):
+        """Append a line read from file, rng is its (start, end, map) range
+        used by MappedBlock
+        """
+        self.append(line)
+
+    def parse_meta(self, line):
+        """Process the (Block-xxx: ) metadata lines
+        @return the line to be stored, None if it is consumed
+        """
         if line.startswith("(Block-"):
             pat = OCV.RE_BLOCK.match(line)
             if pat:
@@ -223,24 +303,21 @@ class Block(list):
 
                 if name == "name":
                     self.b_name = value
-                    return
+                    return None
                 elif name == "expand":
                     self.expand = bool(int(value))
-                    return
+                    return None
                 elif name == "enable":
                     self.enable = bool(int(value))
-                    return
+                    return None
                 elif name == "tab":
                     # Handled elsewhere
-                    return
+                    return None
                 elif name == "color":
                     self.color = value
-                    return
+                    return None
                 elif name == "X":  # uncomment
-                    list.append(
-                        self,
-                        value.replace('[', '(').replace(']', ')'))
-                    return
+                    return value.replace('[', '(').replace(']', ')')
 
         if self.b_name is None and ("id:" in line) and ("End" not in line):
             pat = OCV.RE_ID.match(line)
@@ -248,7 +325,7 @@ class Block(list):
             if pat:
                 self.b_name = pat.group(1)
 
-        list.append(self, line)
+        return line
 
     def resetPath(self):
         del self._path[:]
@@ -287,3 +364,265 @@ class Block(list):
         self.xmax = max(self.xmax, max([i[0] for i in xyz]))
         self.ymax = max(self.ymax, max([i[1] for i in xyz]))
         self.zmax = max(self.zmax, max([i[2] for i in xyz]))
+
+    @staticmethod
+    def parse_record(line):
+        """@return kind, letters, values of a line"""
+        if line.lstrip()[:1] == '%':
+            # depends on the running state
+            return Block.REC_OTHER, "", ()
+
+        cmd = ParseCache.compile_comment(line)[0]
+        words = ParseCache.parse_line(line)
+
+        if cmd is None and words is None:
+            return Block.REC_EMPTY, "", ()
+
+        if not isinstance(cmd, str):
+            return Block.REC_OTHER, "", ()
+
+        # CNC.breakLine and Heuristic.parse_line must agree, malformed
+        # lines are left to them
+        if ParseCache.break_line(cmd) != words:
+            return Block.REC_OTHER, "", ()
+
+        pairs = ParseCache.word_values(words)
+        letters = "".join([c for c, v in pairs])
+        values = [0.0 if v is None else v for c, v in pairs]
+        return Block.REC_WORDS, letters, values
+
+    def lines_changed(self):
+        """Lines are inserted, deleted or moved, rebuild all the records"""
+        self._rec_kind = None
+        self._rec_start = None
+        self._rec_letter = None
+        self._rec_value = None
+        self._rec_patch = {}
+        # drawn again by CNCCanvas.drawPaths
+        self.dirty = True
+
+    def line_changed(self, lid):
+        """Rebuild the record of line lid"""
+        self.dirty = True
+        if self._rec_kind is not None and lid < len(self._rec_kind):
+            self._rec_patch[lid] = Block.parse_record(self[lid])
+
+    def records(self):
+        """Build the records of the lines if needed"""
+        if self._rec_kind is not None and len(self._rec_kind) == len(self):
+            return
+
+        kinds = array('b')
+        starts = array('I', [0])
+        letters = []
+        values = array('d')
+
+        for line in self:
+            kind, let, val = Block.parse_record(line)
+            kinds.append(kind)
+            if let:
+                letters.append(let)
+                values.extend(val)
+            starts.append(len(values))
+
+        self._rec_kind = kinds
+        self._rec_start = starts
+        self._rec_letter = "".join(letters)
+        self._rec_value = values
+        self._rec_patch = {}
+
+    def has_records(self):
+        """@return True if the records are built"""
+        return self._rec_kind is not None and len(self._rec_kind) == len(self)
+
+    def get_records(self):
+        """@return the records as a picklable tuple, see set_records"""
+        self.records()
+
+        if self._rec_patch:
+            # fold the patched lines
+            self.lines_changed()
+            self.records()
+
+        return self._rec_kind, self._rec_start, self._rec_letter, \
+            self._rec_value
+
+    def set_records(self, records):
+        """Set the records built elsewhere by get_records, see BlockPool"""
+        self._rec_kind, self._rec_start, self._rec_letter, \
+            self._rec_value = records
+        self._rec_patch = {}
+
+    def has_other(self):
+        """@return True if some line has no record (REC_OTHER)"""
+        self.records()
+
+        if Block.REC_OTHER in self._rec_kind:
+            return True
+
+        for kind, letters, values in self._rec_patch.values():
+            if kind == Block.REC_OTHER:
+                return True
+
+        return False
+
+    def record(self, lid):
+        """@return kind, (letter, value) pairs of line lid
+        pairs is None if the kind is not REC_WORDS
+        """
+        self.records()
+
+        if self._rec_patch and lid in self._rec_patch:
+            kind, letters, values = self._rec_patch[lid]
+        else:
+            kind = self._rec_kind[lid]
+            if kind != Block.REC_WORDS:
+                return kind, None
+            a = self._rec_start[lid]
+            b = self._rec_start[lid + 1]
+            letters = self._rec_letter[a:b]
+            values = self._rec_value[a:b]
+
+        if kind != Block.REC_WORDS:
+            return kind, None
+
+        return kind, tuple(zip(letters, values))
+
+    def iter_records(self):
+        """Yield line, kind, pairs for each line see record()"""
+        self.records()
+        kinds = self._rec_kind
+        starts = self._rec_start
+        letters = self._rec_letter
+        values = self._rec_value
+
+        for lid, line in enumerate(self):
+            if self._rec_patch and lid in self._rec_patch:
+                yield (line,) + self.record(lid)
+                continue
+
+            kind = kinds[lid]
+
+            if kind == Block.REC_WORDS:
+                a = starts[lid]
+                b = starts[lid + 1]
+                yield line, kind, tuple(zip(letters[a:b], values[a:b]))
+            else:
+                yield line, kind, None
+
+    def records_size(self):
+        """@return the bytes used by the records"""
+        self.records()
+        size = 0
+        for item in (self._rec_kind, self._rec_start, self._rec_value):
+            size += item.itemsize * len(item)
+        return size + len(self._rec_letter)
+
+
+def _promoted(name):
+    """list method that promotes the MappedBlock before changing it"""
+    def method(self, *args, **kwargs):
+        self.promote()
+        return getattr(self, name)(*args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+class MappedBlock(Block):
+    """
+    Read only Block of a memory mapped file, see GCode.read_mapped.
+    The lines are not stored, only their (start, end) byte ranges in the
+    map, and they are decoded when they are read, for the editor (only
+    the expanded blocks) or the sender.
+
+    Any change to the lines promotes the block to a plain Block, the lines
+    are then read from the map and stored as strings.
+
+    Memory cost 12 bytes per line, 8 for the start and 4 for the length.
+    """
+
+    def __init__(self, name=None, mapped=None):
+        Block.__init__(self, name)
+        self._map = mapped
+        self._start = array('Q')
+        self._size = array('I')
+
+    def append_line(self, line, rng=None):
+        """Append the line of range rng, the line is used only for the
+        metadata, see Block.parse_meta
+        """
+        stored = self.parse_meta(line)
+
+        if stored is None:
+            return
+
+        if rng is None or stored is not line:
+            # changed line, the block can't be mapped anymore
+            self.promote()
+            list.append(self, stored)
+            return
+
+        self._start.append(rng[0])
+        self._size.append(rng[1] - rng[0])
+
+    def promote(self):
+        """Read all the lines and turn self into a plain Block"""
+        lines = list(self)
+        del self._map
+        del self._start
+        del self._size
+        self.__class__ = Block
+        list.extend(self, lines)
+        self.lines_changed()
+
+    def _line(self, idx):
+        start = self._start[idx]
+        line = self._map[start:start + self._size[idx]]
+
+        # python 3 maps are bytes
+        if not isinstance(line, str):
+            line = line.decode("utf-8", "replace")
+
+        return line.replace("\x0d", "")
+
+    def __len__(self):
+        return len(self._start)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self._line(idx) for idx in range(*item.indices(len(self)))]
+
+        return self._line(item)
+
+    def __iter__(self):
+        for idx in range(len(self._start)):
+            yield self._line(idx)
+
+    def __reversed__(self):
+        for idx in range(len(self._start) - 1, -1, -1):
+            yield self._line(idx)
+
+    def __contains__(self, line):
+        return line in iter(self)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def index(self, line, *args):
+        return list(self).index(line, *args)
+
+    def count(self, line):
+        return list(self).count(line)
+
+    __setitem__ = _promoted("__setitem__")
+    __delitem__ = _promoted("__delitem__")
+    __iadd__ = _promoted("__iadd__")
+    __imul__ = _promoted("__imul__")
+    append = _promoted("append")
+    extend = _promoted("extend")
+    insert = _promoted("insert")
+    pop = _promoted("pop")
+    remove = _promoted("remove")
+    reverse = _promoted("reverse")
+    sort = _promoted("sort")
@@ -0,0 +1,187 @@
+# -*- coding: ascii -*-
+"""BlockPool.py
+
+This module contains the parallel compilation of the Blocks used by
+CNCCanvas.drawPaths, the lengths, times and margins shown by
+Interface.show_stats are computed from its results.
+
+The blocks are independent once the modal state at the start of each one
+is known, so the work is split in three steps:
+    1   the records of the blocks (Block.records) are built in a
+        multiprocessing pool, one task per block
+    2   a sequential pass over the records takes the modal state snapshot
+        at the start of each block (CNC.modalState), the blocks with
+        expressions are computed here as they can change the variables
+    3   CNC.motionBlock runs in the pool starting from the snapshots
+
+The BlockMotion results are returned in the blocks order, they are
+applied to the blocks by the caller.
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import multiprocessing
+
+import OCV
+from Block import Block
+from CNC import CNC
+
+# number of processes of the pool, 0 to use the number of CPUs
+# and 1 to never use the pool
+PROCESSES = 1
+# programs with less lines are compiled sequentially
+MIN_LINES = 20000
+# lines of the smaller blocks grouped in a pool task
+TASK_LINES = 5000
+
+_POOL = [None, 0]
+
+
+def processes():
+    """@return the number of processes to use"""
+    if PROCESSES > 0:
+        return PROCESSES
+
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def get_pool():
+    """@return the pool, created at first use"""
+    size = processes()
+
+    if _POOL[0] is not None and _POOL[1] != size:
+        close()
+
+    if _POOL[0] is None:
+        # the Tk process runs the serial and loader threads, a forked
+        # process could inherit a lock held by one of them
+        try:
+            context = multiprocessing.get_context("spawn")
+        except AttributeError:
+            # python 2 can only fork
+            context = multiprocessing
+        _POOL[0] = context.Pool(size)
+        _POOL[1] = size
+
+    return _POOL[0]
+
+
+def close():
+    """Terminate the pool processes, called when the program ends"""
+    if _POOL[0] is not None:
+        _POOL[0].terminate()
+        _POOL[0] = None
+
+
+def usable(blocks):
+    """@return True if the blocks are worth a parallel compilation"""
+    if processes() < 2:
+        return False
+
+    return sum(len(block) for block in blocks) >= MIN_LINES
+
+
+def _config():
+    """settings used by the pool tasks"""
+    return OCV.stdexpr, OCV.inch, OCV.accuracy
+
+
+def _task_block(config, lines, records=None):
+    """Block of lines in a pool process"""
+    OCV.stdexpr, OCV.inch, OCV.accuracy = config
+    block = Block()
+    # the lines are already processed by Block.append
+    list.extend(block, lines)
+
+    if records is not None:
+        block.set_records(records)
+
+    return block
+
+
+def build_records(task):
+    """pool task, @return the records of the lines"""
+    config, lines = task
+    return _task_block(config, lines).get_records()
+
+
+def block_motion(task):
+    """pool task, @return the BlockMotion of the lines"""
+    config, lines, records, state = task
+    block = _task_block(config, lines, records)
+    cnc = CNC()
+    cnc.setModalState(state)
+    return cnc.motionBlock(block)
+
+
+def _chunksize(tasks, lines):
+    """group the tasks to have about TASK_LINES lines each"""
+    if not tasks:
+        return 1
+
+    return max(1, int(TASK_LINES * len(tasks) / max(lines, 1)))
+
+
+def compile_blocks(blocks, cnc, parse, states=None):
+    """Compute the BlockMotion of each block
+    @param cnc is left in the modal state at the end of the blocks
+    @param parse function of CNC.motionBlock, used for the blocks with
+        expressions
+    @param states list where the CNC.modalState at the start of each block
+        is appended, if not None
+    @return list of (motion, end) in the blocks order, end is the (x, y, z)
+        position at the end of the block
+    """
+    pool = get_pool()
+    config = _config()
+    lines = [list(block) for block in blocks]
+
+    # 1. records
+    todo = [idx for idx, block in enumerate(blocks)
+            if not block.has_records()]
+    tasks = [(config, lines[idx]) for idx in todo]
+    chunk = _chunksize(tasks, sum(len(lines[idx]) for idx in todo))
+
+    for idx, records in zip(todo, pool.imap(build_records, tasks, chunk)):
+        blocks[idx].set_records(records)
+
+    # 2. modal state at the start of each block
+    total_time = cnc.totalTime
+    result = []
+    todo = []
+    tasks = []
+
+    for idx, block in enumerate(blocks):
+        if states is not None:
+            states.append(cnc.modalState())
+
+        if block.has_other():
+            result.append(cnc.motionBlock(block, parse))
+        else:
+            result.append(None)
+            todo.append(idx)
+            tasks.append(
+                (config, lines[idx], block.get_records(), cnc.modalState()))
+            cnc.motionModal(block)
+
+        lines[idx] = (cnc.x, cnc.y, cnc.z)
+
+    # the times are added by BlockMotion.apply
+    cnc.totalTime = total_time
+
+    # 3. motions
+    chunk = _chunksize(tasks, sum(len(task[1]) for task in tasks))
+
+    for idx, motion in zip(todo, pool.imap(block_motion, tasks, chunk)):
+        result[idx] = motion
+
+    return list(zip(result, lines))
@@ -19,6 +19,13 @@ from __future__ import print_function
 import math
 
 import OCV
+import ParseCache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # import Probe
 # import Block
 
@@ -293,10 +300,227 @@ class Orient(object):
         self.saved = True
 
 
+class BlockMotion(object):
+    """
+    Motions of a whole block, as computed by CNC.motionBlock
+    For each line of the block that produces a path there is a motion,
+    motion i has:
+        lid[i]      line index in the block
+        gcode[i]    motion gcode
+        feed[i]     feed rate
+        mode[i]     feed mode (93, 94 or 0)
+        arc[i]      True for G2/G3 arcs
+        end[i]      (x, y, z) position after the motion
+        points[offset[i]:offset[i+1]] the (x, y, z) path points
+    start is the position after the first feed motion line, as used by
+    Block.startPath, or None.
+    With numpy the fields are numpy arrays, else python lists.
+    """
+
+    def __init__(self):
+        self.lid = []
+        self.gcode = []
+        self.feed = []
+        self.mode = []
+        self.arc = []
+        self.end = []
+        self.offset = [0]
+        self.points = []
+        self.start = None
+        self.dwell = None  # motion index after the last G4, see apply()
+        self.dwell_time = 0.0  # P value of the last G4
+        self._arcs = []  # (motion index, arc) expanded by finish()
+        self._length = None
+
+    def __len__(self):
+        return len(self.lid)
+
+    def add(self, lid, gcode, feed, mode, xyz, end):
+        self.lid.append(lid)
+        self.gcode.append(gcode)
+        self.feed.append(feed)
+        # only the numeric 93, 94 modes set by motionStart are timed
+        self.mode.append(mode if mode in (93, 94) else 0)
+        self.arc.append(gcode in (2, 3))
+        self.end.append(end)
+        self.points.extend(xyz)
+        self.offset.append(len(self.points))
+
+    def add_arc(self, lid, gcode, feed, mode, arc, end):
+        """Add a G2/G3 motion, arc as returned by CNC.motionArc
+        with numpy all the arcs are expanded at once by finish()
+        """
+        if np is None:
+            self.add(lid, gcode, feed, mode, CNC.arcPoints(arc), end)
+            return
+
+        self._arcs.append((len(self.lid), arc))
+        self.add(lid, gcode, feed, mode, (), end)
+
+    def finish(self):
+        """Convert the lists to numpy arrays"""
+        if np is None:
+            return
+
+        self.lid = np.array(self.lid, dtype=np.int32)
+        self.gcode = np.array(self.gcode, dtype=np.int16)
+        self.feed = np.array(self.feed, dtype=np.float64)
+        self.mode = np.array(self.mode, dtype=np.int16)
+        self.arc = np.array(self.arc, dtype=bool)
+        self.end = np.array(self.end, dtype=np.float64).reshape(-1, 3)
+        self.offset = np.array(self.offset, dtype=np.int64)
+        self.points = np.array(self.points, dtype=np.float64).reshape(-1, 3)
+
+        if not self._arcs:
+            return
+
+        # merge the arc points with the ones of the other motions
+        idx = np.array([i for i, arc in self._arcs], dtype=np.int64)
+        arc_pts, arc_off = CNC.arcPointsBatch([arc for i, arc in self._arcs])
+        counts = np.diff(self.offset)
+        counts[idx] = np.diff(arc_off)
+        offset = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offset[1:])
+
+        points = np.empty((offset[-1], 3), dtype=np.float64)
+        other = np.ones(len(counts), dtype=bool)
+        other[idx] = False
+        other = np.nonzero(other)[0]
+        old = np.diff(self.offset)[other]
+        points[np.arange(old.sum()) + np.repeat(
+            offset[other] - self.offset[other], old)] = self.points
+        points[np.arange(len(arc_pts)) + np.repeat(
+            offset[idx] - arc_off[:-1], counts[idx])] = arc_pts
+
+        self.offset = offset
+        self.points = points
+        self._arcs = []
+
+    def path(self, i):
+        """@return the points of motion i as list of tuples"""
+        pts = self.points[self.offset[i]:self.offset[i + 1]]
+        if np is None:
+            return list(pts)
+        return [tuple(p) for p in pts.tolist()]
+
+    def length(self):
+        """@return the length of each motion path"""
+        if self._length is not None:
+            return self._length
+
+        if np is None:
+            length = []
+            for i in range(len(self.lid)):
+                pts = self.points[self.offset[i]:self.offset[i + 1]]
+                tot = 0.0
+                p = pts[0]
+                for q in pts:
+                    tot += math.sqrt(
+                        (q[0]-p[0])**2 + (q[1]-p[1])**2 + (q[2]-p[2])**2)
+                    p = q
+                length.append(tot)
+        else:
+            # segment k joins points k and k+1, the ones across two
+            # motions are excluded by the offsets
+            seg = np.sqrt(
+                (np.diff(self.points, axis=0)**2).sum(axis=1))
+            cum = np.concatenate(([0.0], np.cumsum(seg)))
+            first = self.offset[:-1]
+            last = np.maximum(self.offset[1:] - 1, first)
+            length = cum[last] - cum[first]
+
+        self._length = length
+        return length
+
+    def times(self):
+        """@return the time of each motion path, as CNC.pathLength"""
+        length = self.length()
+
+        if np is None:
+            times = []
+            for l, g, f, m in zip(length, self.gcode, self.feed, self.mode):
+                if g == 0:
+                    times.append(l / OCV.feedmax_x)
+                elif m == 94 and f != 0:
+                    times.append(l / f)
+                elif m == 93:
+                    times.append(l * f)
+                else:
+                    times.append(0.0)
+            return times
+
+        times = np.zeros(len(length))
+        rapid = self.gcode == 0
+        times[rapid] = length[rapid] / OCV.feedmax_x
+        sel = ~rapid & (self.mode == 94) & (self.feed != 0)
+        times[sel] = length[sel] / self.feed[sel]
+        sel = ~rapid & (self.mode == 93)
+        times[sel] = length[sel] * self.feed[sel]
+        return times
+
+    def apply(self, block, cnc):
+        """Add lengths, time and margins to block and cnc
+        as CNC.pathLength, Block.pathMargins and CNC.pathMargins do
+        """
+        if not len(self.lid):
+            return
+
+        length = self.length()
+        times = self.times()
+
+        if np is None:
+            rapid = sum(l for l, g in zip(length, self.gcode) if g == 0)
+            total = sum(length)
+            feed_pts = []
+            for i, g in enumerate(self.gcode):
+                if g in (1, 2, 3):
+                    feed_pts.extend(
+                        self.points[self.offset[i]:self.offset[i + 1]])
+            time_all = sum(times)
+            time_dwell = sum(times[self.dwell:]) \
+                if self.dwell is not None else 0.0
+        else:
+            rapid = float(length[self.gcode == 0].sum())
+            total = float(length.sum())
+            sel = (self.gcode >= 1) & (self.gcode <= 3)
+            idx = np.repeat(sel, np.diff(self.offset))
+            feed_pts = self.points[idx]
+            time_all = float(times.sum())
+            time_dwell = float(times[self.dwell:].sum()) \
+                if self.dwell is not None else 0.0
+
+        block.rapid += rapid
+        block.length += total - rapid
+        block.time += time_all
+        cnc.totalLength += total
+
+        if self.dwell is not None:
+            # G4 resets the total time see CNC.motionPath
+            cnc.totalTime = self.dwell_time + time_dwell
+        else:
+            cnc.totalTime += time_all
+
+        if len(feed_pts):
+            if np is None:
+                block.pathMargins(feed_pts)
+            else:
+                lo = feed_pts.min(axis=0).tolist()
+                hi = feed_pts.max(axis=0).tolist()
+                block.xmin = min(block.xmin, lo[0])
+                block.ymin = min(block.ymin, lo[1])
+                block.zmin = min(block.zmin, lo[2])
+                block.xmax = max(block.xmax, hi[0])
+                block.ymax = max(block.ymax, hi[1])
+                block.zmax = max(block.zmax, hi[2])
+            cnc.pathMargins(block)
+
+
 class CNC(object):
     """Command operations on a CNC"""
 
     def __init__(self):
+        # a (Block-name: line was read, see GCode.add_line
+        self.blocksExist = False
         self.initPath()
         self.resetAllMargins()
 
@@ -620,180 +844,17 @@ class CNC(object):
         line s breaking a line containing list of commands,
         None,"" if empty or comment
         else compiled expressions,""
+        see Tokenizer.compile_line, results are cached in ParseCache
         """
-        line = line.strip()
-
-        if not line:
-            return None
-
-        if line[0] == "$":
-            return line
-
-        # to accept #nnn variables as _nnn internally
-        line = line.replace('#', '_')
-        OCV.comment = ""
-
-        # execute literally the line after the first character
-        if line[0] == '%':
-            # special command
-            pat = OCV.RE_AUX.match(line.strip())
-
-            if pat:
-                cmd = pat.group(1)
-                args = pat.group(2)
-            else:
-                cmd = None
-                args = None
-
-            if cmd == "%wait":
-                return (OCV.GSTATE_WAIT,)
-            elif cmd == "%msg":
-
-                if not args:
-                    args = None
-
-                return (OCV.GSTATE_MSG, args)
-            elif cmd == "%update":
-                return (OCV.GSTATE_UPDATE, args)
-            elif line.startswith("%if running") and not OCV.CD["running"]:
-                # ignore if running lines when not running
-                return None
-            else:
-                try:
-                    return compile(line[1:], "", "exec")
-                except Exception:
-                    # FIXME show the error!!!!
-                    return None
-
-        # most probably an assignment like  #nnn = expr
-        if line[0] == '_':
-            try:
-                return compile(line, "", "exec")
-            except Exception as e:
-                print("Compile line error: \n")
-                print(e)
-                return None
-
-        # commented line
-        if line[0] == ';':
-            OCV.comment = line[1:].strip()
-            return None
-
-        out = []  # output list of commands
-        braket = 0  # bracket count []
-        paren = 0  # parenthesis count ()
-        expr = ""  # expression string
-        cmd = ""  # cmd string
-        inComment = False  # inside inComment
-        for i, ch in enumerate(line):
-            if ch == '(':
-                # comment start?
-                paren += 1
-                inComment = (braket == 0)
-
-                if not inComment:
-                    expr += ch
-
-            elif ch == ')':
-                # comment end?
-                paren -= 1
-                if not inComment:
-                    expr += ch
-
-                if paren == 0 and inComment:
-                    inComment = False
-            elif ch == '[':
-                # expression start?
-                if not inComment:
-
-                    if OCV.stdexpr:
-                        ch = '('
-
-                    braket += 1
-
-                    if braket == 1:
-                        if cmd:
-                            out.append(cmd)
-                            cmd = ""
-                    else:
-                        expr += ch
-                else:
-                    OCV.comment += ch
-
-            elif ch == ']':
-                # expression end?
-                if not inComment:
-
-                    if OCV.stdexpr:
-                        ch = ')'
-                    braket -= 1
-
-                    if braket == 0:
-                        try:
-                            out.append(compile(expr, "", "eval"))
-                        except Exception:
-                            # FIXME show the error!!!!
-                            pass
-                        # out.append("<<"+expr+">>")
-                        expr = ""
-                    else:
-                        expr += ch
-
-                else:
-                    OCV.comment += ch
-
-            elif ch == '=':
-                # check for assignments (FIXME very bad)
-                if not out and braket == 0 and paren == 0:
-                    for i in " ()-+*/^$":
-                        if i in cmd:
-                            cmd += ch
-                            break
-                    else:
-                        try:
-                            return compile(line, "", "exec")
-                        except Exception:
-                            # FIXME show the error!!!!
-                            return None
-            elif ch == ';':
-                # Skip everything after the semicolon on normal lines
-                if not inComment and paren == 0 and braket == 0:
-                    OCV.comment += line[i+1:]
-                    break
-                else:
-                    expr += ch
-
-            elif braket > 0:
-                expr += ch
-
-            elif not inComment:
-                if ch == ' ':
-                    if space:
-                        cmd += ch
-                else:
-                    cmd += ch
-
-            elif inComment:
-                OCV.comment += ch
-
-        if cmd:
-            out.append(cmd)
-
-        # return output commands
-        if len(out) == 0:
-            return None
-        if len(out) > 1:
-            return out
-        return out[0]
+        return ParseCache.compile_line(line, space)
 
     @staticmethod
     def breakLine(line):
         """Break line into commands"""
         if line is None:
             return None
-        # Insert space before each command
-        line = OCV.RE_CMD.sub(r" \1", line).lstrip()
-        return line.split()
+        # the words are cached as a tuple, callers append to the list
+        return list(ParseCache.break_line(line))
 
     def motionStart(self, cmds):
         """extract informations from a block of commands
@@ -802,12 +863,17 @@ class CNC(object):
          and some deltas for (X, Y, Z)
         """
         # print "\n<<<",cmds
+        if not isinstance(cmds, tuple):
+            cmds = tuple(cmds)
+        self.motionStartPairs(ParseCache.word_values(cmds))
+
+    def motionStartPairs(self, pairs):
+        """as motionStart using the (letter, value) pairs
+        returned by ParseCache.word_values
+        """
         self.mval = 0  # reset m command
-        for cmd in cmds:
-            c = cmd[0].upper()
-            try:
-                value = float(cmd[1:])
-            except Exception:
+        for c, value in pairs:
+            if value is None:
                 value = 0
 
             if c == "X":
@@ -998,6 +1064,143 @@ class CNC(object):
         return xc,yc,zc
         """
 
+    def motionArc(self):
+        """@return the parameters of the current G2/G3 arc
+        (plane, uc, vc, r, phi0, phi1, df, w0, ws, start, end)
+        as used by arcPoints, u, v are the plane coordinates and w the
+        helical axis, phi1 is already adjusted for the direction and df is
+        the signed angle step
+        """
+        uc, vc = self.motionCenter()
+
+        gcode = self.gcode
+        if self.plane == OCV.CNC_XY:
+            u0 = self.x
+            v0 = self.y
+            w0 = self.z
+            u1 = self.xval
+            v1 = self.yval
+            w1 = self.zval
+        elif self.plane == OCV.CNC_XZ:
+            u0 = self.x
+            v0 = self.z
+            w0 = self.y
+            u1 = self.xval
+            v1 = self.zval
+            w1 = self.yval
+            gcode = 5-gcode    # flip 2-3 when XZ plane is used
+        else:
+            u0 = self.y
+            v0 = self.z
+            w0 = self.x
+            u1 = self.yval
+            v1 = self.zval
+            w1 = self.xval
+        phi0 = math.atan2(v0-vc, u0-uc)
+        phi1 = math.atan2(v1-vc, u1-uc)
+        try:
+            sagitta = 1.0-OCV.accuracy/self.rval
+        except ZeroDivisionError:
+            sagitta = 0.0
+        if sagitta > 0.0:
+            df = 2.0*math.acos(sagitta)
+            df = min(df, math.pi/4.0)
+        else:
+            df = math.pi/4.0
+
+        if gcode == 2:
+            if phi1 >= phi0-1e-10:
+                phi1 -= 2.0 * math.pi
+            df = -df
+        else:
+            if phi1 <= phi0+1e-10:
+                phi1 += 2.0 * math.pi
+
+        ws = (w1-w0)/(phi1-phi0)
+
+        return (self.plane, uc, vc, self.rval, phi0, phi1, df, w0, ws,
+                (self.x, self.y, self.z), (self.xval, self.yval, self.zval))
+
+    @staticmethod
+    def arcPoints(arc):
+        """@return the list of (x, y, z) points of an arc
+        from start to end see motionArc
+        """
+        plane, uc, vc, r, phi0, phi1, df, w0, ws, start, end = arc
+        xyz = [start]
+        phi = phi0 + df
+        while (phi - phi1)*df < 0.0:
+            u = uc + r*math.cos(phi)
+            v = vc + r*math.sin(phi)
+            w = w0 + (phi-phi0)*ws
+            phi += df
+            if plane == OCV.CNC_XY:
+                xyz.append((u, v, w))
+            elif plane == OCV.CNC_XZ:
+                xyz.append((u, w, v))
+            else:
+                xyz.append((w, u, v))
+        xyz.append(end)
+        return xyz
+
+    @staticmethod
+    def arcPointsBatch(arcs):
+        """Expand many arcs at once, numpy is required
+        @return points (n, 3) array and offsets, the points of arc i,
+            start and end included, are points[offset[i]:offset[i+1]]
+        """
+        count = len(arcs)
+        plane = np.array([arc[0] for arc in arcs])
+        par = np.array([arc[1:9] for arc in arcs], dtype=np.float64)
+        par = par.reshape(count, 8)
+        uc, vc, r, phi0, phi1, df, w0, ws = par.T
+
+        # the arcs are grouped by the power of 2 above their number of
+        # steps, each group is a table of a row per arc, its angles are
+        # summed along the rows as the loop of arcPoints, so that the
+        # points and their number are the same
+        upper = np.ceil((phi1 - phi0) / df).astype(np.int64) + 1
+        group = np.ceil(np.log2(upper)).astype(np.int64)
+        steps = np.zeros(count, dtype=np.int64)
+        parts = []
+
+        for size in np.unique(group).tolist():
+            ids = np.flatnonzero(group == size)
+            phi = np.empty((len(ids), 1 << size), dtype=np.float64)
+            phi[:] = df[ids, None]
+            phi[:, 0] += phi0[ids]
+            np.cumsum(phi, axis=1, out=phi)
+            # the angles are monotone, the ones before phi1 are the first
+            inside = (phi - phi1[ids, None]) * df[ids, None] < 0.0
+            steps[ids] = inside.sum(axis=1)
+            row, k = np.nonzero(inside)
+            parts.append((ids[row], k, phi[row, k]))
+
+        offset = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(steps + 2, out=offset[1:])
+        points = np.empty((offset[-1], 3), dtype=np.float64)
+        points[offset[:-1]] = [arc[9] for arc in arcs]
+        points[offset[1:] - 1] = [arc[10] for arc in arcs]
+
+        if offset[-1] > 2 * count:
+            aid = np.concatenate([part[0] for part in parts])
+            k = np.concatenate([part[1] for part in parts])
+            # the k-th angle of an arc is its point offset + k + 1
+            dest = offset[aid] + k + 1
+            phi = np.concatenate([part[2] for part in parts])
+            u = uc[aid] + r[aid] * np.cos(phi)
+            v = vc[aid] + r[aid] * np.sin(phi)
+            w = w0[aid] + (phi - phi0[aid]) * ws[aid]
+
+            pl = plane[aid]
+            xy = pl == OCV.CNC_XY
+            xz = pl == OCV.CNC_XZ
+            points[dest, 0] = np.where(xy | xz, u, w)
+            points[dest, 1] = np.where(xy, v, np.where(xz, w, u))
+            points[dest, 2] = np.where(xy, w, v)
+
+        return points, offset
+
     def motionPath(self):
         """Create path for one g command"""
         xyz = []
@@ -1011,82 +1214,7 @@ class CNC(object):
                 xyz.append((self.xval, self.yval, self.zval))
 
         elif self.gcode in (2, 3):    # CW=2,CCW=3 circle
-            xyz.append((self.x, self.y, self.z))
-            uc, vc = self.motionCenter()
-
-            gcode = self.gcode
-            if self.plane == OCV.CNC_XY:
-                u0 = self.x
-                v0 = self.y
-                w0 = self.z
-                u1 = self.xval
-                v1 = self.yval
-                w1 = self.zval
-            elif self.plane == OCV.CNC_XZ:
-                u0 = self.x
-                v0 = self.z
-                w0 = self.y
-                u1 = self.xval
-                v1 = self.zval
-                w1 = self.yval
-                gcode = 5-gcode    # flip 2-3 when XZ plane is used
-            else:
-                u0 = self.y
-                v0 = self.z
-                w0 = self.x
-                u1 = self.yval
-                v1 = self.zval
-                w1 = self.xval
-            phi0 = math.atan2(v0-vc, u0-uc)
-            phi1 = math.atan2(v1-vc, u1-uc)
-            try:
-                sagitta = 1.0-OCV.accuracy/self.rval
-            except ZeroDivisionError:
-                sagitta = 0.0
-            if sagitta > 0.0:
-                df = 2.0*math.acos(sagitta)
-                df = min(df, math.pi/4.0)
-            else:
-                df = math.pi/4.0
-
-            if gcode == 2:
-                if phi1 >= phi0-1e-10:
-                    phi1 -= 2.0 * math.pi
-                ws = (w1-w0)/(phi1-phi0)
-                phi = phi0 - df
-
-                while phi > phi1:
-                    u = uc + self.rval*math.cos(phi)
-                    v = vc + self.rval*math.sin(phi)
-                    w = w0 + (phi-phi0)*ws
-                    phi -= df
-                    if self.plane == OCV.CNC_XY:
-                        xyz.append((u, v, w))
-                    elif self.plane == OCV.CNC_XZ:
-                        xyz.append((u, w, v))
-                    else:
-                        xyz.append((w, u, v))
-            else:
-                if phi1 <= phi0+1e-10:
-                    phi1 += 2.0 * math.pi
-
-                ws = (w1-w0)/(phi1-phi0)
-                phi = phi0 + df
-
-                while phi < phi1:
-                    u = uc + self.rval*math.cos(phi)
-                    v = vc + self.rval*math.sin(phi)
-                    w = w0 + (phi-phi0)*ws
-                    phi += df
-
-                    if self.plane == OCV.CNC_XY:
-                        xyz.append((u, v, w))
-                    elif self.plane == OCV.CNC_XZ:
-                        xyz.append((u, w, v))
-                    else:
-                        xyz.append((w, u, v))
-
-            xyz.append((self.xval, self.yval, self.zval))
+            xyz = CNC.arcPoints(self.motionArc())
 
         elif self.gcode == 4:  # Dwell
             self.totalTime = self.pval
@@ -1202,6 +1330,81 @@ class CNC(object):
             self.dy = 0
             self.dz = drill - retract
 
+    def motionBlock(self, block, parse=None):
+        """Interpret all the lines of a block
+        the modal state is updated line by line as motionStart,
+        motionPath and motionEnd do
+        @param parse function(line) returning the (letter, value) pairs
+            or None for the lines that have no record (REC_OTHER)
+        @return BlockMotion with the paths of the block
+        """
+        motion = BlockMotion()
+
+        for lid, (line, kind, pairs) in enumerate(block.iter_records()):
+
+            if kind == block.REC_OTHER:
+                if parse is None:
+                    continue
+                pairs = parse(line)
+
+            if pairs is None:
+                continue
+
+            self.motionStartPairs(pairs)
+            gcode = self.gcode
+
+            if gcode in (2, 3):
+                arc = self.motionArc()
+                self.motionEnd()
+                motion.add_arc(
+                    lid, gcode, self.feed, OCV.CD["feedmode"], arc,
+                    (self.x, self.y, self.z))
+            else:
+                xyz = self.motionPath()
+
+                if gcode == 4:
+                    motion.dwell = len(motion.lid)
+                    motion.dwell_time = self.pval
+
+                self.motionEnd()
+
+                if xyz:
+                    motion.add(
+                        lid, gcode, self.feed, OCV.CD["feedmode"], xyz,
+                        (self.x, self.y, self.z))
+
+            if motion.start is None and gcode in (1, 2, 3):
+                motion.start = (self.x, self.y, self.z)
+
+        motion.finish()
+        return motion
+
+    def motionModal(self, block):
+        """Update the modal state over the lines of block as motionBlock
+        does, without computing the arc paths and the BlockMotion.
+        The lines without record (REC_OTHER) are skipped, see BlockPool
+        """
+        for line, kind, pairs in block.iter_records():
+            if pairs is None:
+                continue
+
+            self.motionStartPairs(pairs)
+
+            if self.gcode not in (2, 3):
+                # canned cycles change the modal state
+                self.motionPath()
+
+            self.motionEnd()
+
+    def modalState(self):
+        """@return a picklable snapshot of the modal state"""
+        return dict(self.__dict__), OCV.unit, OCV.CD["feedmode"]
+
+    def setModalState(self, state):
+        """Restore the modal state of modalState()"""
+        values, OCV.unit, OCV.CD["feedmode"] = state
+        self.__dict__.update(values)
+
     def pathLength(self, block, xyz):
         """Calculate Path Length"""
         # FIXME: Doesn't work correctly for G83 (peck drilling)
@@ -18,6 +18,8 @@ from __future__ import print_function
 import sys
 import math
 import time
+from array import array
+from bisect import bisect_right
 import bmath
 try:
     import Tkinter as Tk
@@ -26,6 +28,11 @@ except ImportError:
 
 import OCV
 from CNC import CNC
+import BlockPool
+import ParseCache
+import PathIndex
+import PathLOD
+import PathRaster
 import Commands as cmd
 import IniFile
 import Utils
@@ -84,6 +91,10 @@ ALT_MASK = 8
 CONTROLSHIFT_MASK = SHIFT_MASK | CONTROL_MASK
 CLOSE_DISTANCE = 5
 MAXDIST = 10000
+# maximum points of the polylines of the merged paths
+MERGE_POINTS = 500
+# ms after the last zoom in to draw the paths with more detail
+LOD_DELAY = 500
 ZOOM = 1.25
 
 S60 = math.sin(math.radians(60))
@@ -129,6 +140,99 @@ class AlarmException(Exception):
     pass
 
 
+class PathSpan(object):
+    """Consecutive lines of a block drawn by drawPaths as a single polyline
+    item, the segment of the line lid[k] starts at the point point[k] of
+    the polyline and ends at the start of the next one
+    """
+
+    __slots__ = ("bid", "rapid", "lid", "point", "coords")
+
+    def __init__(self, bid, lid, rapid, coords):
+        self.bid = bid
+        self.rapid = rapid
+        self.lid = array("i", (lid,))
+        self.point = array("i", (0,))
+        # (x, y, z) points of the polyline, only while it is drawn
+        self.coords = coords
+
+    def add(self, lid, coords):
+        """Append the coords of line lid, starting at the last point"""
+        self.lid.append(lid)
+        self.point.append(len(self.coords) - 1)
+        self.coords.extend(coords[1:])
+
+    def simplify(self, keep):
+        """Move the starts of the lines to the points kept, the indexes
+        returned by PathLOD.simplify
+        """
+        for k, point in enumerate(self.point):
+            self.point[k] = bisect_right(keep, point) - 1
+
+    def line(self, point):
+        """@return the lid of the segment starting at point"""
+        return self.lid[max(bisect_right(self.point, point) - 1, 0)]
+
+    def bounds(self, lid, points):
+        """@return first and last point of line lid in the polyline of
+        points points
+        """
+        k = max(bisect_right(self.lid, lid) - 1, 0)
+        start = self.point[k]
+
+        if k + 1 < len(self.point):
+            end = self.point[k + 1]
+        else:
+            end = points - 1
+
+        # a line shorter than the simplification
+        if start == end:
+            if end < points - 1:
+                end += 1
+            else:
+                start -= 1
+
+        return start, end
+
+
+class DrawnBlock(object):
+    """A block drawn by drawPaths, its items are kept by the next draw if
+    the block is not dirty and the drawing starts from the same state
+    """
+
+    __slots__ = ("block", "bid", "start", "end", "length", "time", "dwell",
+                 "reduced", "segments")
+
+    def __init__(self, block, bid, start):
+        self.block = block
+        self.bid = bid
+        # drawState at the start and at the end of the block
+        self.start = start
+        self.end = None
+        # totals added to CNC, time is the total after a dwell
+        self.length = 0.0
+        self.time = 0.0
+        self.dwell = False
+        # points not drawn by PathLOD
+        self.reduced = 0
+        # PathIndex.segments of the lines
+        self.segments = None
+
+
+def segmentDistance(x, y, x1, y1, x2, y2):
+    """@return the square of the distance of x, y from a segment"""
+    dx = x2 - x1
+    dy = y2 - y1
+    length = dx * dx + dy * dy
+
+    if length > 0.0:
+        t = max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / length))
+        x1 += t * dx
+        y1 += t * dy
+
+    return (x - x1) ** 2 + (y - y1) ** 2
+
+
 class CNCCanvas(Tk.Canvas, object):
     """Drawing canvas"""
 
@@ -201,6 +305,29 @@ class CNCCanvas(Tk.Canvas, object):
         self.zoom = 1.0
         self.__tzoom = 1.0  # delayed zoom (temporary)
         self._items = {}
+        # merged paths: item -> PathSpan
+        self._spans = {}
+        # zoom bucket of the paths drawn and points not drawn
+        self._lodBucket = None
+        self._lodReduced = 0
+        self._lodAfter = None
+        # raster backend, segments and image item of the paths
+        self.raster = None
+        self._rasterItem = None
+        self._rasterImage = None
+        # polyline being merged by drawPaths and its item
+        self._merge = None
+        self._mergeItem = None
+        # overlays of the lines executed, polyline item -> overlay
+        self._process = {}
+        # blocks drawn, id(block) -> DrawnBlock, and the settings used
+        self._drawn = {}
+        self._drawnKey = None
+        # spatial index of the paths, built when used, and the points of
+        # the lines of the block drawn
+        self._index = None
+        self._indexPoints = []
+        self._indexLines = []
 
         self._x = self._y = 0
         self._xp = self._yp = 0
@@ -253,6 +380,8 @@ class CNCCanvas(Tk.Canvas, object):
         self.draw_workarea = True
         self.draw_paths = True
         self.draw_rapid = True  # draw rapid motions
+        self.draw_merge = True  # merge consecutive moves in polylines
+        self.draw_raster = False  # draw the paths in an image
         self._wx = self._wy = self._wz = 0.0  # work position
         self._dx = self._dy = self._dz = 0.0  # work-machine position
 
@@ -625,50 +754,73 @@ class CNCCanvas(Tk.Canvas, object):
                 ACTION_SELECT_AREA):
 
             if self._mouseAction == ACTION_SELECT_AREA:
-                # if event.state & SHIFT_MASK == 0:
-                if self._x < event.x:  # From left->right enclosed
-                    closest = self.find_enclosed(
-                        self.canvasx(self._x),
-                        self.canvasy(self._y),
-                        self.canvasx(event.x),
-                        self.canvasy(event.y))
-                else:  # From right->left overlapping
-                    closest = self.find_overlapping(
-                        self.canvasx(self._x),
+                area = (self.canvasx(self._x),
                         self.canvasy(self._y),
                         self.canvasx(event.x),
                         self.canvasy(event.y))
+                # if event.state & SHIFT_MASK == 0:
+                enclosed = self._x < event.x
+                index = self.pathIndex()
 
                 self.delete(self._select)
                 self._select = None
                 items = []
 
-                for i in closest:
-                    try:
-                        items.append(self._items[i])
-                    except:
-                        pass
+                if index is not None:
+                    items.extend(index.area(
+                        area[0] / self.zoom, area[1] / self.zoom,
+                        area[2] / self.zoom, area[3] / self.zoom,
+                        enclosed))
+
+                else:
+                    if enclosed:  # From left->right enclosed
+                        closest = self.find_enclosed(*area)
+                    else:  # From right->left overlapping
+                        closest = self.find_overlapping(*area)
+
+                    for i in closest:
+                        if i in self._spans:
+                            items.extend(self._areaLines(i, area, enclosed))
+                            continue
+                        try:
+                            items.append(self._items[i])
+                        except:
+                            pass
 
             elif self._mouseAction in (
                     ACTION_SELECT_SINGLE, ACTION_SELECT_DOUBLE):
-                closest = self.find_closest(
-                    self.canvasx(event.x),
-                    self.canvasy(event.y),
-                    CLOSE_DISTANCE)
-
+                cx = self.canvasx(event.x)
+                cy = self.canvasy(event.y)
+                index = self.pathIndex()
                 items = []
 
-                for i in closest:
-                    try:
-                        items.append(self._items[i])
-                        # i = None
-                    except KeyError:
-                        tags = self.gettags(i)
-                        if "Orient" in tags:
-                            self.selectMarker(i)
-                            return
-                        # i = self.find_below(i)
-                        pass
+                if index is not None:
+                    marker = self._orientMarker(cx, cy)
+                    if marker is not None:
+                        self.selectMarker(marker)
+                        return
+
+                    segment = index.nearest(
+                        cx / self.zoom,
+                        cy / self.zoom,
+                        CLOSE_DISTANCE / self.zoom)
+                    if segment is not None:
+                        items.append(index.line(segment))
+
+                else:
+                    closest = self.find_closest(cx, cy, CLOSE_DISTANCE)
+
+                    for i in closest:
+                        try:
+                            items.append(self._nearestLine(i, cx, cy))
+                            # i = None
+                        except KeyError:
+                            tags = self.gettags(i)
+                            if "Orient" in tags:
+                                self.selectMarker(i)
+                                return
+                            # i = self.find_below(i)
+                            pass
 
             if not items:
                 return
@@ -727,31 +879,48 @@ class CNCCanvas(Tk.Canvas, object):
 
         dmin = (CLOSE_DISTANCE*self.zoom)**2
 
-        # ... and if we are closer than 5pixels
-        for item in self.find_closest(cx, cy, CLOSE_DISTANCE):
-            try:
-                bid, lid = self._items[item]
-            except KeyError:
-                continue
+        index = self.pathIndex()
 
-            # Very cheap and inaccurate approach :)
-            coords = self.coords(item)
-            x = coords[0]    # first
-            y = coords[1]    # point
-            d = (cx-x)**2 + (cy-y)**2
-            if d < dmin:
-                dmin = d
-                xs, ys = x, y
-
-            x = coords[-2]    # last
-            y = coords[-1]    # point
-            d = (cx-x)**2 + (cy-y)**2
-            if d < dmin:
-                dmin = d
-                xs, ys = x, y
+        # ... and if we are closer than 5pixels
+        if index is not None:
+            segment = index.nearest(
+                cx / self.zoom, cy / self.zoom, CLOSE_DISTANCE / self.zoom)
+
+            if segment is not None:
+                # first and last point of the line
+                for x, y in index.ends(segment):
+                    x *= self.zoom
+                    y *= self.zoom
+                    d = (cx-x)**2 + (cy-y)**2
+                    if d < dmin:
+                        dmin = d
+                        xs, ys = x, y
 
-            # I need to check the real code and if
-            # an arc check also the center?
+        else:
+            for item in self.find_closest(cx, cy, CLOSE_DISTANCE):
+                try:
+                    bid, lid = self._nearestLine(item, cx, cy)
+                except KeyError:
+                    continue
+
+                # Very cheap and inaccurate approach :)
+                coords = self._lineCoords(item, lid)
+                x = coords[0]    # first
+                y = coords[1]    # point
+                d = (cx-x)**2 + (cy-y)**2
+                if d < dmin:
+                    dmin = d
+                    xs, ys = x, y
+
+                x = coords[-2]    # last
+                y = coords[-1]    # point
+                d = (cx-x)**2 + (cy-y)**2
+                if d < dmin:
+                    dmin = d
+                    xs, ys = x, y
+
+                # I need to check the real code and if
+                # an arc check also the center?
 
         if xs is not None:
             return xs, ys
@@ -772,22 +941,26 @@ class CNCCanvas(Tk.Canvas, object):
         ret = Tk.Canvas.xview(self, *args)
         if args:
             self.cameraPosition()
+            self.rasterUpdate()
         return ret
 
     def yview(self, *args):
         ret = Tk.Canvas.yview(self, *args)
         if args:
             self.cameraPosition()
+            self.rasterUpdate()
         return ret
 
     def configureEvent(self, event):
         self.cameraPosition()
+        self.rasterUpdate()
         self.RefreshItems()
 
     def pan(self, event):
         if self._mouseAction == ACTION_PAN:
             self.scan_dragto(event.x, event.y, gain=1)
             self.cameraPosition()
+            self.rasterUpdate()
             self.RefreshItems()
 
         else:
@@ -881,9 +1054,24 @@ class CNCCanvas(Tk.Canvas, object):
             self._projectProbeImage()
             self.itemconfig(self._probe, image=self._probeTkImage)
 
+        if self.raster is not None:
+            self.raster.project(self.view, self.zoom)
+            self.rasterUpdate()
+
         self.cameraUpdate()
         self.RefreshItems()
 
+        # the paths simplified for a lower zoom
+        if self._lodReduced and PathLOD.bucket(self.zoom) > self._lodBucket:
+            if self._lodAfter is not None:
+                self.after_cancel(self._lodAfter)
+            self._lodAfter = self.after(LOD_DELAY, self._lodRedraw)
+
+    def _lodRedraw(self):
+        """Draw again the paths with the detail of the zoom"""
+        self._lodAfter = None
+        self.event_generate("<<ViewChange>>")
+
     def selBbox(self):
         """Return selected objects bounding box"""
         x1 = None
@@ -996,6 +1184,100 @@ class CNCCanvas(Tk.Canvas, object):
     def mouseZoomOut(self, event):
         self.zoomCanvas(event.x, event.y, 1.0/ZOOM)
 
+    def _orientMarker(self, cx, cy):
+        """@return the orientation marker item at cx, cy, None if there is
+        none
+        """
+        for item in self.find_withtag("Orient"):
+            x1, y1, x2, y2 = self.bbox(item)
+            if x1 - CLOSE_DISTANCE <= cx <= x2 + CLOSE_DISTANCE and \
+                    y1 - CLOSE_DISTANCE <= cy <= y2 + CLOSE_DISTANCE:
+                return item
+
+        return None
+
+    def _nearestLine(self, item, cx, cy):
+        """@return the (bid, lid) of the line drawn by item closest to
+        cx, cy, raise KeyError if item is not a path
+        """
+        span = self._spans.get(item)
+
+        if span is None:
+            return self._items[item]
+
+        coords = self.coords(item)
+        dmin = None
+        point = 0
+
+        for p in range(0, len(coords) - 2, 2):
+            d = segmentDistance(cx, cy, *coords[p:p + 4])
+            if dmin is None or d < dmin:
+                dmin = d
+                point = p // 2
+
+        return span.bid, span.line(point)
+
+    def _areaLines(self, item, area, enclosed):
+        """@return the (bid, lid) of the lines of a merged item inside
+        area, all of them if the item was found enclosed
+        """
+        span = self._spans[item]
+
+        if enclosed:
+            return [(span.bid, lid) for lid in span.lid]
+
+        x1, y1, x2, y2 = area
+        xmin, xmax = min(x1, x2), max(x1, x2)
+        ymin, ymax = min(y1, y2), max(y1, y2)
+        coords = self.coords(item)
+        lines = []
+
+        for p in range(0, len(coords), 2):
+            if xmin <= coords[p] <= xmax and ymin <= coords[p + 1] <= ymax:
+                # the point ends the segment before and starts the next
+                for point in (p // 2 - 1, p // 2):
+                    if point < 0 or point >= len(coords) // 2 - 1:
+                        continue
+                    line = span.bid, span.line(point)
+                    if not lines or lines[-1] != line:
+                        lines.append(line)
+
+        if not lines:
+            # crossed without points inside
+            lines.append(self._nearestLine(
+                item, (xmin + xmax) / 2.0, (ymin + ymax) / 2.0))
+
+        return lines
+
+    def _lineCoords(self, item, lid):
+        """@return the canvas coords of line lid drawn by item"""
+        coords = self.coords(item)
+        span = self._spans.get(item)
+
+        if span is None:
+            return coords
+
+        start, end = span.bounds(lid, len(coords) // 2)
+        return coords[2 * start:2 * end + 2]
+
+    def _segment(self, item, lid, **options):
+        """Draw line lid of a merged item as an item over it, to highlight
+        it alone
+        @return the new item
+        """
+        span = self._spans[item]
+
+        if span.rapid:
+            options["dash"] = (4, 3)
+
+        segment = self.create_line(
+            self._lineCoords(item, lid),
+            tags="segment",
+            **options)
+
+        self._items[segment] = span.bid, lid
+        return segment
+
     def wheel(self, event):
         self.zoomCanvas(event.x, event.y, pow(ZOOM, (event.delta//120)))
 
@@ -1009,12 +1291,43 @@ class CNCCanvas(Tk.Canvas, object):
         block = self.gcode[b]
         item = block.path(i)
 
-        if item is not None and item != self._lastActive:
-            if self._lastActive is not None:
-                self.itemconfig(self._lastActive, arrow=Tk.NONE)
+        if self.raster is not None:
+            self._clearActive()
+            idx = self.raster.lines(b, i)
+            if len(idx):
+                self._lastActive = self._rasterOverlay(
+                    idx,
+                    fill=self.raster.fills[self.raster.color[idx[-1]]],
+                    tags="segment")
+                self.itemconfig(self._lastActive, arrow=Tk.LAST)
+
+        elif item in self._spans:
+            # a line of a polyline, the arrow on a segment over it
+            self._clearActive()
+            self._lastActive = self._segment(
+                item, i,
+                width=self.itemcget(item, "width"),
+                fill=self.itemcget(item, "fill"),
+                arrow=Tk.LAST)
+
+        elif item is not None and item != self._lastActive:
+            self._clearActive()
             self._lastActive = item
             self.itemconfig(self._lastActive, arrow=Tk.LAST)
 
+    def _clearActive(self):
+        """Remove the arrow of the active marker"""
+        if self._lastActive is None:
+            return
+
+        if "segment" in self.gettags(self._lastActive):
+            self._items.pop(self._lastActive, None)
+            self.delete(self._lastActive)
+        else:
+            self.itemconfig(self._lastActive, arrow=Tk.NONE)
+
+        self._lastActive = None
+
     def gantry(self, wx, wy, wz, mx, my, mz):
         """Display gantry"""
         self._lastGantry = (wx, wy, wz)
@@ -1055,9 +1368,11 @@ class CNCCanvas(Tk.Canvas, object):
 
     def clearSelection(self):
         """Clear highlight of selection"""
-        if self._lastActive is not None:
-            self.itemconfig(self._lastActive, arrow=Tk.NONE)
-            self._lastActive = None
+        self._clearActive()
+
+        for i in self.find_withtag("segment"):
+            self._items.pop(i, None)
+        self.delete("segment")
 
         for i in self.find_withtag("sel"):
             bid, lid = self._items[i]
@@ -1087,15 +1402,28 @@ class CNCCanvas(Tk.Canvas, object):
         """Highlight selected items"""
         for b, i in items:
             block = self.gcode[b]
-            if i is None:
+            if self.raster is not None:
+                if i is None:
+                    idx = self.raster.block(b)
+                elif isinstance(i, int):
+                    idx = self.raster.lines(b, i)
+                else:
+                    continue
                 sel = block.enable and "sel" or "sel2"
-                for path in block._path:
+                self._rasterOverlay(idx, tags=(sel, "segment"))
+
+            elif i is None:
+                sel = block.enable and "sel" or "sel2"
+                # the lines of a merged path share its item
+                for path in set(block._path):
                     if path is not None:
                         self.addtag_withtag(sel, path)
                 sel = block.enable and "sel3" or "sel4"
 
             elif isinstance(i, int):
                 path = block.path(i)
+                if path in self._spans:
+                    path = self._segment(path, i)
                 if path:
                     sel = block.enable and "sel" or "sel2"
                     self.addtag_withtag(sel, path)
@@ -1350,9 +1678,22 @@ class CNCCanvas(Tk.Canvas, object):
         if view is not None: self.view = view
 
         self._last = (0., 0., 0.)
-        self.initPosition()
+        key = self._drawKey()
+
+        # draw again only the blocks changed if nothing else did
+        if key == self._drawnKey and not self.draw_raster and \
+                any(not block.dirty and id(block) in self._drawn
+                    for block in OCV.blocks):
+            incremental = True
+            self._merge = None
+            self.cnc.initPath()
+            self.cnc.resetAllMargins()
+        else:
+            incremental = False
+            self.initPosition()
 
-        self.drawPaths()
+        self._drawnKey = key
+        self.drawPaths(incremental)
         self.drawGrid()
         self.drawMargin()
         self.drawWorkarea()
@@ -1373,6 +1714,16 @@ class CNCCanvas(Tk.Canvas, object):
         self._inDraw = False
 
 
+    def _drawKey(self):
+        """@return the settings of the drawing, the blocks drawn are kept
+        only if they are the same
+        """
+        return (self.view, self.zoom, self.draw_paths, self.draw_rapid,
+                self.draw_merge, self.draw_raster, PathLOD.TOLERANCE,
+                OCV.COLOR_ENABLE, OCV.COLOR_DISABLE, OCV.COLOR_CANVAS,
+                OCV.COLOR_GANTRY, OCV.CD["diameter"], OCV.stdexpr,
+                OCV.inch, OCV.accuracy)
+
     def initPosition(self):
         """Initialize gantry position"""
 
@@ -1416,6 +1767,12 @@ class CNCCanvas(Tk.Canvas, object):
         self._select = None
         self._vector = None
         self._items.clear()
+        self._spans.clear()
+        self._process.clear()
+        self._drawn.clear()
+        self._merge = None
+        self._rasterItem = None
+        self._rasterImage = None
         self.cnc.initPath()
         self.cnc.resetAllMargins()
         self.RefreshItems()
@@ -2038,22 +2395,44 @@ class CNCCanvas(Tk.Canvas, object):
         return x, y
 
 
-    def drawPaths(self):
+    def drawPaths(self, incremental=False):
         """
             Draw the paths for the whole gcode file
+            if incremental the items of the blocks not changed, drawn
+            from the same state, are kept
         """
 
+        self.raster = None
+        self._index = None
+
         if not self.draw_paths:
             for block in OCV.blocks:
                 block.resetPath()
             return
 
+        self._lodBucket = PathLOD.bucket(self.zoom)
+        self._lodReduced = 0
+
+        if self.draw_raster and PathRaster.usable():
+            self.raster = PathRaster.PathRaster(MAXDIST)
+
+        drawn = {}
+        record = None
+
         try:
             n = 1
             startTime = before = time.time()
             self.cnc.resetAllMargins()
             drawG = self.draw_rapid or self.draw_paths or self.draw_margin
             bid = OCV.TK_EDITOR.getSelectedBlocks()
+            states = []
+
+            if drawG and not incremental and BlockPool.usable(OCV.blocks):
+                # motions of the blocks computed on all the CPU cores
+                motions = BlockPool.compile_blocks(
+                    OCV.blocks, self.cnc, self.parseLine, states)
+            else:
+                motions = None
 
             for i, block in enumerate(OCV.blocks):
 
@@ -2062,11 +2441,52 @@ class CNCCanvas(Tk.Canvas, object):
                 else:
                     selected = False
 
-                start = True    # start location found
+                if not drawG:
+                    block.resetPath()
+                    for line in block:
+                        block.addPath(None)
+                    continue
+
+                if motions is not None:
+                    start = self._drawState(states[i])
+                else:
+                    start = self._drawState(self.cnc.modalState())
+
+                if record is not None:
+                    record.end = start
+
+                if incremental:
+                    record = self._drawn.get(id(block))
+
+                    if self._drawnBlock(block, record, start):
+                        self._keepBlock(block, i, record)
+                        drawn[id(block)] = record
+                        continue
+
+                    self._deleteBlock(block)
+
+                record = None
                 block.resetPath()
+                del self._indexPoints[:]
+                del self._indexLines[:]
+
+                # all the motions of the block in one pass
+                if motions is not None:
+                    motion, end = motions[i]
+                else:
+                    motion = self.cnc.motionBlock(block, self.parseLine)
+                    end = self.cnc.x, self.cnc.y, self.cnc.z
+
+                length = self.cnc.totalLength
+                total = self.cnc.totalTime
+                reduced = self._lodReduced
+                motion.apply(block, self.cnc)
+                k = 0
+                merge = self.draw_merge
+                raster = self.raster is not None
 
                 # Draw block
-                for j, line in enumerate(block):
+                for j in range(len(block)):
                     n -= 1
                     if n == 0:
                         if time.time() - startTime > OCV.DRAW_TIME:
@@ -2076,88 +2496,430 @@ class CNCCanvas(Tk.Canvas, object):
                             self.update()
                             before = time.time()
                         n = 1000
-                    try:
-                        cmd = self.gcode.evaluate(CNC.compileLine(line))
 
-                        if isinstance(cmd, tuple):
-                            cmd = None
+                    if k < len(motion) and motion.lid[k] == j:
+                        if raster:
+                            path = self.rasterPath(block, i, j, motion, k)
+                        elif merge:
+                            path = self.mergePath(block, i, j, motion, k)
                         else:
-                            cmd = CNC.breakLine(cmd)
+                            path = self.drawPath(block, motion, k)
+                            self._items[path] = i, j
+                        block.addPath(path)
+                        k += 1
+                    else:
+                        block.addPath(None)
 
-                    except AlarmException:
-                        raise
-                    except:
-                        sys.stderr.write(_(">>> ERROR: {0}\n").format(
-                            str(sys.exc_info()[1])))
+                self._endMerge()
 
-                        sys.stderr.write(_("     line: {0}\n").format(line))
-                        cmd = None
+                if motion.start is not None:
+                    # Mark as start the first non-rapid motion
+                    block.startPath(*motion.start)
+                block.endPath(*end)
 
-                    if cmd is None or not drawG:
-                        block.addPath(None)
-                    else:
-                        path = self.drawPath(block, cmd)
-                        self._items[path] = i, j
-                        block.addPath(path)
-                        if start and self.cnc.gcode in (1, 2, 3):
-                            # Mark as start the first non-rapid motion
-                            block.startPath(self.cnc.x, self.cnc.y, self.cnc.z)
-                            start = False
-                block.endPath(self.cnc.x, self.cnc.y, self.cnc.z)
+                record = DrawnBlock(block, i, start)
+                record.length = self.cnc.totalLength - length
+                record.dwell = motion.dwell is not None
+
+                if record.dwell:
+                    record.time = self.cnc.totalTime
+                else:
+                    record.time = self.cnc.totalTime - total
+
+                record.reduced = self._lodReduced - reduced
+
+                if not raster and PathIndex.usable():
+                    record.segments = PathIndex.segments(
+                        self._indexPoints, self._indexLines)
+
+                drawn[id(block)] = record
+                block.dirty = False
+
+            if record is not None:
+                record.end = self._drawState(self.cnc.modalState())
 
         except AlarmException:
+            self._endMerge()
             self.status("Rendering takes TOO Long. Interrupted...")
 
+        if self.raster is not None:
+            self._endRaster()
+            return
+
+        # the blocks removed or not drawn
+        for key, old in self._drawn.items():
+            if key not in drawn:
+                self._deleteBlock(old.block)
 
-    def drawPath(self, block, cmds):
-        """Create path for one g command
+        self._drawn = drawn
+
+    def _drawState(self, state):
+        """@return the CNC.modalState, without the totals, and the last
+        point drawn, the state drawPaths starts a block from
+        """
+        values, unit, feedmode = state
+        values = dict(values)
+        del values["totalLength"]
+        del values["totalTime"]
+        return values, unit, feedmode, self._last
+
+    def _drawnBlock(self, block, record, start):
+        """@return True if the items of the block drawn in record can be
+        kept, drawn from start
+        """
+        return record is not None and \
+            not block.dirty and \
+            record.start == start and \
+            len(block._path) == len(block) and \
+            not block.has_other()
+
+    def _keepBlock(self, block, bid, record):
+        """Keep the items of the block, now at index bid, and move the
+        CNC to its end as if drawn again
         """
+        values, unit, feedmode, self._last = record.end
+        self.cnc.setModalState((values, unit, feedmode))
+        self.cnc.totalLength += record.length
 
-        self.cnc.motionStart(cmds)
-        xyz = self.cnc.motionPath()
-        self.cnc.motionEnd()
-        if xyz:
-            self.cnc.pathLength(block, xyz)
-            if self.cnc.gcode in (1, 2, 3):
-                block.pathMargins(xyz)
-                self.cnc.pathMargins(block)
-            if block.enable:
-                if self.cnc.gcode == 0 and self.draw_rapid:
-                    xyz[0] = self._last
-                self._last = xyz[-1]
-            else:
-                if self.cnc.gcode == 0:
-                    return None
-            coords = self.plotCoords(xyz)
-            if coords:
-                if block.enable:
-                    if block.color:
-                        fill = block.color
-                    else:
-                        fill = OCV.COLOR_ENABLE
-                else:
-                    fill = OCV.COLOR_DISABLE
+        if record.dwell:
+            self.cnc.totalTime = record.time
+        else:
+            self.cnc.totalTime += record.time
 
-                if self.cnc.gcode == 0:
+        self._lodReduced += record.reduced
+
+        if block.xmin <= block.xmax:
+            self.cnc.pathMargins(block)
+
+        if record.bid == bid:
+            return
+
+        record.bid = bid
+
+        for path in set(block._path):
+            if path in self._items:
+                self._items[path] = bid, self._items[path][1]
+
+            span = self._spans.get(path)
+
+            if span is not None:
+                span.bid = bid
+
+    def _deleteBlock(self, block):
+        """Delete the items drawn for the block"""
+        items = set(block._path)
+        items.discard(None)
+
+        for path in list(items):
+            self._items.pop(path, None)
+            self._spans.pop(path, None)
+            overlay = self._process.pop(path, None)
+
+            if overlay is not None:
+                self._spans.pop(overlay, None)
+                items.add(overlay)
+
+        if items:
+            self.delete(*items)
+
+    def parseLine(self, line):
+        """@return the (letter, value) pairs of a line with expressions
+        for CNC.motionBlock, the expressions are evaluated every time
+        """
+        try:
+            cmd = self.gcode.evaluate(CNC.compileLine(line))
 
-                    if self.draw_rapid:
+            if isinstance(cmd, tuple):
+                return None
 
-                        return self.create_line(
-                            coords,
-                            fill=fill,
-                            width=0,
-                            dash=(4, 3))
+            cmd = CNC.breakLine(cmd)
+
+            if cmd is None:
+                return None
+
+            return ParseCache.word_values(tuple(cmd))
+
+        except AlarmException:
+            raise
+        except:
+            sys.stderr.write(_(">>> ERROR: {0}\n").format(
+                str(sys.exc_info()[1])))
+
+            sys.stderr.write(_("     line: {0}\n").format(line))
+            return None
+
+    def drawPath(self, block, motion, k):
+        """Create path for motion k of the block
+        motion is the BlockMotion returned by CNC.motionBlock
+        """
+        xyz = self._pathPoints(block, motion, k)
+
+        if xyz is None:
+            return None
+
+        keep = PathLOD.simplify(xyz, self.zoom)
+
+        if keep is not None:
+            self._lodReduced += len(xyz) - len(keep)
+            xyz = [xyz[i] for i in keep]
+
+        self._indexPath(motion.lid[k], xyz)
+        coords = self.plotCoords(xyz)
+
+        if not coords:
+            return None
+
+        return self._createPath(
+            coords, self._pathFill(block), motion.gcode[k] == 0)
+
+    def mergePath(self, block, bid, lid, motion, k):
+        """Add motion k of the block to the polyline of the previous ones
+        if it is of the same kind and starts at its end, or start a new
+        polyline
+        @return the item of the polyline
+        """
+        xyz = self._pathPoints(block, motion, k)
+
+        if xyz is None:
+            return None
+
+        rapid = motion.gcode[k] == 0
+        span = self._merge
+
+        self._indexPath(lid, xyz)
+
+        if span is not None and span.rapid == rapid and \
+                span.coords[-1] == xyz[0] and \
+                len(span.coords) < MERGE_POINTS:
+            span.add(lid, xyz)
+            return self._mergeItem
+
+        self._endMerge()
+        coords = self.plotCoords(xyz)
+
+        if not coords:
+            return None
 
-                elif self.draw_paths:
+        path = self._createPath(coords, self._pathFill(block), rapid)
+        self._items[path] = bid, lid
 
-                    return self.create_line(
-                        coords,
-                        fill=fill,
-                        width=0,
-                        cap="projecting")
+        if len(coords) > 1:
+            self._merge = PathSpan(bid, lid, rapid, xyz)
+            self._mergeItem = path
+            self._spans[path] = self._merge
+
+        return path
+
+    def _indexPath(self, lid, xyz):
+        """Add the points of line lid to the ones of the block drawn"""
+        self._indexLines.append((lid, len(xyz)))
+        self._indexPoints.extend(xyz)
+
+    def pathIndex(self):
+        """@return the PathIndex of the paths drawn, built at the first
+        use after drawPaths, None without numpy
+        """
+        if self._index is not None or not PathIndex.usable():
+            return self._index
+
+        if self.raster is not None:
+            if self.raster.keys is None:
+                return None
+            p0, p1, keys = self.raster.p0, self.raster.p1, self.raster.keys
+        else:
+            p0, p1, keys = PathIndex.join([
+                (record.bid, record.segments)
+                for record in sorted(
+                    self._drawn.values(), key=lambda record: record.bid)
+                if record.segments is not None])
+
+        self._index = PathIndex.PathIndex(p0, p1, keys, self.view)
+        return self._index
+
+    def rasterPath(self, block, bid, lid, motion, k):
+        """Add motion k of the block to the segments of the raster
+        @return None, the line has no item
+        """
+        xyz = self._pathPoints(block, motion, k)
+
+        if xyz is not None:
+            self.raster.add(
+                bid, lid, xyz, self._pathFill(block), motion.gcode[k] == 0)
 
         return None
 
+    def _endRaster(self):
+        """Create the image item of the raster paths"""
+        self.raster.finish(
+            lambda fill: [c >> 8 for c in self.winfo_rgb(fill)])
+        self.raster.project(self.view, self.zoom)
+
+        if self.raster.bounds is None:
+            return
+
+        # the extent of the paths, for the scroll region and fit
+        self.create_rectangle(self.raster.bounds, outline="", fill="")
+        self._rasterItem = self.create_image(0, 0, anchor=Tk.NW)
+        self.rasterUpdate()
+
+    def rasterUpdate(self):
+        """Draw the raster paths in the visible part of the canvas"""
+        if self.raster is None or self._rasterItem is None:
+            return
+
+        visible = (self.canvasx(0), self.canvasy(0),
+                   self.canvasx(self.winfo_width()),
+                   self.canvasy(self.winfo_height()))
+        self.raster.visible = visible
+
+        if not self.raster.render(*visible):
+            if self.raster.drawn is None:
+                # nothing visible, as after a zoom far from the paths
+                self.itemconfig(self._rasterItem, image="")
+            return
+
+        image, x, y = self.raster.picture()
+        self._rasterImage = ImageTk.PhotoImage(image)
+        self.coords(self._rasterItem, x, y)
+        self.itemconfig(self._rasterItem, image=self._rasterImage)
+
+    def _rasterOverlay(self, idx, **options):
+        """Draw the raster segments idx as polylines over the image
+        @return the last item created
+        """
+        item = None
+
+        for coords in self.raster.polylines(idx):
+            item = self.create_line(coords, **options)
+
+        return item
+
+    def _endMerge(self):
+        """Set the points of the polyline merged, simplified for the zoom"""
+        span = self._merge
+
+        if span is None:
+            return
+
+        xyz = span.coords
+        keep = PathLOD.simplify(xyz, self.zoom)
+
+        if keep is not None:
+            self._lodReduced += len(xyz) - len(keep)
+            span.simplify(keep)
+            xyz = [xyz[i] for i in keep]
+
+        if keep is not None or len(span.lid) > 1:
+            self.coords(
+                self._mergeItem, Tk._flatten(self.plotCoords(xyz)))
+
+        span.coords = None
+        self._merge = None
+
+    def _pathPoints(self, block, motion, k):
+        """@return the (x, y, z) points of motion k of the block, None if
+        it is not drawn
+        """
+        gcode = motion.gcode[k]
+        xyz = motion.path(k)
+
+        if block.enable:
+            if gcode == 0 and self.draw_rapid:
+                xyz[0] = self._last
+            self._last = xyz[-1]
+        else:
+            if gcode == 0:
+                return None
+
+        if gcode == 0:
+            if not self.draw_rapid:
+                return None
+        elif not self.draw_paths:
+            return None
+
+        return xyz
+
+    def _pathFill(self, block):
+        """@return the color of the paths of the block"""
+        if not block.enable:
+            return OCV.COLOR_DISABLE
+
+        if block.color:
+            return block.color
+
+        return OCV.COLOR_ENABLE
+
+    def _createPath(self, coords, fill, rapid):
+        """@return the item of a path"""
+        if rapid:
+            return self.create_line(
+                coords,
+                fill=fill,
+                width=0,
+                dash=(4, 3))
+
+        return self.create_line(
+            coords,
+            fill=fill,
+            width=0,
+            cap="projecting")
+
+    def processPaths(self, paths):
+        """Highlight the paths of the (bid, lid) lines executed by a run,
+        the part executed of a merged path with an item over it
+        """
+        if self.raster is not None:
+            if paths:
+                idx = [self.raster.lines(bid, lid) for bid, lid in paths]
+                self._rasterOverlay(
+                    numpy.concatenate(idx),
+                    width=2,
+                    fill=OCV.COLOR_PROCESS,
+                    tags="process")
+            return
+
+        ends = {}
+
+        for bid, lid in paths:
+            path = self.gcode[bid].path(lid)
+
+            if path in self._spans:
+                ends[path] = lid
+            elif path:
+                self.itemconfig(
+                    path,
+                    width=2,
+                    fill=OCV.COLOR_PROCESS)
+
+        for path, lid in ends.items():
+            span = self._spans[path]
+            coords = self.coords(path)
+            end = span.bounds(lid, len(coords) // 2)[1]
+            coords = coords[:2 * end + 2]
+            overlay = self._process.get(path)
+
+            if overlay is None:
+                overlay = self.create_line(
+                    coords,
+                    width=2,
+                    fill=OCV.COLOR_PROCESS,
+                    tags="process")
+                if span.rapid:
+                    self.itemconfig(overlay, dash=(4, 3))
+                self._process[path] = overlay
+                # picked as the path below
+                self._spans[overlay] = span
+            else:
+                self.coords(overlay, Tk._flatten(coords))
+
+    def resetProcess(self):
+        """Remove the highlight of the merged paths executed"""
+        for overlay in self._process.values():
+            self._spans.pop(overlay, None)
+
+        self._process.clear()
+        self.delete("process")
+
     def plotCoords(self, xyz):
         """
             Return plotting coordinates for a 3d xyz path
@@ -2562,9 +3324,18 @@ class CanvasFrame(Tk.Frame):
         self.view.set(IniFile.get_str("Canvas", "view", VIEWS[0]))
 
         OCV.DRAW_TIME = IniFile.get_int("Canvas", "drawtime", OCV.DRAW_TIME)
+        BlockPool.PROCESSES = IniFile.get_int(
+            "Canvas", "drawprocesses", BlockPool.PROCESSES)
+        self.canvas.draw_merge = IniFile.get_bool("Canvas", "merge", True)
+        PathLOD.TOLERANCE = IniFile.get_float(
+            "Canvas", "lod", PathLOD.TOLERANCE)
+        self.canvas.draw_raster = IniFile.get_bool("Canvas", "raster", False)
 
     def saveConfig(self):
         IniFile.set_value("Canvas", "drawtime", OCV.DRAW_TIME)
+        IniFile.set_value("Canvas", "merge", self.canvas.draw_merge)
+        IniFile.set_value("Canvas", "lod", PathLOD.TOLERANCE)
+        IniFile.set_value("Canvas", "raster", self.canvas.draw_raster)
         IniFile.set_value("Canvas", "view", self.view.get())
         IniFile.set_value("Canvas", "axes", self.draw_axes.get())
         IniFile.set_value("Canvas", "grid", self.draw_grid.get())
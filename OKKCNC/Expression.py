@@ -0,0 +1,89 @@
+# -*- coding: ascii -*-
+"""Expression.py
+
+This module contains the cache of the compiled [expressions] found in the
+GCode lines, used by Tokenizer.compile_tokens.
+
+The text of an expression is compiled once in a code object, shared by all
+the lines containing it, that GCode.evaluate runs with eval() as before.
+
+An expression without names, as [25.4/2], is a constant: its value is
+computed once when it is compiled and Tokenizer puts its text in the line,
+so it is never evaluated again.
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import types
+
+import OCV
+
+CACHE_SIZE = 8192
+# returned by constant for the expressions with names
+MISSING = object()
+
+# compiled expressions by text, see compile_expr
+_CACHE = {}
+# value of the constant expressions by code
+_CONSTANTS = {}
+
+
+def compile_expr(source):
+    """@return the cached code object of the expression text, syntax
+    errors are raised as by compile()
+    """
+    try:
+        return _CACHE[source]
+    except KeyError:
+        pass
+
+    if len(_CACHE) >= CACHE_SIZE:
+        _CACHE.clear()
+        _CONSTANTS.clear()
+
+    code = compile(source, "", "eval")
+    value = _evaluate(code)
+
+    if value is not MISSING:
+        _CONSTANTS[code] = value
+
+    _CACHE[source] = code
+    return code
+
+
+def _evaluate(code):
+    """@return the value of code if it is a constant or MISSING"""
+    # names are variables, globals or attributes, lambdas and
+    # comprehensions have their own code
+    if code.co_names or any(
+            isinstance(const, types.CodeType) for const in code.co_consts):
+        return MISSING
+
+    try:
+        value = eval(code, {})
+    except Exception:
+        # raised again when evaluated
+        return MISSING
+
+    if not isinstance(value, (int, float, str)):
+        return MISSING
+
+    return value
+
+
+def constant(code):
+    """@return the value of a constant expression or MISSING"""
+    return _CONSTANTS.get(code, MISSING)
+
+
+def format_value(value):
+    """@return the text of an expression value in a GCode line"""
+    if isinstance(value, float):
+        return str(round(value, OCV.digits))
+    return str(value)
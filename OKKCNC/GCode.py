@@ -17,6 +17,8 @@ Credits:
 from __future__ import absolute_import
 from __future__ import print_function
 
+import itertools
+import mmap
 import os
 import math
 import re
@@ -25,22 +27,42 @@ import types
 from time import strftime, localtime
 
 import OCV
-from Block import Block
+from Block import Block, MappedBlock
 import Heuristic
+import ParseCache
 import Probe
+import SendStream
 import bmath
+import Expression
 import undo
 
 from CNC import CNC, Orient, get_dict_value
 from bpath import Path, Segment  # eq,
 
+# lines at the start of file scanned for the postprocessor marker
+PP_MARKER_LINES = 9
+# lines read between two calls of the load progress function
+PROGRESS_LINES = 10000
+
+
+class LoadCancelled(Exception):
+    """Raised by the progress function of GCode.read_file to stop it"""
+    pass
+
 
 class GCode(object):
     """Gcode file"""
     LOOP_MERGE = False
+    # files bigger than MAP_SIZE MB are loaded read only memory mapped
+    # 0 to never map them
+    MAP_SIZE = 0
 
     def __init__(self):
         self.cnc = CNC()
+        # modal state used while reading a file, see read_file
+        self.read_cnc = CNC()
+        # modal state used while preparing a run, see comp_level
+        self.run_cnc = CNC()
         self.undoredo = undo.UndoRedo()
         self.probe = Probe.Probe()
         self.orient = Orient()
@@ -54,19 +76,16 @@ class GCode(object):
         self.footer = ""
 
         OCV.blocks = []  # list of blocks
-        # dummy values for min_z and max_z to correctly test when setted
-        OCV.max_z = -9999
-        OCV.min_z = 10000
         # TODO: maybe this could be used to name the blocks ?
         OCV.gcp_mop_name = ""
-        #
-        OCV.gcodelines = ["(-)",]  # Add a starting 0 pos to better align index
         self.vars.clear()
         self.undoredo.reset()
         # FIXME check if this is needed
         # self.probe.init()
 
         self._lastModified = 0
+        # memory map of the file for the MappedBlocks
+        self._map = None
         self._modified = False
 
     def calculateEnableMargins(self):
@@ -107,11 +126,7 @@ class GCode(object):
 
                 if isinstance(expr, types.CodeType):
                     result = eval(expr, OCV.CD, self.vars)
-
-                    if isinstance(result, float):
-                        line[i] = str(round(result, OCV.digits))
-                    else:
-                        line[i] = str(result)
+                    line[i] = Expression.format_value(result)
             return "".join(line)
 
         elif isinstance(line, types.CodeType):
@@ -125,49 +140,51 @@ class GCode(object):
         else:
             return line
 
-    def parse_gcode(self, filename, adv_heur=False):
-        """scan lines from gcodelines and parse them to create
-        a proper OCV.blocks structure
+    def parse_gcode(self, lines, blocks, cnc, filename=""):
+        """scan the lines iterable and parse them to create a proper blocks
+        structure, the lines are consumed one at a time so the file is
+        never held in memory, only the blocks are.
+        @return blocks
         """
 
         if OCV.DEBUG_PAR is True:
             OCV.printout_header("Scanning {0}", filename)
 
+        cnc.blocksExist = False
+
         # preprocess file to find a Post processor marker
-        prcs = True
-        l_idx = 1
-        l_bound = min(10, len(OCV.gcodelines))
-        while prcs is True:
-            line = OCV.gcodelines[l_idx]
+        # in the first lines, they are read ahead and then chained back
+        lines = iter(lines)
+        head = list(itertools.islice(lines, PP_MARKER_LINES))
 
+        for line in head:
             if line.startswith("( ver: okk-"):
                 OCV.g_code_pp = "CamBam-OKK"
-            else:
-                pass
 
-            if l_idx < (l_bound - 1):
-                l_idx += 1
-            else:
-                prcs = False
+        lines = itertools.chain(head, lines)
 
         # act depending on prostprocessor marker
         # for now only 'CamBam-OKK' is implemented, using 'custom' grbl.cbpp
         # file as postprocessor in CamBam
         # others could be implemented if relevant information are supplied
         if OCV.g_code_pp in ("CamBam-OKK",):
-            self.pre_process_gcode()
+            # the events are processed while the lines are read
+            Heuristic.process_blocks(
+                self.pre_process_gcode(lines, blocks, cnc), blocks)
         else:
             # Plain Gcode file or not implemented "generators" are processed
             # using "add_line" method, in this case the g_code_pp value is
             # left 'Generic' as set in OCV file
-            for line in OCV.gcodelines:
-                self.add_line(line)
+            for line in lines:
+                self.add_line(line, blocks, cnc)
 
-        Heuristic.trim_blocks()
+        Heuristic.trim_blocks(blocks)
 
         if OCV.DEBUG_PAR is True:
             OCV.printout_header("{0}", "END SCAN")
 
+        return blocks
+
     def debug_info(self, line, move, move_s, move_f, delta_z):
 
         print(line)
@@ -190,63 +207,49 @@ class GCode(object):
 
         print(OCV.str_sep)
 
-    def pre_process_gcode(self):
+    def pre_process_gcode(self, lines, blocks, cnc):
         """scan gcode lines and inject some metadata, it create only one Block.
-        The main scope is to populate OCV.blocks_ev list used in later
-        elaboration done by Heuristic.process_blocks().
+        This is a generator, each line is appended to blocks[-1] and then
+        the event it generates, if any, is yielded to
+        Heuristic.process_blocks() that split the blocks meanwhile.
         See the Documentation in Heuristic.process_blocks() for more info.
+        Lines are numbered from 1 as the first line of the file.
         """
         # DEBUG_INFO activation only for this method
         INT_DEBUG = False
         OCV.infos = []
+        # dummy value for max_z to correctly test when setted
+        max_z = -9999
 
-        process = True
-        l_idx = -1
-        OCV.blocks_ev = ["",]
-
-        while process is True:
-            if l_idx < (len(OCV.gcodelines) - 1):
-                l_idx += 1
-            else:
-                # continue here is to force the loop to terminate here
-                # if not present last line is scanned again
-                process = False
-                continue
-
-            line = OCV.gcodelines[l_idx]
+        for l_idx, line in enumerate(lines, 1):
 
             if INT_DEBUG is True:
                 print("{0} Line > {1}".format(l_idx, line))
 
-                if l_idx == (len(OCV.gcodelines) - 1):
-                    print("last line fo gcode")
-
-            # discard the dummy first item
+            # discard the dummy lines
             if line.startswith("(-)"):
                 continue
 
-            if not OCV.blocks:
-                OCV.blocks.append(Block("Header"))
+            if not blocks:
+                blocks.append(Block("Header"))
 
             # events are processes later
 
             if line[:10] == "(MOP Start":
-                OCV.blocks_ev.append(
-                    ("MS", l_idx, line,
-                     ((self.cnc.x, self.cnc.y, self.cnc.z),
-                      self.cnc.zval,
-                      (self.cnc.dx, self.cnc.dy, self.cnc.dz))))
-                OCV.blocks[-1].append(line)
+                blocks[-1].append(line)
+                yield ("MS", l_idx, line,
+                       ((cnc.x, cnc.y, cnc.z),
+                        cnc.zval,
+                        (cnc.dx, cnc.dy, cnc.dz)))
                 continue
 
             if line[:8] == "(MOP End":
                 # if there is a MOP end
-                OCV.blocks_ev.append(
-                    ("ME", l_idx, line,
-                     ((self.cnc.x, self.cnc.y, self.cnc.z),
-                      self.cnc.zval,
-                      (self.cnc.dx, self.cnc.dy, self.cnc.dz))))
-                OCV.blocks[-1].append(line)
+                blocks[-1].append(line)
+                yield ("ME", l_idx, line,
+                       ((cnc.x, cnc.y, cnc.z),
+                        cnc.zval,
+                        (cnc.dx, cnc.dy, cnc.dz)))
                 continue
 
             cmds = Heuristic.parse_line(line)
@@ -255,7 +258,7 @@ class GCode(object):
 
             if cmds is None:
                 # the line contains comments or no valid commands
-                OCV.blocks[-1].append(line)
+                blocks[-1].append(line)
                 continue
 
             # self.cnc.motionStart(cmds), analyze the move and populate the
@@ -266,13 +269,13 @@ class GCode(object):
             # take care to "generate" the start value and the end value for
             # each line
 
-            self.cnc.motionStart(cmds)
+            cnc.motionStart(cmds)
             move = cmds[0]
-            move_s = (self.cnc.x, self.cnc.y, self.cnc.z)
-            move_s_dz = self.cnc.dz
+            move_s = (cnc.x, cnc.y, cnc.z)
+            move_s_dz = cnc.dz
 
-            self.cnc.motionEnd()
-            move_f = (self.cnc.x, self.cnc.y, self.cnc.z)
+            cnc.motionEnd()
+            move_f = (cnc.x, cnc.y, cnc.z)
 
             # at this point we have all the motion infos neede to generate
             # properly an event
@@ -281,11 +284,11 @@ class GCode(object):
             move_c = ((move_s[0], move_s[1], move_s[2]), delta_z,
                       (move_f[0], move_f[1], move_f[2]))
 
-            OCV.min_z = min(OCV.min_z, move_f[2])
-            OCV.max_z = max(OCV.max_z, move_f[2])
+            max_z = max(max_z, move_f[2])
 
             # debug info useful only for development
-            self.debug_info(line, move, move_s, move_f, delta_z)
+            if INT_DEBUG is True:
+                self.debug_info(line, move, move_s, move_f, delta_z)
 
             # analyze moves
             if move in ("G1", "G2", "G3"):
@@ -295,127 +298,260 @@ class GCode(object):
                         ev_label = "GMZ"
                     else:
                         ev_label = "GMXY"
-                    OCV.blocks_ev.append(
-                            (ev_label, l_idx, line, move_c, cmds))
-                    OCV.blocks[-1].append(line)
+                    blocks[-1].append(line)
+                    yield (ev_label, l_idx, line, move_c, cmds)
                     continue
                 else:
                     # 'cut move' with no feedrate, generally a plain move no
                     # event to process
-                    OCV.blocks[-1].append(line)
+                    blocks[-1].append(line)
             elif move == "G0":
                 # original code using self.cnc.gcode == 0
                 # will also detect come G0 move that don't contains Z value
                 # leading to some 'false' positive
                 if cmds[1][0] == "Z" and move_s_dz > 0.0:
-                    # rapid Z move up detected
-                    OCV.blocks_ev.append(("ZU", l_idx, line, move_c))
-                    OCV.blocks[-1].append(line)
+                    # rapid Z move up detected, with the highest Z so far
+                    blocks[-1].append(line)
+                    yield ("ZU", l_idx, line, move_c, max_z)
                     continue
                 elif cmds[1][0] == "Z" and move_s_dz < 0:
                     # rapid Z move down detected
-                    OCV.blocks_ev.append(("ZD", l_idx, line, move_c))
-                    OCV.blocks[-1].append(line)
+                    blocks[-1].append(line)
+                    yield ("ZD", l_idx, line, move_c)
                 elif cmds[1][0] == "Z" and move_s_dz == 0:
                     # Z neutral move this catch G0 Z(same level of prior move)
                     # that sometimes could appear in code
-                    OCV.blocks_ev.append(("ZN", l_idx, line, move_c))
-                    OCV.blocks[-1].append(line)
+                    blocks[-1].append(line)
+                    yield ("ZN", l_idx, line, move_c)
                 else:
                     # a normal G0 move is detected
                     # this could catch "G0 Zxx" moves
-                    OCV.blocks_ev.append(("G0", l_idx, line, move_c, cmds))
-                    OCV.blocks[-1].append(line)
+                    blocks[-1].append(line)
+                    yield ("G0", l_idx, line, move_c, cmds)
                     continue
             elif move in OCV.end_cmds:
                 # catch the end commands
-                OCV.blocks_ev.append((move, l_idx, line, move_c))
-                OCV.blocks[-1].append(line)
+                blocks[-1].append(line)
+                yield (move, l_idx, line, move_c)
             else:
                 # other 'moves' T, M () not catched as end_cmds and S
-                OCV.blocks[-1].append(line)
+                blocks[-1].append(line)
 
-        # one line to pass the work to Heuristic module single that take care
-        # of susbsequent work on parsing and block splitting
-        Heuristic.process_blocks()
-
-    def add_line(self, line):
+    def add_line(self, line, blocks=None, cnc=None, rng=None):
         """plain addLine method from bCNC
         used by setLinesUndo method and if no postprocessor is detected in
-        GCode file
+        GCode file, blocks and cnc default to OCV.blocks and self.cnc
+        rng is the (start, end, map) range of line in the memory mapped
+        file, MappedBlocks are created if it is given, see read_mapped
         """
+        if blocks is None:
+            blocks = OCV.blocks
+
+        if cnc is None:
+            cnc = self.cnc
+
         if line.startswith("(-)"):
             return
 
         if line.startswith("(Block-name:"):
-            self._blocksExist = True
+            cnc.blocksExist = True
             pat = OCV.RE_BLOCK.match(line)
             if pat:
                 value = pat.group(2).strip()
-                if not OCV.blocks or len(OCV.blocks[-1]):
-                    OCV.blocks.append(Block(value))
+                if not blocks or len(blocks[-1]):
+                    blocks.append(self.new_block(value, rng))
                 else:
-                    OCV.blocks[-1].b_name = value
+                    blocks[-1].b_name = value
                 return
 
-        if not OCV.blocks:
-            OCV.blocks.append(Block("Header"))
+        if not blocks:
+            blocks.append(self.new_block("Header", rng))
 
         cmds = Heuristic.parse_line(line)
         if cmds is None:
-            OCV.blocks[-1].append(line)
+            blocks[-1].append_line(line, rng)
             return
 
-        self.cnc.motionStart(cmds)
+        cnc.motionStart(cmds)
 
         # rapid move up = end of block
-        if self._blocksExist:
-            OCV.blocks[-1].append(line)
-        elif self.cnc.gcode == 0 and self.cnc.dz > 0.0:
-            OCV.blocks[-1].append(line)
-            OCV.blocks.append(Block())
-        elif self.cnc.gcode == 0 and len(OCV.blocks) == 1:
-            OCV.blocks.append(Block())
-            OCV.blocks[-1].append(line)
+        if cnc.blocksExist:
+            blocks[-1].append_line(line, rng)
+        elif cnc.gcode == 0 and cnc.dz > 0.0:
+            blocks[-1].append_line(line, rng)
+            blocks.append(self.new_block(None, rng))
+        elif cnc.gcode == 0 and len(blocks) == 1:
+            blocks.append(self.new_block(None, rng))
+            blocks[-1].append_line(line, rng)
         else:
-            OCV.blocks[-1].append(line)
+            blocks[-1].append_line(line, rng)
+
+        cnc.motionEnd()
 
-        self.cnc.motionEnd()
+    @staticmethod
+    def read_lines(f_handle, progress=None, total=0):
+        """Generator of the normalized lines of an open file, without the
+        line terminators, identical lines are stored once see ParseCache
+        progress(done, total) is called every PROGRESS_LINES lines with
+        the characters read
+        """
+        done = 0
+
+        for l_idx, line in enumerate(f_handle, 1):
+            if progress is not None:
+                done += len(line)
+                if l_idx % PROGRESS_LINES == 0:
+                    progress(done, total)
+
+            yield ParseCache.intern_line(
+                line.rstrip("\n").replace("\x0d", ""))
+
+    @staticmethod
+    def new_block(name, rng=None):
+        """@return a new Block, or MappedBlock if rng is given"""
+        if rng is None:
+            return Block(name)
+
+        return MappedBlock(name, rng[2])
+
+    @staticmethod
+    def map_lines(f_map, progress=None):
+        """Generator of the lines of a memory map and their
+        (start, end, f_map) range, without the line terminators
+        progress(done, total) is called every PROGRESS_LINES lines
+        """
+        pos = 0
+        size = len(f_map)
+        l_idx = 0
+
+        while pos < size:
+            end = f_map.find(b"\n", pos)
+
+            if end < 0:
+                end = size
+
+            line_end = end
+
+            if line_end > pos and f_map[line_end - 1:line_end] == b"\r":
+                line_end -= 1
 
-    def load(self, filename=None):
-        """Load a file into editor"""
+            line = f_map[pos:line_end]
+
+            if not isinstance(line, str):
+                line = line.decode("utf-8", "replace")
+
+            l_idx += 1
+            if progress is not None and l_idx % PROGRESS_LINES == 0:
+                progress(pos, size)
+
+            yield line.replace("\x0d", ""), (pos, line_end, f_map)
+            pos = end + 1
+
+    def load(self, filename=None, mapped=None):
+        """Load a file into editor
+        see read_file and set_file
+        """
         if filename is None:
             filename = self.filename
 
-        self.init()
-        self.filename = filename
+        result = self.read_file(filename, mapped)
 
-        try:
-            f_handle = open(self.filename, "r")
-        except Exception as e:
+        if result is None:
             return False
 
-        self._lastModified = os.stat(self.filename).st_mtime
+        self.set_file(filename, *result)
+
+        return True
+
+    def read_file(self, filename, mapped=None, progress=None):
+        """Read and parse filename without touching the loaded program, so
+        it can run in a worker thread, see Sender.loadBackground.
+        The file is streamed through parse_gcode, the lines are stored
+        only in the blocks.
+        If mapped is True, or None and the file is bigger than MAP_SIZE,
+        the file is loaded read only see read_mapped
+        progress(done, total) is called while reading, it can raise
+        LoadCancelled to stop.
+        @return (blocks, file map or None, modification time)
+        or None if the file can't be opened
+        """
+        try:
+            f_handle = open(filename, "r")
+        except Exception:
+            return None
 
+        f_stat = os.fstat(f_handle.fileno())
+        self.read_cnc.initPath()
+
+        if mapped is None:
+            mapped = (self.MAP_SIZE > 0 and
+                      f_stat.st_size > self.MAP_SIZE * 1048576)
+
+        f_map = None
+
+        with f_handle:
+            if mapped and f_stat.st_size > 0:
+                f_map = mmap.mmap(
+                    f_handle.fileno(), 0, access=mmap.ACCESS_READ)
+                blocks = self.read_mapped(f_map, progress)
+            else:
+                blocks = self.parse_gcode(
+                    self.read_lines(f_handle, progress, f_stat.st_size),
+                    [], self.read_cnc, filename)
+
+        return blocks, f_map, f_stat.st_mtime
+
+    def set_file(self, filename, blocks, f_map=None, mtime=0):
+        """Replace the loaded program with the blocks read by read_file,
+        it has to be called from the main thread
+        """
+        self.init()
+        self.filename = filename
+        self._lastModified = mtime
+        self._map = f_map
         self.cnc.initPath()
         self.cnc.resetAllMargins()
-        self._blocksExist = False
+        OCV.blocks = blocks
+
+    def read_mapped(self, f_map, progress=None):
+        """Split the memory mapped file in MappedBlocks using add_line, the
+        blocks hold only the line ranges, the Heuristic is not applied as
+        the blocks are not meant to be edited.
+        @return blocks
+        """
+        blocks = []
+        self.read_cnc.blocksExist = False
 
-        for line in f_handle:
-            # Add line to the gcodelines used for display and heuristic
-            OCV.gcodelines.append(line[:-1].replace("\x0d", ""))
+        for line, rng in self.map_lines(f_map, progress):
+            self.add_line(line, blocks, self.read_cnc, rng)
 
-        f_handle.close()
+        Heuristic.trim_blocks(blocks)
 
-        self.parse_gcode(filename, False)
+        return blocks
 
-        return True
+    def unmap(self, filename):
+        """Promote the MappedBlocks to Blocks before overwriting the mapped
+        file filename, the undo history is cleared as it could contain
+        MappedBlocks
+        """
+        if self._map is None or not self.filename or \
+           os.path.abspath(filename) != os.path.abspath(self.filename):
+            return
+
+        for block in OCV.blocks:
+            if isinstance(block, MappedBlock):
+                block.promote()
+
+        self.undoredo.reset()
+        self._map = None
 
     def save(self, filename=None):
         """Save to a file"""
         if filename is not None:
             self.filename = filename
 
+        self.unmap(self.filename)
+
         try:
             f = open(self.filename, "w")
         except Exception:
@@ -432,6 +568,7 @@ class GCode(object):
         """Save in NGC format
         Cleaned from Block OKKCNC metadata with or without comments
         """
+        self.unmap(filename)
         f_handle = open(filename, 'w')
         for block in OCV.blocks:
             # print(block.enable)
@@ -452,6 +589,7 @@ class GCode(object):
         """Save in OKK format
         with OKKCNC metadata and comments
         """
+        self.unmap(filename)
         okkf = open(filename, 'w')
         for block in OCV.blocks:
             block.write(okkf)
@@ -494,10 +632,7 @@ class GCode(object):
         # get only first path that enters the surface
         # ignore the deeper ones
         passno = 0
-        for line in block:
-            # flatten helical paths
-            line = re.sub(r"\s?z-?[0-9\.]+", "", line)
-
+        for line, kind, pairs in block.iter_records():
             # break after first depth pass
             if line == "( ---------- cut-here ---------- )":
                 passno = 0
@@ -511,12 +646,21 @@ class GCode(object):
             if passno > 1:
                 continue
 
-            cmds = Heuristic.parse_line(line)
+            if kind == Block.REC_OTHER:
+                # flatten helical paths
+                cmds = Heuristic.parse_line(
+                    re.sub(r"\s?z-?[0-9\.]+", "", line))
 
-            if cmds is None:
+                if cmds is None:
+                    continue
+
+                self.cnc.motionStart(cmds)
+            elif kind == Block.REC_EMPTY:
                 continue
+            else:
+                # flatten helical paths
+                self.cnc.motionStartPairs([p for p in pairs if p[0] != "Z"])
 
-            self.cnc.motionStart(cmds)
             end = bmath.Vector(self.cnc.xval, self.cnc.yval)
             if self.cnc.gcode == 0:  # rapid move (new block)
                 if path:
@@ -638,12 +782,12 @@ class GCode(object):
         # Delete all blocks and create new ones
         del OCV.blocks[:]
         self.cnc.initPath()
-        self._blocksExist = False
+        self.cnc.blocksExist = False
 
         for line in lines:
             self.add_line(line)
 
-        Heuristic.trim_blocks()
+        Heuristic.trim_blocks(OCV.blocks)
         return undoinfo
 
     def setAllBlocksUndo(self, blocks=[]):
@@ -738,12 +882,14 @@ class GCode(object):
         """Set block state"""
         undoinfo = (self.setBlockEnableUndo, bid, OCV.blocks[bid].enable)
         OCV.blocks[bid].enable = enable
+        OCV.blocks[bid].dirty = True
         return undoinfo
 
     def setBlockColorUndo(self, bid, color):
         """Set block color"""
         undoinfo = (self.setBlockColorUndo, bid, OCV.blocks[bid].color)
         OCV.blocks[bid].color = color
+        OCV.blocks[bid].dirty = True
         return undoinfo
 
     def swapBlockUndo(self, a, b):
@@ -1050,35 +1196,43 @@ class GCode(object):
             block = OCV.blocks[bid]
 
             if isinstance(lid, int):
-                cmds = Heuristic.parse_line(block[lid])
+                line = block[lid]
+                kind, pairs = block.record(lid)
 
-                if cmds is None:
+                if kind == Block.REC_OTHER:
+                    cmds = Heuristic.parse_line(line)
+
+                    if cmds is None:
+                        continue
+
+                    pairs = ParseCache.word_values(tuple(cmds))
+                elif kind == Block.REC_EMPTY:
                     continue
 
-                self.cnc.motionStart(cmds)
+                self.cnc.motionStartPairs(pairs)
 
                 # Collect all values
                 new.clear()
-                for cmd in cmds:
+                for c, value in pairs:
 
-                    if cmd.upper() == 'G91':
+                    if c == "G" and value == 91.0:
                         relative = True
-                    if cmd.upper() == 'G90':
+                    if c == "G" and value == 90.0:
                         relative = False
 
-                    c = cmd[0].upper()
                     # record only coordinates commands
                     if c not in "XYZIJKR":
                         continue
 
-                    try:
-                        new[c] = old[c] = float(cmd[1:])*OCV.unit
-                    except Exception:
+                    if value is None:
                         new[c] = old[c] = 0.0
+                    else:
+                        new[c] = old[c] = value*OCV.unit
 
                 # Modify values with func
                 if func(new, old, relative, *args):
-                    # Reconstruct new line
+                    # Reconstruct new line from the words
+                    cmds = Heuristic.parse_line(line)
                     newcmd = []
                     present = ""
                     for cmd in cmds:
@@ -1348,7 +1502,11 @@ class GCode(object):
         self.addUndo(undoinfo, "Optimize")
 
     def comp_level(self, queue, stopFunc=None):
-        """Use probe information (if exist) to modify the g-code to autolevel"""
+        """Use probe information (if exist) to modify the g-code to autolevel
+        the lines are queued as SendStream records.
+        The modal state is run_cnc, not the cnc drawn by the canvas, so it
+        can run in a worker thread, see Sender.runBackground
+        """
       
         paths = []
         # empty the gctos value
@@ -1356,19 +1514,16 @@ class GCode(object):
 
         def add(line, path):
             if line is not None:
-                if isinstance(line, str):
-                    queue.put(line + "\n")
-                    OCV.gctos.append(line)
-                else:
-                    queue.put(line)
-                    OCV.gctos.append(line)
+                queue.put(SendStream.make(line, path))
+                OCV.gctos.append(line)
 
             paths.append(path)
         
         # check the existence of an autolevel file        
         autolevel = not self.probe.isEmpty()
 
-        self.initPath()
+        cnc = self.run_cnc
+        cnc.initPath()
 
         for line in CNC.compile_pgm(OCV.startup.splitlines()):
             add(line, None)
@@ -1403,11 +1558,11 @@ class GCode(object):
 
                 skip = False
                 expand = None
-                self.cnc.motionStart(cmds)
+                cnc.motionStart(cmds)
 
                 # FIXME append feed on cut commands.
                 # It will be obsolete in grbl v1.0
-                if OCV.appendFeed and self.cnc.gcode in (1, 2, 3):
+                if OCV.appendFeed and cnc.gcode in (1, 2, 3):
                     # Check is not existing in cmds
                     for c in cmds:
                         if c[0] in ('f', 'F'):
@@ -1416,11 +1571,11 @@ class GCode(object):
                         cmds.append(
                             OCV.fmt(
                                 'F',
-                                self.cnc.feed / OCV.unit))
+                                cnc.feed / OCV.unit))
 
-                if autolevel and self.cnc.gcode in (0, 1, 2, 3) and \
-                      self.cnc.mval == 0:
-                    xyz = self.cnc.motionPath()
+                if autolevel and cnc.gcode in (0, 1, 2, 3) and \
+                      cnc.mval == 0:
+                    xyz = cnc.motionPath()
 
                     if not xyz:
                         # while auto-levelling, do not ignore non-movement
@@ -1433,7 +1588,7 @@ class GCode(object):
                                     'G', 'X', 'Y', 'Z', 'I', 'J', 'K', 'R'):
                                 extra += c
                         x1, y1, z1 = xyz[0]
-                        if self.cnc.gcode == 0:
+                        if cnc.gcode == 0:
                             g = 0
                         else:
                             g = 1
@@ -1451,16 +1606,16 @@ class GCode(object):
                                 extra = ""
 
                             x1, y1, z1 = x2, y2, z2
-                    self.cnc.motionEnd()
+                    cnc.motionEnd()
                     continue
                 else:
                     # FIXME expansion policy here variable needed
                     # Canned cycles
                     if OCV.drillPolicy == 1 and \
-                       self.cnc.gcode in (81, 82, 83, 85, 86, 89):
-                        expand = self.cnc.macroGroupG8X()
+                       cnc.gcode in (81, 82, 83, 85, 86, 89):
+                        expand = cnc.macroGroupG8X()
                     # Tool change
-                    elif self.cnc.mval == 6:
+                    elif cnc.mval == 6:
                         if OCV.toolPolicy == 0:
                             # send to grbl
                             pass
@@ -1468,8 +1623,8 @@ class GCode(object):
                             # skip whole line
                             skip = True
                         elif OCV.toolPolicy >= 2:
-                            expand = CNC.compile_pgm(self.cnc.toolChange())
-                    self.cnc.motionEnd()
+                            expand = CNC.compile_pgm(cnc.toolChange())
+                    cnc.motionEnd()
 
                 if expand is not None:
                     for line in expand:
@@ -0,0 +1,181 @@
+# -*- coding: ascii -*-
+"""GrblStatus.py
+
+This module contains the parser of the GRBL 1.1 status reports, used by
+controllers/GRBL1.py, the report
+
+    <Run|MPos:1.000,2.000,3.000|Bf:15,128|FS:500,8000|WCO:0.000,0.000,0.000>
+
+fills the attributes of a Status record, allocated once, instead of
+splitting every field with a regex and writing its values in OCV.CD.
+
+The fields are split only on "|" and ":", in any order, the ones not
+known (grblHAL sends more) are skipped. A single regex matching the
+fields in the GRBL order was measured slower than this.
+
+The record is OCV.c_status, read by the GUI, the values used by the GCode
+[expressions] and by the rest of the program are copied in OCV.CD with
+Status.update_dict, once for every update of the GUI and not for every
+report.
+
+fields has a bit set for every field found in the last report, pins and
+accessories are empty when their field is not reported, as GRBL does when
+no pin is active.
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+# bits of Status.fields
+MPOS = 0x001
+WPOS = 0x002
+BF = 0x004
+LN = 0x008
+FS = 0x010
+PN = 0x020
+WCO = 0x040
+OV = 0x080
+A = 0x100
+
+
+class Status(object):
+    """Values of the last status report"""
+
+    __slots__ = ("state", "fields", "mx", "my", "mz", "wx", "wy", "wz",
+                 "wcox", "wcoy", "wcoz", "feed", "spindle", "planner",
+                 "rxbytes", "ovfeed", "ovrapid", "ovspindle", "pins",
+                 "line", "accessories", "reports", "digits", "error")
+
+    def __init__(self, digits=4):
+        self.state = ""
+        self.fields = 0
+        self.mx = self.my = self.mz = 0.0
+        self.wx = self.wy = self.wz = 0.0
+        self.wcox = self.wcoy = self.wcoz = 0.0
+        self.feed = 0.0
+        self.spindle = 0.0
+        self.planner = 0
+        self.rxbytes = 0
+        self.ovfeed = 100
+        self.ovrapid = 100
+        self.ovspindle = 100
+        self.pins = ""
+        self.line = 0
+        self.accessories = ""
+        # reports parsed, to know if the values changed
+        self.reports = 0
+        # of the work position
+        self.digits = digits
+        # name of the field not parsed
+        self.error = None
+
+    def parse(self, line):
+        """Parse a <...> status report
+        @return False if a field can't be parsed, its name is in error and
+            the fields after it are ignored
+        """
+        fields = line[1:-1].split("|")
+        self.state = fields[0]
+        self.pins = ""
+        self.accessories = ""
+        self.error = None
+        found = 0
+
+        for field in fields[1:]:
+            key, sep, value = field.partition(":")
+
+            try:
+                if key == "MPos":
+                    # in every report, without the call of _floats
+                    values = value.split(",")
+                    self.mx = float(values[0])
+                    self.my = float(values[1])
+                    self.mz = float(values[2])
+                    found |= MPOS
+                elif key == "FS":
+                    feed, spindle = value.split(",")
+                    self.feed = float(feed)
+                    self.spindle = float(spindle)
+                    found |= FS
+                elif key == "Bf":
+                    planner, rxbytes = value.split(",")
+                    self.planner = int(planner)
+                    self.rxbytes = int(rxbytes)
+                    found |= BF
+                elif key == "WCO":
+                    self.wcox, self.wcoy, self.wcoz = _floats(value)
+                    found |= WCO
+                elif key == "Ov":
+                    feed, rapid, spindle = value.split(",")
+                    self.ovfeed = int(feed)
+                    self.ovrapid = int(rapid)
+                    self.ovspindle = int(spindle)
+                    found |= OV
+                elif key == "Pn":
+                    self.pins = value
+                    found |= PN
+                elif key == "Ln":
+                    self.line = int(value)
+                    found |= LN
+                elif key == "A":
+                    self.accessories = value
+                    found |= A
+                elif key == "F":
+                    self.feed = float(value)
+                    found |= FS
+                elif key == "WPos":
+                    self.wx, self.wy, self.wz = _floats(value)
+                    found |= WPOS
+            except (ValueError, IndexError):
+                self.error = key
+                break
+
+        self._positions(found)
+        return self.error is None
+
+    def _positions(self, found):
+        """Compute the position not reported from the other and the
+        offset, and set the fields found
+        """
+        if found & WPOS:
+            self.mx = round(self.wx + self.wcox, self.digits)
+            self.my = round(self.wy + self.wcoy, self.digits)
+            self.mz = round(self.wz + self.wcoz, self.digits)
+        elif found & MPOS:
+            self.wx = round(self.mx - self.wcox, self.digits)
+            self.wy = round(self.my - self.wcoy, self.digits)
+            self.wz = round(self.mz - self.wcoz, self.digits)
+
+        self.fields = found
+        self.reports += 1
+
+    def update_dict(self, values):
+        """Copy the values in a dictionary with the OCV.CD names"""
+        values["mx"] = self.mx
+        values["my"] = self.my
+        values["mz"] = self.mz
+        values["wx"] = self.wx
+        values["wy"] = self.wy
+        values["wz"] = self.wz
+        values["wcox"] = self.wcox
+        values["wcoy"] = self.wcoy
+        values["wcoz"] = self.wcoz
+        values["curfeed"] = self.feed
+        values["curspindle"] = self.spindle
+        values["planner"] = self.planner
+        values["rxbytes"] = self.rxbytes
+        values["OvFeed"] = self.ovfeed
+        values["OvRapid"] = self.ovrapid
+        values["OvSpindle"] = self.ovspindle
+        values["pins"] = self.pins
+
+
+def _floats(value):
+    """@return the first three values of a position field"""
+    values = value.split(",")
+    return float(values[0]), float(values[1]), float(values[2])
@@ -16,97 +16,93 @@ Gcode file loading phase.
 from __future__ import absolute_import
 from __future__ import print_function
 
+from collections import deque
+
 import OCV
+import ParseCache
 from Block import Block
 # from CNC import CNC
 
+# events retained by process_events, from l_idx - 2 to l_idx + 2
+EV_WINDOW = 5
+
 
 def parse_line(line):
     """@return
-        lines breaking a line containing list of commands,
+        tuple of the commands in line,
         None if empty or comment
     """
-    # skip empty lines
-    if len(line) == 0 or line[0] in ("%", "#", ";", "("):
-        return None
-
-    # remove comments
-    line = OCV.RE_PAREN.sub("", line)
-    line = OCV.RE_SEMI.sub("", line)
-
-    # process command
-    # strip all spaces
-    line = line.replace(" ", "")
+    # the word lists are cached, see ParseCache.parse_line
+    return ParseCache.parse_line(line)
 
-    # Insert space before each command
-    line = OCV.RE_CMD.sub(r" \1", line).lstrip()
-    return line.split()
 
-
-def trim_blocks():
+def trim_blocks(blocks):
     """Trim blocks - delete empty blocks"""
-    if not OCV.blocks:
+    if not blocks:
         return
 
     process = True
     idx = 0
     while (process is True):
-        block = OCV.blocks[idx]
+        block = blocks[idx]
 
         if len(block) == 0 or (len(block) == 1 and len(block[0]) == 0):
             # print("delete block")
-            del OCV.blocks[idx]
+            del blocks[idx]
             if idx > 1:
                 idx -= 1
 
-        if idx < (len(OCV.blocks) - 1):
+        if idx < (len(blocks) - 1):
             idx += 1
         else:
             process = False
 
 
-def process_blocks():
+def process_blocks(events, blocks):
+    """process the events yielded by GCode.pre_process_gcode while it is
+    reading the file and appending the lines to blocks, then split the
+    blocks created.
+    The blocks list is passed explicitly, it is not OCV.blocks until the
+    load is ended.
+    """
     # first task, process the event detected in GCode.pre_process_gcode
-    process_events()
+    process_events(events, blocks)
     # now we have some blocks, see the comments in process_events
     # try to detect the G0 moves between the MOPS
-    # reset the events, we reuse the variable for other event detection.
-    process_rapids()
-    OCV.blocks_ev = []
-    process_z_pass()
-    # refresh block in editor
-    OCV.TK_MAIN.event_generate("<<Modified>>")
+    process_rapids(blocks)
+    process_z_pass(blocks)
+    # the editor and the canvas are refreshed by the caller of GCode.load
 
 
-def print_events(l_idx, ev_msg):
+def print_events(l_idx, ev_msg, pre_ev, act_ev, nex_ev):
     print(OCV.str_sep)
     print(l_idx, ev_msg)
-    print("act ev", OCV.blocks_ev[l_idx])
-    print("prec ev", OCV.blocks_ev[l_idx - 1])
-    print("next ev", OCV.blocks_ev[l_idx + 1])
+    print("act ev", act_ev)
+    print("prec ev", pre_ev)
+    print("next ev", nex_ev)
 
 
-def print_block(b_num):
+def print_block(blocks, b_num):
     print(OCV.str_sep)
     print("Block number {0} dump".format(b_num))
     print("Block info ", OCV.blocks_info[b_num])
     print(OCV.str_sep)
-    for l_idx, line in enumerate(OCV.blocks[b_num]):
+    for l_idx, line in enumerate(blocks[b_num]):
         print(l_idx, line)
     print(OCV.str_sep)
 
 
-def print_blocks_debug_info(b_idx):
+def print_blocks_debug_info(blocks, b_idx):
     print(OCV.str_sep)
-    print("block prior", OCV.blocks[b_idx - 1])
+    print("block prior", blocks[b_idx - 1])
     print("\n", OCV.str_sep)
-    print("block actual", OCV.blocks[b_idx])
+    print("block actual", blocks[b_idx])
     print("\n", OCV.str_sep)
-    print("block next", OCV.blocks[b_idx + 1])
+    print("block next", blocks[b_idx + 1])
     print("\n", OCV.str_sep)
 
 
-def insert_mark(event, label, ev_seq):
+def insert_mark(blocks, event, label, ev_seq):
     block_num = OCV.blocks_pos
     b_start = OCV.blocks_info[block_num][0]
     ev_pos = event[1]
@@ -195,17 +191,19 @@ def insert_mark(event, label, ev_seq):
                 st_pos[0], st_pos[1],
                 en_pos[2], OCV.digits)
 
-    print("ISM - Mark", label, ev_label, str_seq)
+    if OCV.DEBUG_HEUR > 2:
+        print("ISM - Mark", label, ev_label, str_seq)
 
     # add mark  line, we need to add 1 to position it after the event
-    OCV.blocks[-1].insert(line_pos + 1, OCV.b_mdata_h + " " + ev_label + ")")
+    blocks[-1].insert(line_pos + 1, OCV.b_mdata_h + " " + ev_label + ")")
+    blocks[-1].lines_changed()
     # incrment the added lines counter
     OCV.block_add_l += 1
-    # set the new block line count
-    OCV.blocks_info[block_num][1] = len(OCV.blocks[-1])
+    # set the new block line count, the lines read so far
+    OCV.blocks_info[block_num][1] = len(blocks[-1])
 
 
-def process_events():
+def process_events(events, blocks):
     """process event list and make the appropriate actions like:
         block change
         inject metadata
@@ -220,185 +218,199 @@ def process_events():
                 M2 or M30 (Program End)
     more blocks are created detecting the custom '(MOP Start:' supplied
     by CamBam postprocessor modified by onekk.
+
+    events is an iterable, usually the GCode.pre_process_gcode generator
+    that appends the lines to blocks[-1] while reading the file, only a
+    window of EV_WINDOW events is retained, an event is processed when
+    the two following are known.
     """
     OCV.blocks_info = []
     OCV.blocks_pos = 0  # only one block is created by pre_process_gcode
+    OCV.block_add_l = 0
     # index start from 1 as the first line is a dummy marker
     OCV.blocks_info.append([1, 0])
 
-    if OCV.DEBUG_HEUR > 2:
-        print_block(0)
-        print(OCV.str_sep)
-
+    # window[-1] is the event l_idx + 2, the first item is a dummy event
+    # as in the old event list
+    window = deque(maxlen=EV_WINDOW)
+    window.append("")
     process = True
     l_idx = 1
 
-    while process is True:
-        if l_idx < (len(OCV.blocks_ev) - 2):
+    for event in events:
+        window.append(event)
+
+        if process is True and len(window) == EV_WINDOW:
             l_idx += 1
-        else:
-            # continue here is to force the loop to terminate here
-            # if not present last line is scanned again
-            process = False
-            continue
+            process = process_event(blocks, l_idx, window, window[4])
 
-        act_ev = OCV.blocks_ev[l_idx]
-        pre_ev = OCV.blocks_ev[l_idx - 1]
-        nex_ev = OCV.blocks_ev[l_idx + 1]
-        ev_label = act_ev[0]
+    # the event before the last has no second following event
+    if process is True and len(window) >= 4:
+        window.append(None)
+        l_idx += 1
+        process_event(blocks, l_idx, window, None)
 
-        if l_idx > 3:
-            pre_pre_ev = OCV.blocks_ev[l_idx - 2]
-            ev_seq = (pre_pre_ev[0], pre_ev[0], act_ev[0], nex_ev[0])
-        else:
-            ev_seq = (pre_ev[0], act_ev[0], nex_ev[0])
 
-        ev_info = []
+def process_event(blocks, l_idx, window, nex1_ev):
+    """process the event window[-3], window contains the events from
+    l_idx - 2 to l_idx + 2 (l_idx + 1 at the end of the events)
+    @return False when the End Block is detected and no more events have
+    to be processed
+    """
+    act_ev = window[-3]
+    pre_ev = window[-4]
+    nex_ev = window[-2]
+    ev_label = act_ev[0]
+
+    if l_idx > 3:
+        pre_pre_ev = window[-5]
+        ev_seq = (pre_pre_ev[0], pre_ev[0], act_ev[0], nex_ev[0])
+    else:
+        ev_seq = (pre_ev[0], act_ev[0], nex_ev[0])
 
-        if OCV.DEBUG_HEUR > 2:
-            print("Processing event [{0}] >> \n".format(l_idx), act_ev)
+    ev_info = []
 
-            if l_idx > 3:
-                pre_pre_ev = OCV.blocks_ev[l_idx - 2]
-                ev_info.append(
-                    "Ev sequence {0} >> {1} >> [{2}] >> {3}".format(
-                        pre_pre_ev[0], pre_ev[0], act_ev[0], nex_ev[0]))
-            else:
-                ev_info.append(
-                    "Ev sequence {0} >> [{1}] >> {2}".format(*ev_seq))
-
-            # theese lines are for testing event sequences
-            # keep here for future use
-            if len(ev_seq) > 3:
-                if ev_seq == ("GMZ", "GMXY", "GMZ", "GMXY"):
-                    print(">>>> Other Z Pass <<<<")
-                elif ev_seq == ("G0", "ZD", "GMZ", "GMXY"):
-                    print(">>>> First Z Pass <<<<")
-                elif ev_seq == ("ZU", "ZD", "GMZ", "GMXY"):
-                    print(">>>> Inter Z Pass (pt2)<<<<")
-
-        if ev_label == "MS":
-            if pre_ev[0] == "ZU" and nex_ev[0] == "G0":
-                # proper names are added in the process_rapids method
-                pe_new_block(
-                    act_ev[1], "First MOP")
-            else:
-                pe_new_block(
-                    act_ev[1], "Other MOP")
-
-        elif ev_label == "ME":
-            if nex_ev[0] == "MS":
-                # this occur in the middle of file, no action needed
-                pass
-            elif nex_ev[0] == "ZU":
-                nex1_ev = OCV.blocks_ev[l_idx + 2]
-                if nex1_ev[0] in OCV.end_cmds:
-                    pe_new_block(
-                        act_ev[1] + 1, "End Block")
-                    # if this is the end block we have done
-                    process = False
-
-        elif ev_label == "GMZ":
-            # check if there is a distinctive events sequence
-            if len(ev_seq) > 3:
-                if ev_seq == ("GMZ", "GMXY", "GMZ", "GMXY"):
-                    ev_label = "GCZP"
-                elif ev_seq == ("G0", "ZD", "GMZ", "GMXY"):
-                    ev_label = "GCFZP"
-            else:
-                # to catch all GMZ event, default stanzas
-                ev_label = "GMZ"
-                ev_info.append("Generic GMZ event -- {0}".format(act_ev))
+    if OCV.DEBUG_HEUR > 2:
+        print("Processing event [{0}] >> \n".format(l_idx), act_ev)
 
-            insert_mark(act_ev, ev_label, ev_seq)
+        if l_idx > 3:
+            ev_info.append(
+                "Ev sequence {0} >> {1} >> [{2}] >> {3}".format(*ev_seq))
+        else:
+            ev_info.append(
+                "Ev sequence {0} >> [{1}] >> {2}".format(*ev_seq))
+
+        # theese lines are for testing event sequences
+        # keep here for future use
+        if len(ev_seq) > 3:
+            if ev_seq == ("GMZ", "GMXY", "GMZ", "GMXY"):
+                print(">>>> Other Z Pass <<<<")
+            elif ev_seq == ("G0", "ZD", "GMZ", "GMXY"):
+                print(">>>> First Z Pass <<<<")
+            elif ev_seq == ("ZU", "ZD", "GMZ", "GMXY"):
+                print(">>>> Inter Z Pass (pt2)<<<<")
+
+    if ev_label == "MS":
+        if pre_ev[0] == "ZU" and nex_ev[0] == "G0":
+            # proper names are added in the process_rapids method
+            pe_new_block(
+                blocks, act_ev[1], "First MOP")
+        else:
+            pe_new_block(
+                blocks, act_ev[1], "Other MOP")
+
+    elif ev_label == "ME":
+        if nex_ev[0] == "MS":
+            # this occur in the middle of file, no action needed
+            pass
+        elif nex_ev[0] == "ZU":
+            if nex1_ev is not None and nex1_ev[0] in OCV.end_cmds:
+                pe_new_block(
+                    blocks, act_ev[1] + 1, "End Block")
+                # if this is the end block we have done
+                return False
+
+    elif ev_label == "GMZ":
+        # check if there is a distinctive events sequence
+        if len(ev_seq) > 3:
+            if ev_seq == ("GMZ", "GMXY", "GMZ", "GMXY"):
+                ev_label = "GCZP"
+            elif ev_seq == ("G0", "ZD", "GMZ", "GMXY"):
+                ev_label = "GCFZP"
+        else:
+            # to catch all GMZ event, default stanzas
+            ev_label = "GMZ"
+            ev_info.append("Generic GMZ event -- {0}".format(act_ev))
 
-        elif ev_label == "GMXY":
-            insert_mark(act_ev, "GMXY", ev_seq)
+        insert_mark(blocks, act_ev, ev_label, ev_seq)
 
-        elif ev_label == "G0":
-            insert_mark(act_ev, "G0M", ev_seq)
+    elif ev_label == "GMXY":
+        insert_mark(blocks, act_ev, "GMXY", ev_seq)
 
-        elif ev_label == "ZD":
-            insert_mark(act_ev, "Z_DW", ev_seq)
+    elif ev_label == "G0":
+        insert_mark(blocks, act_ev, "G0M", ev_seq)
 
-        elif ev_label == "ZU":
-            if act_ev[3][1] > (OCV.max_z - 0.00001):
-                ev_info.append(">>>> Z_MAX_UP >> {0}".format(act_ev))
-            else:
-                ev_info.append(">>>> ZUP >> {0}".format(act_ev))
+    elif ev_label == "ZD":
+        insert_mark(blocks, act_ev, "Z_DW", ev_seq)
 
-            if pre_ev[0] == "MS":
-                pass
-            else:
-                insert_mark(act_ev, "Z_UP", ev_seq)
-        elif ev_label == "ZN":
-            ev_info.append(">>>> ZN >> {0}".format(act_ev))
+    elif ev_label == "ZU":
+        if act_ev[3][1] > (act_ev[4] - 0.00001):
+            ev_info.append(">>>> Z_MAX_UP >> {0}".format(act_ev))
+        else:
+            ev_info.append(">>>> ZUP >> {0}".format(act_ev))
 
+        if pre_ev[0] == "MS":
+            pass
         else:
-            ev_info.append("No Catch >> {0}".format(act_ev))
+            insert_mark(blocks, act_ev, "Z_UP", ev_seq)
+    elif ev_label == "ZN":
+        ev_info.append(">>>> ZN >> {0}".format(act_ev))
 
-        if OCV.DEBUG_HEUR > 2:
-            if len(ev_info) >= 1:
-                print(OCV.str_sep)
-                print("\n".join(ev_info))
-                print(OCV.str_sep)
+    else:
+        ev_info.append("No Catch >> {0}".format(act_ev))
+
+    if OCV.DEBUG_HEUR > 2:
+        if len(ev_info) >= 1:
+            print(OCV.str_sep)
+            print("\n".join(ev_info))
+            print(OCV.str_sep)
 
+    return True
 
-def pe_new_block(ev_line, b_name):
+
+def pe_new_block(blocks, ev_line, b_name):
     """Add a new block to the block list during a process_event run
     ev_line >> position in which the event occurs
     b_name  >> block name
+    Only the lines read so far are moved, the following ones are appended
+    to the new last block by GCode.pre_process_gcode
     """
     # retain actual block_pos
     old_block_num = OCV.blocks_pos
 
-    # calculate the block length
-    for b_idx in range(0, OCV.blocks_pos):
-        block = OCV.blocks[b_idx]
-        print(b_idx, len(block))
+    if OCV.DEBUG_HEUR > 3:
+        # calculate the block length
+        for b_idx in range(0, OCV.blocks_pos):
+            block = blocks[b_idx]
+            print(b_idx, len(block))
 
     # increment block_pos
     OCV.blocks_pos += 1
-    # retain new block_pos
-    new_block_num = OCV.blocks_pos
 
     added_lines = OCV.block_add_l
     # determine the start
     line_num = ev_line - OCV.blocks_info[old_block_num][0] + added_lines
+    old_block = blocks[old_block_num]
 
     if OCV.DEBUG_HEUR > 3:
         print(OCV.str_sep)
         print("New Block {0}".format(b_name))
         print(">> Event Line = {0} , added_lines {1}".format(
             ev_line, added_lines))
-        print(OCV.gcodelines[ev_line])
+        print(old_block[line_num])
         print("New Block: start at {0}\n".format(line_num))
-        print_block(old_block_num)
+        print_block(blocks, old_block_num)
 
     # a list is needed as we have to modify the values later
     OCV.blocks_info.append([ev_line, added_lines])
-    OCV.blocks.append(Block(b_name))
+    new_block = Block(b_name)
+    blocks.append(new_block)
 
     # reset the added lines counter
     OCV.block_add_l = 0
 
-    l_idx = 0
-    l2mov = len(OCV.blocks[old_block_num]) - line_num
+    move_lines(old_block, line_num, new_block)
 
-    while l_idx < l2mov:
-        l_idx += 1
-
-        if OCV.DEBUG_HEUR > 3:
-            print(
-                "l2mov = {0} l_idx = {1} line_num {2}".format(
-                      l2mov, l_idx, line_num),
-                    OCV.blocks[old_block_num][line_num])
 
-        line = OCV.blocks[old_block_num].pop(line_num)
-        OCV.blocks[new_block_num].append(line)
+def move_lines(block, l_idx, dest):
+    """move the lines of block starting from l_idx at the end of dest"""
+    dest.extend(block[l_idx:])
+    del block[l_idx:]
+    block.lines_changed()
+    dest.lines_changed()
 
 
-def process_rapids():
+def process_rapids(blocks):
     """This has to identify the rapids between the MOPs and eventually those
     between shapes (profiles or pockets) in each MOP"""
 
@@ -424,7 +436,7 @@ def process_rapids():
         wf_block = False
         process2 = True  # reset internal loop exit flag
 
-        cur_block = OCV.blocks[b_idx]
+        cur_block = blocks[b_idx]
         # obtain header and footer of the block
         cur_head = cur_block[0]
         cur_foot = cur_block[-1]
@@ -475,7 +487,7 @@ def process_rapids():
 
                     mv_d = extract_rapid_move_value(line)
                     modify_block(
-                        b_idx, l_idx,
+                        blocks, b_idx, l_idx,
                         split_type, [mv_d[1]],
                         mop_name, shape_num)
                     # as following lines are now in new block
@@ -483,7 +495,8 @@ def process_rapids():
                     process2 = False
                     continue
                 elif line[md_mkl + 1:md_mk_cm] == OCV.b_mdata_mc:
-                    print("This is a cut move")
+                    if OCV.DEBUG_HEUR > 2:
+                        print("This is a cut move")
                 if OCV.DEBUG_HEUR > 2:
                     print("-------------")
 
@@ -492,7 +505,7 @@ def process_rapids():
             else:
                 process2 = False
 
-        if b_idx < (len(OCV.blocks) - 1):
+        if b_idx < (len(blocks) - 1):
             b_idx += 1
         else:
             process = False
@@ -537,9 +550,9 @@ def detect_names(head_line, dt):
     return ret_val
 
 
-def modify_block(b_idx, l_idx, action, ac_data, mop_name, shape_num):
+def modify_block(blocks, b_idx, l_idx, action, ac_data, mop_name, shape_num):
     """Split blocks based on block number and position"""
-    cur_block = OCV.blocks[b_idx]
+    cur_block = blocks[b_idx]
     old_name = cur_block.b_name
     new_block_name = OCV.b_mdata_ss.format(
             mop_name, "Shape " + str(shape_num))
@@ -549,10 +562,11 @@ def modify_block(b_idx, l_idx, action, ac_data, mop_name, shape_num):
                 old_name, shape_num, b_idx, l_idx))
 
     if action in ("TM", "TMBP"):
-        new_block = create_new_block(b_idx, l_idx, new_block_name + " cut")
+        new_block = create_new_block(
+            blocks, b_idx, l_idx, new_block_name + " cut")
 
-        OCV.blocks.insert(b_idx + 1, new_block)
-        added_block = OCV.blocks[b_idx + 1]
+        blocks.insert(b_idx + 1, new_block)
+        added_block = blocks[b_idx + 1]
 
         if action == "TM":
             label = new_block_name
@@ -570,10 +584,11 @@ def modify_block(b_idx, l_idx, action, ac_data, mop_name, shape_num):
             added_block.set_name(new_block_name + " - cut")
 
     elif action == "SP":
-        new_block = create_new_block(b_idx, l_idx - 1, new_block_name + " -ZP")
+        new_block = create_new_block(
+            blocks, b_idx, l_idx - 1, new_block_name + " -ZP")
 
-        OCV.blocks.insert(b_idx + 1, new_block)
-        added_block = OCV.blocks[b_idx + 1]
+        blocks.insert(b_idx + 1, new_block)
+        added_block = blocks[b_idx + 1]
 
         label = " Z{0:.{1}f}".format(ac_data[2], OCV.digits)
         block_new_name = new_block_name + " pass at " + label
@@ -588,7 +603,7 @@ def modify_block(b_idx, l_idx, action, ac_data, mop_name, shape_num):
         label = " Z{0:.{1}f}".format(ac_data[2], OCV.digits)
         block_new_name = new_block_name + " first pass at " + label
 
-        move_lines2block(b_idx, l_idx, 0, block_new_name)
+        move_lines2block(blocks, b_idx, l_idx, 0, block_new_name)
         # remove Block Metadata line after the event line
         del cur_block[1]
         # place a comment that don't contain Block Metadata marker
@@ -598,32 +613,20 @@ def modify_block(b_idx, l_idx, action, ac_data, mop_name, shape_num):
         cur_block.insert(0, "( FZP at " + label + " pos " + label2 + ")")
         cur_block.set_name(block_new_name)
 
-    OCV.TK_MAIN.event_generate("<<Modified>>")
-
 
-def create_new_block(b_idx, l_idx, block_name):
+def create_new_block(blocks, b_idx, l_idx, block_name):
     """Create a new block and move the line starting from l_idx on it"""
     new_block = Block(block_name)
-    l_cnt = 0
-    l2mov = len(OCV.blocks[b_idx]) - l_idx
 
     if OCV.DEBUG_HEUR > 2:
         print("New Block Event at Block {0} line {1}".format(b_idx, l_idx))
 
-    while l_cnt < l2mov:
-
-        if OCV.DEBUG_HEUR > 4:  # only for troubleshooting split idx > 4
-            print("l2mov = {0} l_cnt = {1} l_idx {2}".format(
-                    l2mov, l_cnt, l_idx), OCV.blocks[b_idx][l_idx])
-
-        line = OCV.blocks[b_idx].pop(l_idx)
-        new_block.append(line)
-        l_cnt += 1
+    move_lines(blocks[b_idx], l_idx, new_block)
 
     return new_block
 
 
-def move_lines2block(b_idx, l_idx, move2, block_new_name):
+def move_lines2block(blocks, b_idx, l_idx, move2, block_new_name):
     """move lines to another block
      lines are moved from the present block to the block selected according
      to move2 value as follows:
@@ -631,23 +634,22 @@ def move_lines2block(b_idx, l_idx, move2, block_new_name):
          1 >> to the next block (NOT IMPLEMENTED YET)
     """
     if move2 == 0:
-        l_cnt = 0
-        l2mov = l_idx
-        block = OCV.blocks[b_idx - 1]
-
-        while l_cnt < l2mov:
-            if OCV.DEBUG_HEUR > 4:  # only for troubleshooting split idx > 4
-                print("l2mov = {0} l_cnt = {1} l_idx {2}".format(
-                        l2mov, l_cnt, l_idx), OCV.blocks[b_idx][l_idx])
-            line = OCV.blocks[b_idx].pop(0)
-            block.append(line)
-            l_cnt += 1
+        block = blocks[b_idx]
+        prev_block = blocks[b_idx - 1]
+
+        if OCV.DEBUG_HEUR > 4:  # only for troubleshooting split idx > 4
+            print("l2mov = {0} b_idx {1}".format(l_idx, b_idx))
+
+        prev_block.extend(block[:l_idx])
+        del block[:l_idx]
+        block.lines_changed()
+        prev_block.lines_changed()
     else:
         # for no no action
         return
 
 
-def process_z_pass():
+def process_z_pass(blocks):
     """The scope of this method is to identify z_pass, using the marks added
     in process_events.
     """
@@ -670,7 +672,7 @@ def process_z_pass():
         l_idx = -1
         process2 = True  # line loop flag, False to exit line loop
 
-        cur_block = OCV.blocks[b_idx]
+        cur_block = blocks[b_idx]
 
         while process2 is True:
             # line advance here to clean end the loop when block counter is
@@ -706,7 +708,7 @@ def process_z_pass():
                     mv_d = extract_value(ev_data)
                     mop_name, shape_num = detect_names(ms_name, 2)
                     modify_block(
-                        b_idx, l_idx - 1,
+                        blocks, b_idx, l_idx - 1,
                         "FP", mv_d, mop_name, shape_num)
                     # lines are moved to the old block, reset line counter
                     # to (re)start scanning from (new) first block line
@@ -717,7 +719,7 @@ def process_z_pass():
                     mv_d = extract_value(ev_data)
                     mop_name, shape_num = detect_names(ms_name, 2)
                     modify_block(
-                        b_idx, l_idx,
+                        blocks, b_idx, l_idx,
                         "SP", mv_d, mop_name, shape_num)
                     # lines are passed to a new block, force line scan loop
                     # so block loop counter is advanced
@@ -727,7 +729,7 @@ def process_z_pass():
             if OCV.DEBUG_HEUR > 2:
                 print(OCV.str_sep)
 
-        if b_idx < (len(OCV.blocks) - 1):
+        if b_idx < (len(blocks) - 1):
             b_idx += 1
         else:
             process = False
@@ -736,8 +738,6 @@ def process_z_pass():
         if OCV.DEBUG_HEUR > 0:
             OCV.printout_header("{0}", "END PROCESS_SHAPES")
 
-    OCV.TK_MAIN.event_generate("<<Modified>>")
-
 
 def extract_rapid_move_value(md_string):
     """extract values of moves from RAPID MOVE string
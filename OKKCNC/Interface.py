@@ -28,6 +28,7 @@ import Commands as cmd
 # Import Here the OCV module as it contains variables used across the program
 import OCV
 import IniFile
+import ParseCache
 import Ribbon
 import tkExtra
 import Utils
@@ -505,6 +506,39 @@ def show_stats():
 
     frame.grid_columnconfigure(1, weight=1)
 
+    frame = Tk.LabelFrame(
+        toplevel,
+        text=_("Parse cache"),
+        foreground="DarkRed")
+
+    frame.pack(fill=Tk.BOTH)
+
+    row, col = 0, 0
+
+    cache_stats = ParseCache.stats()
+
+    for name in sorted(cache_stats):
+        hits, misses, entries = cache_stats[name]
+
+        lab = Tk.Label(frame, text="{0}:".format(name))
+
+        lab.grid(row=row, column=col, sticky=Tk.E)
+
+        col += 1
+
+        lab = Tk.Label(
+            frame,
+            text=_("hits {0}  misses {1}  entries {2}").format(
+                hits, misses, entries),
+            foreground="DarkBlue")
+
+        lab.grid(row=row, column=col, sticky=Tk.W)
+
+        row += 1
+        col = 0
+
+    frame.grid_columnconfigure(1, weight=1)
+
     frame = Tk.Frame(toplevel)
     frame.pack(fill=Tk.X)
 
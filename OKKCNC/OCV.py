@@ -127,12 +127,11 @@ appendFeed = False
 
 #--- B #
 blocks = []  # Gcode blocks, here to be shared
-""" blocks_info is used in GCode.process_block indes is given by block_pos
-    list items:
-    0 > block start line (the line in OCV.gcodlines)
-    1 > number of added lines to keep in sync with OCV.gcodelines
+""" blocks_info is used in Heuristic.process_events index is given by
+    block_pos list items:
+    0 > block start line (the line number in the file)
+    1 > number of lines in the block when the last mark was added
 """
-blocks_ev = []  # blocks events, used by pre_process_gcode
 blocks_info = []
 #  to keep tracks on which block we are working
 blocks_pos = 0
@@ -307,6 +306,8 @@ config = None
 c_pgm_end = False
 # controller state to determine the state
 c_state = ""
+# GrblStatus.Status of the last status report, set by Sender
+c_status = None
 # controllers errors (only for GBRL for now)
 CTL_ERRORS = []
 # controllers errors (only for GBRL for now)
@@ -382,9 +383,6 @@ FONT_STATE_BUT = ("Sans", "-11")
 FONT_SEC_NAME = "Font"
 
 #--- G #
-# gcodelines holds "plain" lines, readed from file, used by heuristic and
-# other parts
-gcodelines = ["(-)",]
 # gcp_ vars are used in GCode.pre_process_gcode to signal some detection
 gcp_mop_s = False  # 'MOP Start:' detection
 gcp_mop_e = False  # 'MOP End:' detection
@@ -581,6 +579,8 @@ TK_STATUSBAR = None
 TK_TERMBUF = None
 # TerminalFrame.terminal
 TK_TERMINAL = None
+# TerminalFrame metrics of the run
+TK_TERMSTATS = None
 
 TOLERANCE = 1e-7
 
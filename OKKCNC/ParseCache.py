@@ -0,0 +1,209 @@
+# -*- coding: ascii -*-
+"""ParseCache.py
+
+This module contains a bounded LRU cache of the parsed GCode lines, shared
+by CNC.compileLine, CNC.breakLine and Heuristic.parse_line.
+
+Machine generated files repeat the same lines a lot ("G0 Z5", "G1 Z-0.5
+F300", ...) and the same strings are parsed again every time the program
+is drawn, levelled, modified or saved.
+
+The cache stores for each line text:
+    compile     the CNC.compileLine result and the comment found
+    words       the word list of CNC.breakLine or Heuristic.parse_line
+    values      (letter, value) pairs of the words, value is a float or
+                None if the word value is not a number
+
+Cached lists are returned as tuples or copies, as GCode.evaluate replace the
+expressions in place.
+
+The whole cache is cleared when OCV.stdexpr, the unit mode or OCV.digits
+(used for the constant [expressions]) change, the counters are reported by
+stats().
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sys
+from collections import OrderedDict
+
+import OCV
+import Tokenizer
+
+try:
+    intern_str = sys.intern
+except AttributeError:
+    intern_str = intern  # noqa: F821 python 2
+
+CACHE_SIZE = 8192
+# returned by LRUCache.get for missing keys, None is a valid cached value
+MISSING = object()
+
+
+class LRUCache(object):
+    """Least recently used dictionary with a maximum size"""
+
+    def __init__(self, name, size=CACHE_SIZE):
+        self.name = name
+        self.size = size
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """@return cached value or MISSING, moving it at the newest position"""
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return MISSING
+        self.data[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store value removing the oldest entry if full"""
+        self.data[key] = value
+        if len(self.data) > self.size:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+
+_COMPILE = LRUCache("compile")
+_WORDS = LRUCache("words")
+_HEUR = LRUCache("parse")
+_VALUES = LRUCache("values")
+CACHES = (_COMPILE, _WORDS, _HEUR, _VALUES)
+
+# state used to build the cached values
+_stamp = [None]
+
+
+def _check_stamp():
+    stamp = (OCV.stdexpr, OCV.inch, OCV.unit, OCV.digits)
+    if stamp != _stamp[0]:
+        if _stamp[0] is not None:
+            clear()
+        _stamp[0] = stamp
+
+
+def clear():
+    """Clear all the caches, the counters are left untouched"""
+    for cache in CACHES:
+        cache.clear()
+
+
+def reset_stats():
+    for cache in CACHES:
+        cache.reset_stats()
+
+
+def stats():
+    """@return dict name: (hits, misses, entries)"""
+    return dict(
+        (cache.name, (cache.hits, cache.misses, len(cache.data)))
+        for cache in CACHES)
+
+
+def intern_line(line):
+    """Return the shared copy of line, identical lines are stored once"""
+    return intern_str(line)
+
+
+def compile_line(line, space=False):
+    """Cached Tokenizer.compile_line, set OCV.comment as it does"""
+    cmd, comment = compile_comment(line, space)
+
+    if comment is not None:
+        OCV.comment = comment
+
+    return cmd
+
+
+def compile_comment(line, space=False):
+    """Cached Tokenizer.compile_comment, OCV.comment is not touched"""
+    _check_stamp()
+    key = (line, space)
+    entry = _COMPILE.get(key)
+
+    if entry is MISSING:
+        cmd, comment = Tokenizer.compile_comment(line, space)
+        # % lines depend on the running state, don't cache them
+        if line.lstrip()[:1] != '%':
+            if isinstance(cmd, list):
+                _COMPILE.put(
+                    (intern_str(line), space), (tuple(cmd), comment))
+            else:
+                _COMPILE.put((intern_str(line), space), (cmd, comment))
+        return cmd, comment
+
+    cmd, comment = entry
+    if isinstance(cmd, tuple):
+        # lists are stored as tuples, the % lines are never cached
+        return list(cmd), comment
+    return cmd, comment
+
+
+def break_line(line):
+    """Cached Tokenizer.split_words"""
+    _check_stamp()
+    words = _WORDS.get(line)
+
+    if words is MISSING:
+        words = tuple(Tokenizer.split_words(line))
+        _WORDS.put(intern_str(line), words)
+
+    return words
+
+
+def parse_line(line):
+    """Cached word list of Heuristic.parse_line, None for comments"""
+    _check_stamp()
+    words = _HEUR.get(line)
+
+    if words is MISSING:
+        # skip empty lines
+        if not line or line[0] in ("%", "#", ";", "("):
+            words = None
+        else:
+            # remove comments and all spaces
+            cmd = OCV.RE_PAREN.sub("", line)
+            cmd = OCV.RE_SEMI.sub("", cmd)
+            cmd = cmd.replace(" ", "")
+            words = tuple(Tokenizer.split_words(cmd))
+        _HEUR.put(intern_str(line), words)
+
+    return words
+
+
+def word_values(words):
+    """@return tuple of (letter, value) pairs, letter is uppercase
+    and value is float or None if not a number
+    """
+    _check_stamp()
+    values = _VALUES.get(words)
+
+    if values is MISSING:
+        values = []
+        for word in words:
+            try:
+                value = float(word[1:])
+            except ValueError:
+                value = None
+            values.append((word[0].upper(), value))
+        values = tuple(values)
+        _VALUES.put(words, values)
+
+    return values
@@ -0,0 +1,251 @@
+# -*- coding: ascii -*-
+"""PathIndex.py
+
+This module contains the spatial index of the paths drawn by CNCCanvas,
+used to pick the lines with the mouse, to select them in an area and to
+snap to their ends, without asking the Tk canvas, as find_closest and
+find_overlapping check every item and they are not usable with the
+raster backend.
+
+The segments of the lines are projected for the view at zoom 1, as
+plotCoords does, the index is valid for every zoom and the canvas
+coordinates are divided by the zoom.
+
+The segments are kept in a uniform grid of cells, as numpy arrays sorted
+by cell, a segment is in all the cells crossed by its bounding box, the
+long ones crossing more than MAX_CELLS cells are kept apart and checked
+every time. A query checks only the segments of the cells of its area.
+
+The segments of a line are consecutive and the lines are sorted by block
+and line, as they are drawn.
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import math
+
+from PathRaster import PROJECTIONS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# mean segments in a cell
+CELL_SEGMENTS = 4
+# segments crossing more cells are not in the grid
+MAX_CELLS = 64
+
+
+def usable():
+    """@return True if numpy is installed"""
+    return np is not None
+
+
+def segments(points, lines):
+    """@return the p0, p1, lid arrays of the segments of the lines
+    @param points (x, y, z) points of the lines, one after the other
+    @param lines (lid, number of points) of the lines
+    """
+    pts = np.array(points, dtype=np.float64).reshape(-1, 3)
+    lid = np.repeat(
+        np.array([line[0] for line in lines], dtype=np.int64),
+        [line[1] for line in lines])
+    # consecutive points of the same line
+    same = np.flatnonzero(lid[1:] == lid[:-1])
+    return pts[same], pts[same + 1], lid[same]
+
+
+def join(blocks):
+    """@return the p0, p1, keys arrays of the segments of the blocks
+    @param blocks (bid, segments) of the blocks, in order
+    """
+    if not blocks:
+        empty = np.zeros((0, 3))
+        return empty, empty, np.zeros(0, dtype=np.int64)
+
+    return (np.concatenate([seg[0] for bid, seg in blocks]),
+            np.concatenate([seg[1] for bid, seg in blocks]),
+            np.concatenate([(bid << 32) | seg[2] for bid, seg in blocks]))
+
+
+class PathIndex(object):
+    """Grid of the segments p0, p1 of the lines keys, bid << 32 | lid, in
+    the view"""
+
+    def __init__(self, p0, p1, keys, view):
+        self.count = len(keys)
+        self.keys = keys
+
+        if not self.count:
+            return
+
+        pu, pv = PROJECTIONS[view]
+        self.u0 = p0.dot(pu)
+        self.v0 = p0.dot(pv)
+        self.u1 = p1.dot(pu)
+        self.v1 = p1.dot(pv)
+        self.umin = np.minimum(self.u0, self.u1)
+        self.umax = np.maximum(self.u0, self.u1)
+        self.vmin = np.minimum(self.v0, self.v1)
+        self.vmax = np.maximum(self.v0, self.v1)
+
+        # first segment of each line
+        self.starts = np.flatnonzero(
+            np.concatenate(([True], keys[1:] != keys[:-1])))
+
+        self._grid()
+
+    def _grid(self):
+        """Put the segments in the cells"""
+        self.ox = float(self.umin.min())
+        self.oy = float(self.vmin.min())
+        width = float(self.umax.max()) - self.ox
+        height = float(self.vmax.max()) - self.oy
+        extent = np.maximum(self.umax - self.umin, self.vmax - self.vmin)
+        segments = self.count / float(CELL_SEGMENTS)
+
+        self.cell = max(
+            math.sqrt(width * height / segments),
+            max(width, height) / segments,
+            float(np.median(extent)),
+            1e-9)
+
+        self.nx = int(width / self.cell) + 1
+        self.ny = int(height / self.cell) + 1
+
+        i0, j0 = self._cells(self.umin, self.vmin)
+        i1, j1 = self._cells(self.umax, self.vmax)
+        across = i1 - i0 + 1
+        cells = across * (j1 - j0 + 1)
+
+        self.long = np.flatnonzero(cells > MAX_CELLS)
+        small = np.flatnonzero(cells <= MAX_CELLS)
+        counts = cells[small]
+
+        # a (segment, cell) pair for every cell of the small segments
+        seg = np.repeat(small, counts)
+        k = np.arange(len(seg)) - np.repeat(np.cumsum(counts) - counts, counts)
+        across = across[seg]
+        cell = (j0[seg] + k // across) * self.nx + i0[seg] + k % across
+
+        order = np.argsort(cell, kind="stable")
+        self.segs = seg[order]
+        self.first = np.searchsorted(
+            cell[order], np.arange(self.nx * self.ny + 1))
+
+    def _cells(self, u, v):
+        """@return the column and row of the cells of u, v"""
+        i = np.clip(((u - self.ox) / self.cell).astype(np.int64),
+                    0, self.nx - 1)
+        j = np.clip(((v - self.oy) / self.cell).astype(np.int64),
+                    0, self.ny - 1)
+        return i, j
+
+    def _candidates(self, x0, y0, x1, y1):
+        """@return the sorted segments with the bounding box in the area"""
+        i0, j0 = self._cells(np.array(x0), np.array(y0))
+        i1, j1 = self._cells(np.array(x1), np.array(y1))
+        i0, j0, i1, j1 = int(i0), int(j0), int(i1), int(j1)
+
+        if (i1 - i0 + 1) * (j1 - j0 + 1) * CELL_SEGMENTS * 4 > self.count:
+            # most of the grid, cheaper to check them all
+            idx = np.arange(self.count)
+        else:
+            parts = [self.long]
+            for j in range(j0, j1 + 1):
+                row = j * self.nx
+                parts.append(
+                    self.segs[self.first[row + i0]:self.first[row + i1 + 1]])
+            idx = np.unique(np.concatenate(parts))
+
+        return idx[(self.umax[idx] >= x0) & (self.umin[idx] <= x1) &
+                   (self.vmax[idx] >= y0) & (self.vmin[idx] <= y1)]
+
+    def nearest(self, x, y, distance):
+        """@return the segment closest to x, y, the last drawn if more are
+        at the same distance, None if there is none nearer than distance
+        """
+        if not self.count:
+            return None
+
+        idx = self._candidates(
+            x - distance, y - distance, x + distance, y + distance)
+
+        if not len(idx):
+            return None
+
+        u0 = self.u0[idx]
+        v0 = self.v0[idx]
+        du = self.u1[idx] - u0
+        dv = self.v1[idx] - v0
+        length = du * du + dv * dv
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = ((x - u0) * du + (y - v0) * dv) / length
+        t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+
+        dist = (u0 + t * du - x) ** 2 + (v0 + t * dv - y) ** 2
+        best = len(dist) - 1 - int(dist[::-1].argmin())
+
+        if dist[best] > distance * distance:
+            return None
+
+        return int(idx[best])
+
+    def area(self, x0, y0, x1, y1, enclosed):
+        """@return the (bid, lid) of the lines with all the segments in the
+        area if enclosed, else with a segment crossing it
+        """
+        if not self.count:
+            return []
+
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        idx = self._candidates(x0, y0, x1, y1)
+
+        if enclosed:
+            idx = idx[(self.umin[idx] >= x0) & (self.umax[idx] <= x1) &
+                      (self.vmin[idx] >= y0) & (self.vmax[idx] <= y1)]
+            line = np.searchsorted(self.starts, idx, "right") - 1
+            line, inside = np.unique(line, return_counts=True)
+            size = np.diff(np.append(self.starts, self.count))[line]
+            # lines with a segment outside are not enclosed
+            keys = self.keys[self.starts[line[inside == size]]]
+        else:
+            # the corners of the area on both sides of the segment
+            u0 = self.u0[idx]
+            v0 = self.v0[idx]
+            du = self.u1[idx] - u0
+            dv = self.v1[idx] - v0
+            side = [(x - u0) * dv - (y - v0) * du
+                    for x, y in ((x0, y0), (x1, y0), (x0, y1), (x1, y1))]
+            crossing = ~(np.all([s > 0.0 for s in side], axis=0) |
+                         np.all([s < 0.0 for s in side], axis=0))
+            keys = np.unique(self.keys[idx[crossing]])
+
+        return [(key >> 32, key & 0xFFFFFFFF) for key in keys.tolist()]
+
+    def ends(self, index):
+        """@return the first and last point of the line of segment index"""
+        line = np.searchsorted(self.starts, index, "right") - 1
+        first = self.starts[line]
+
+        if line + 1 < len(self.starts):
+            last = self.starts[line + 1] - 1
+        else:
+            last = self.count - 1
+
+        return ((float(self.u0[first]), float(self.v0[first])),
+                (float(self.u1[last]), float(self.v1[last])))
+
+    def line(self, index):
+        """@return the (bid, lid) of segment index"""
+        key = int(self.keys[index])
+        return key >> 32, key & 0xFFFFFFFF
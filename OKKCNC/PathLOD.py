@@ -0,0 +1,157 @@
+# -*- coding: ascii -*-
+"""PathLOD.py
+
+This module contains the simplification of the paths drawn by
+CNCCanvas.drawPaths, the points of the motions are reduced before
+plotCoords to the ones visible at the zoom of the drawing.
+
+When the program is zoomed out thousands of segments are shorter than a
+pixel, as the small lines of the 3D surfacing or of the arcs expanded
+by CNC, the Douglas-Peucker algorithm keeps only the points that are
+more than TOLERANCE pixels away from the simplified path.
+
+The simplification is display only, the paths are computed and the lines
+are selected as before, it is done for zoom buckets, powers of 2, so the
+result is valid for every zoom of the bucket and is kept in a bounded
+cache, as the same paths are drawn again at every change of the view.
+CNCCanvas draws again the paths when zoomed in a bucket of more detail.
+
+Unlike douglas in lib/imageToGcode.py it does not fit arcs and it uses
+the distance from the segment and not from its line, so the points where
+the path turns back are kept.
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import math
+
+from ParseCache import LRUCache, MISSING
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# maximum distance in pixels of the points removed, 0 to draw them all
+TOLERANCE = 0.5
+# paths simplified kept
+CACHE_SIZE = 4096
+# paths with less points are not simplified
+MIN_POINTS = 3
+
+_cache = LRUCache("lod", CACHE_SIZE)
+
+
+def bucket(zoom):
+    """@return the zoom bucket of zoom, the power of 2 not over it"""
+    return 2.0 ** math.floor(math.log(zoom, 2))
+
+
+def simplify(points, zoom):
+    """@return the indexes of the (x, y, z) points to draw at zoom, the
+    first and the last are always kept, None to draw them all
+    """
+    if TOLERANCE <= 0.0 or len(points) < MIN_POINTS:
+        return None
+
+    scale = bucket(zoom)
+    # the hash of the points, to not keep them in the cache
+    key = (scale, len(points), hash(tuple(points)))
+    keep = _cache.get(key)
+
+    if keep is MISSING:
+        keep = douglas(points, TOLERANCE / scale)
+        if len(keep) == len(points):
+            keep = None
+        _cache.put(key, keep)
+
+    return keep
+
+
+def douglas(points, tolerance):
+    """@return the indexes of the points kept by Douglas-Peucker"""
+    if np is not None:
+        return _douglas_numpy(points, tolerance)
+
+    last = len(points) - 1
+    keep = [False] * len(points)
+    keep[0] = keep[last] = True
+    stack = [(0, last)]
+    tolerance *= tolerance
+
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        ax, ay, az = points[first]
+        bx, by, bz = points[last]
+        dx = bx - ax
+        dy = by - ay
+        dz = bz - az
+        length = dx * dx + dy * dy + dz * dz
+        dmax = -1.0
+        worst = first
+
+        for i in range(first + 1, last):
+            x, y, z = points[i]
+            x -= ax
+            y -= ay
+            z -= az
+            if length > 0.0:
+                t = max(0.0, min(1.0, (x * dx + y * dy + z * dz) / length))
+                x -= t * dx
+                y -= t * dy
+                z -= t * dz
+            d = x * x + y * y + z * z
+            if d > dmax:
+                dmax = d
+                worst = i
+
+        if dmax > tolerance:
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+
+    return [i for i, kept in enumerate(keep) if kept]
+
+
+def _douglas_numpy(points, tolerance):
+    """douglas with the distances of a segment computed by numpy"""
+    pts = np.array(points, dtype=np.float64)
+    last = len(pts) - 1
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[last] = True
+    stack = [(0, last)]
+    tolerance *= tolerance
+
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        start = pts[first]
+        seg = pts[last] - start
+        length = seg.dot(seg)
+        rel = pts[first + 1:last] - start
+
+        if length > 0.0:
+            t = np.clip(rel.dot(seg) / length, 0.0, 1.0)
+            rel = rel - np.outer(t, seg)
+
+        dist = np.einsum("ij,ij->i", rel, rel)
+        worst = int(dist.argmax())
+
+        if dist[worst] > tolerance:
+            worst += first + 1
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+
+    return np.nonzero(keep)[0].tolist()
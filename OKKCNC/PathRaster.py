@@ -0,0 +1,360 @@
+# -*- coding: ascii -*-
+"""PathRaster.py
+
+This module contains the raster backend of CNCCanvas, the paths of the
+program are drawn with numpy in an RGBA image shown as a single
+PhotoImage, instead of a canvas item for every line, as the Tk canvas
+slows down with millions of items.
+
+drawPaths adds the segments of the paths with their block, line, color
+and kind, they are kept as numpy arrays and projected once for every zoom
+and view, as plotCoords does.
+
+The image covers the visible part of the canvas and MARGIN pixels around
+it, when the canvas is scrolled out of it only the strips exposed are
+drawn, the part already drawn is copied. Zoom draws it all again.
+
+The segments are drawn with a vectorized DDA, clipped to the strip, the
+rapid motions dashed as the vector ones, the later segments are drawn
+over the previous as the canvas items.
+
+The canvas items are still used for everything else, the selection, the
+active line and the lines executed by a run are drawn as polylines over
+the image, made of the segments of the lines (see polylines), the lines
+are picked with the PathIndex of the segments.
+
+The image is also the canvas sent as PNG by the Pendant.
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import math
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = None
+    Image = None
+
+# pixels drawn around the visible part of the canvas
+MARGIN = 256
+# pixels of the segments drawn at once, to limit the memory used
+SAMPLES = 1000000
+# dash of the rapid motions, pixels drawn and total
+DASH = (4, 7)
+
+S60 = math.sin(math.radians(60))
+C60 = math.cos(math.radians(60))
+
+# plotCoords projections, canvas (u, v) from (x, y, z)
+PROJECTIONS = (
+    ((1., 0., 0.), (0., -1., 0.)),            # X-Y
+    ((1., 0., 0.), (0., 0., -1.)),            # X-Z
+    ((0., 1., 0.), (0., 0., -1.)),            # Y-Z
+    ((S60, S60, 0.), (C60, -C60, -1.)),       # ISO1
+    ((S60, -S60, 0.), (-C60, -C60, -1.)),     # ISO2
+    ((-S60, -S60, 0.), (-C60, C60, -1.)),     # ISO3
+    )
+
+
+def usable():
+    """@return True if numpy and PIL are installed"""
+    return np is not None and Image is not None
+
+
+class PathRaster(object):
+    """Segments of the paths drawn and the image of the visible part"""
+
+    def __init__(self, maxdist):
+        # coordinates are limited as the canvas ones
+        self.maxdist = maxdist
+        # canvas area visible, for the Pendant
+        self.visible = None
+        self.clear()
+
+    def clear(self):
+        """Remove all the segments"""
+        self._p0 = []
+        self._p1 = []
+        self._keys = []
+        self._colors = []
+        self._rapid = []
+        self._palette = {}
+        self.count = 0
+        self.p0 = self.p1 = None
+        self.keys = self.color = self.rapid = None
+        self.palette = None
+        self.u0 = self.v0 = self.u1 = self.v1 = None
+        self.bounds = None
+        # pixels drawn and their canvas x, y, width, height
+        self.drawn = None
+        self.fills = []
+
+    def add(self, bid, lid, xyz, fill, rapid):
+        """Add the segments of the (x, y, z) points of line lid"""
+        if len(xyz) < 2:
+            return
+
+        color = self._palette.setdefault(fill, len(self._palette))
+        segments = len(xyz) - 1
+        self._p0.extend(xyz[:-1])
+        self._p1.extend(xyz[1:])
+        self._keys.extend([(bid << 32) | lid] * segments)
+        self._colors.extend([color] * segments)
+        self._rapid.extend([rapid] * segments)
+
+    def finish(self, rgb):
+        """Convert the segments added to arrays
+        @param rgb function returning the (r, g, b) of a color name
+        """
+        self.count = len(self._keys)
+        self.p0 = np.array(self._p0, dtype=np.float64).reshape(-1, 3)
+        self.p1 = np.array(self._p1, dtype=np.float64).reshape(-1, 3)
+        self.keys = np.array(self._keys, dtype=np.int64)
+        self.color = np.array(self._colors, dtype=np.int32)
+        self.rapid = np.array(self._rapid, dtype=bool)
+
+        self.palette = np.zeros((max(len(self._palette), 1), 4), np.uint8)
+        self.fills = [None] * len(self._palette)
+        for fill, color in self._palette.items():
+            self.palette[color, :3] = rgb(fill)
+            self.palette[color, 3] = 255
+            self.fills[color] = fill
+
+        self._p0 = []
+        self._p1 = []
+        self._keys = []
+        self._colors = []
+        self._rapid = []
+
+    def project(self, view, zoom):
+        """Compute the canvas coordinates of the segments for the view
+        and zoom, and forget the image drawn
+        """
+        self.drawn = None
+
+        if not self.count:
+            self.bounds = None
+            return
+
+        pu, pv = PROJECTIONS[view]
+        pu = np.array(pu) * zoom
+        pv = np.array(pv) * zoom
+        limit = self.maxdist
+
+        self.u0 = np.clip(self.p0.dot(pu), -limit, limit)
+        self.v0 = np.clip(self.p0.dot(pv), -limit, limit)
+        self.u1 = np.clip(self.p1.dot(pu), -limit, limit)
+        self.v1 = np.clip(self.p1.dot(pv), -limit, limit)
+
+        self.bounds = (
+            int(math.floor(min(self.u0.min(), self.u1.min()))),
+            int(math.floor(min(self.v0.min(), self.v1.min()))),
+            int(math.ceil(max(self.u0.max(), self.u1.max()))) + 1,
+            int(math.ceil(max(self.v0.max(), self.v1.max()))) + 1)
+
+    def render(self, x0, y0, x1, y1):
+        """Update the image to cover the canvas area x0, y0, x1, y1
+        @return True if the image changed
+        """
+        if self.bounds is None:
+            return False
+
+        if self.drawn is not None:
+            image, (ox, oy, ow, oh) = self.drawn
+            bx0, by0, bx1, by1 = self.bounds
+            # the visible part in the bounds is already drawn
+            if max(x0, bx0) >= ox and max(y0, by0) >= oy and \
+                    min(x1, bx1) <= ox + ow and min(y1, by1) <= oy + oh:
+                return False
+
+        area = self._area(x0 - MARGIN, y0 - MARGIN, x1 + MARGIN, y1 + MARGIN)
+
+        if area is None:
+            return False
+
+        nx, ny, nw, nh = area
+        pixels = np.zeros((nh, nw, 4), np.uint8)
+        todo = [(nx, ny, nx + nw, ny + nh)]
+
+        if self.drawn is not None:
+            image, (ox, oy, ow, oh) = self.drawn
+            # copy the part already drawn
+            cx0 = max(nx, ox)
+            cy0 = max(ny, oy)
+            cx1 = min(nx + nw, ox + ow)
+            cy1 = min(ny + nh, oy + oh)
+
+            if cx0 < cx1 and cy0 < cy1:
+                pixels[cy0 - ny:cy1 - ny, cx0 - nx:cx1 - nx] = \
+                    image[cy0 - oy:cy1 - oy, cx0 - ox:cx1 - ox]
+                todo = [rect for rect in (
+                    (nx, ny, nx + nw, cy0),
+                    (nx, cy1, nx + nw, ny + nh),
+                    (nx, cy0, cx0, cy1),
+                    (cx1, cy0, nx + nw, cy1))
+                    if rect[0] < rect[2] and rect[1] < rect[3]]
+
+        for rect in todo:
+            self._draw(pixels, nx, ny, rect)
+
+        self.drawn = pixels, area
+        return True
+
+    def _area(self, x0, y0, x1, y1):
+        """@return x, y, width, height of the area in the bounds"""
+        bx0, by0, bx1, by1 = self.bounds
+        x0 = max(int(math.floor(x0)), bx0)
+        y0 = max(int(math.floor(y0)), by0)
+        x1 = min(int(math.ceil(x1)), bx1)
+        y1 = min(int(math.ceil(y1)), by1)
+
+        if x0 >= x1 or y0 >= y1:
+            return None
+
+        return x0, y0, x1 - x0, y1 - y0
+
+    def _draw(self, pixels, ox, oy, rect):
+        """Draw the segments crossing rect in the pixels with origin
+        ox, oy
+        """
+        x0, y0, x1, y1 = rect
+        u0 = self.u0
+        v0 = self.v0
+        u1 = self.u1
+        v1 = self.v1
+
+        idx = np.nonzero(
+            (np.minimum(u0, u1) < x1) & (np.maximum(u0, u1) >= x0) &
+            (np.minimum(v0, v1) < y1) & (np.maximum(v0, v1) >= y0))[0]
+
+        su = u0[idx]
+        sv = v0[idx]
+        du = u1[idx] - su
+        dv = v1[idx] - sv
+
+        # Liang-Barsky clipping of the segments to rect
+        t0 = np.zeros(len(idx))
+        t1 = np.ones(len(idx))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for p, q in ((-du, su - x0), (du, x1 - su),
+                         (-dv, sv - y0), (dv, y1 - sv)):
+                ratio = q / p
+                t0 = np.where(p < 0, np.maximum(t0, ratio), t0)
+                t1 = np.where(p > 0, np.minimum(t1, ratio), t1)
+
+        clipped = t0 <= t1
+        idx = idx[clipped]
+
+        # samples at most a pixel apart from the start of the segment, so
+        # that every pixel crossed is drawn, the same in every strip, the
+        # ones between t0 and t1 are in rect
+        steps = np.ceil(
+            np.maximum(np.abs(du), np.abs(dv))[clipped]).astype(np.int64)
+        first = np.ceil(t0[clipped] * steps).astype(np.int64)
+        n = np.floor(t1[clipped] * steps).astype(np.int64) - first + 1
+        drawn = n > 0
+
+        idx = idx[drawn]
+        steps = steps[drawn]
+        first = first[drawn]
+        n = n[drawn]
+        total = np.cumsum(n)
+        start = 0
+
+        while start < len(n):
+            done = total[start - 1] if start else 0
+            end = int(np.searchsorted(total, done + SAMPLES, "right"))
+            end = max(end, start + 1)
+            part = slice(start, end)
+            self._drawSamples(
+                pixels, ox, oy, idx[part], steps[part], first[part], n[part])
+            start = end
+
+    def _drawSamples(self, pixels, ox, oy, idx, steps, first, n):
+        """Draw the samples first to first+n of the segments idx"""
+        seg = np.repeat(np.arange(len(n)), n)
+        step = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + \
+            first[seg]
+        t = step / np.maximum(steps, 1)[seg].astype(np.float64)
+        idx = idx[seg]
+
+        u0 = self.u0[idx]
+        v0 = self.v0[idx]
+        px = np.floor(u0 + t * (self.u1[idx] - u0)).astype(np.int64) - ox
+        py = np.floor(v0 + t * (self.v1[idx] - v0)).astype(np.int64) - oy
+
+        drawn = ~self.rapid[idx] | (step % DASH[1] < DASH[0])
+        drawn &= (px >= 0) & (px < pixels.shape[1]) & \
+            (py >= 0) & (py < pixels.shape[0])
+
+        pixels[py[drawn], px[drawn]] = \
+            self.palette[self.color[idx[drawn]]]
+
+    def picture(self, area=None):
+        """@return the PIL image drawn and its canvas x, y, or of the part
+        of it in the canvas area x0, y0, x1, y1
+        """
+        drawn = self.drawn
+
+        if drawn is None:
+            return None, 0, 0
+
+        pixels, (x, y, width, height) = drawn
+
+        if area is not None:
+            x0 = max(int(area[0]), x)
+            y0 = max(int(area[1]), y)
+            x1 = min(int(area[2]), x + width)
+            y1 = min(int(area[3]), y + height)
+            if x0 >= x1 or y0 >= y1:
+                return None, 0, 0
+            pixels = pixels[y0 - y:y1 - y, x0 - x:x1 - x]
+            x, y = x0, y0
+
+        return Image.fromarray(pixels, "RGBA"), x, y
+
+    def lines(self, bid, lid):
+        """@return the indexes of the segments of line lid of block bid"""
+        key = (bid << 32) | lid
+        first = np.searchsorted(self.keys, key, "left")
+        last = np.searchsorted(self.keys, key, "right")
+        return np.arange(first, last)
+
+    def block(self, bid):
+        """@return the indexes of the segments of block bid"""
+        first = np.searchsorted(self.keys, bid << 32, "left")
+        last = np.searchsorted(self.keys, (bid + 1) << 32, "left")
+        return np.arange(first, last)
+
+    def line(self, index):
+        """@return the (bid, lid) of segment index"""
+        key = int(self.keys[index])
+        return key >> 32, key & 0xFFFFFFFF
+
+    def polylines(self, idx):
+        """@return the canvas coords of the segments idx, as polylines of
+        the consecutive segments
+        """
+        lines = []
+        coords = None
+        last = None
+
+        for start, end in zip(
+                zip(self.u0[idx].tolist(), self.v0[idx].tolist()),
+                zip(self.u1[idx].tolist(), self.v1[idx].tolist())):
+            if start != last:
+                coords = [start]
+                lines.append(coords)
+            coords.append(end)
+            last = end
+
+        return lines
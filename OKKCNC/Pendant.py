@@ -15,6 +15,7 @@ Credits:
 from __future__ import absolute_import
 from __future__ import print_function
 
+import io
 import os
 import re
 #import cgi
@@ -125,9 +126,10 @@ class Pendant(HTTPServer.BaseHTTPRequestHandler):
                 pass
 
         elif page == "/canvas":
+            if self.sendRaster(): return
             if not Image: return
             with tempfile.NamedTemporaryFile(suffix='.ps') as tmp:
-                httpd.app.canvasFrame.canvas.postscript(
+                OCV.TK_CANVAS_F.canvas.postscript(
                     file=tmp.name,
                     colormode='color',
                 )
@@ -168,6 +170,31 @@ class Pendant(HTTPServer.BaseHTTPRequestHandler):
         else:
             self.mainPage(page[1:])
 
+    #----------------------------------------------------------------------
+    def sendRaster(self):
+        """Send the visible part of the raster paths of the canvas as PNG
+        @return False if the canvas does not draw them in an image
+        """
+        raster = OCV.TK_CANVAS_F.canvas.raster
+        if raster is None: return False
+
+        image = raster.picture(raster.visible)[0]
+        if image is None: return False
+
+        try:
+            background = Image.new("RGBA", image.size, OCV.COLOR_CANVAS)
+            image = Image.alpha_composite(background, image)
+        except ValueError:
+            # color name not known by PIL, transparent background
+            pass
+
+        out = io.BytesIO()
+        image.save(out, "PNG")
+        data = out.getvalue()
+        self.do_HEAD(200, content="image/png", cl=len(data))
+        self.wfile.write(data)
+        return True
+
     #----------------------------------------------------------------------
     def deal_post_data(self):
         boundary = self.headers.plisttext.split("=")[1]
@@ -0,0 +1,345 @@
+# -*- coding: ascii -*-
+"""SendLoop.py
+
+This module contains the streaming loop shared by Sender and by the
+Streamer of stream.py, without Tk: the lines queued are fetched, packed
+while the receive buffer and the planner of the controller have room and
+written by SerialIO, the lines received are parsed by the controller
+plugin.
+
+Loop is a mixin, the class using it has the queue, log, gcode and serial
+attributes and the _gcount counter, initLoop is called by its __init__
+and startLoop when the serial port is opened.
+
+Credits:
+    this module code is based on bCNC code
+    https://github.com/vlachoudis/bCNC
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sys
+import re
+import threading
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+import OCV
+import SendMetrics
+import SendStream
+import SerialIO
+
+# receive buffer of the controller used until a Bf: report is received
+RX_BUFFER_SIZE = 128
+# the modal state shown by $G can be changed by the command
+MODALPAT = re.compile(
+    r"(?:G0*(?:[0-3]|1[7-9]|2[01]|38\.[2-5]|43\.1|49|5[4-9]|80|9[0134])"
+    r"|M0*[345789])(?!\d)|[TFS]\s*[-+.\d]", re.IGNORECASE)
+
+
+class Loop(object):
+    """Streaming loop called by the SerialIO threads"""
+    # Messages types for log Queue
+    MSG_BUFFER = 0  # write to buffer one command
+    MSG_SEND = 1  # send message
+    MSG_RECEIVE = 2  # receive message from controller
+    MSG_OK = 3  # ok response from controller, move top most command to queue
+    MSG_ERROR = 4  # error message or exception
+    MSG_RUNEND = 5  # run ended
+    MSG_CLEAR = 6  # clear buffer
+
+    def initLoop(self):
+        """Set the state of the loop"""
+        # lines sent and not yet acknowledged
+        self._txbuf = SerialIO.TxBuffer()
+        # lines sent by the next write
+        self._txpack = None
+        self._tosend = None  # next string to send
+        # receive buffer size, 0 in the ini to detect it, see bufferReport
+        self.rx_buffer_size = RX_BUFFER_SIZE
+        self.rx_buffer_detect = True
+        # planner blocks, known after the first Bf: report
+        self.planner_size = 0
+        # limit the lines sent to the free planner blocks
+        self.planner_fill = False
+        # free planner blocks of the last Bf: report, None if not known,
+        # and lines in flight at the report or sent after it
+        self._plannerFree = None
+        self._plannerUsed = 0
+        # lines streamed by the run, see SendMetrics
+        self.metrics = SendMetrics.Metrics()
+        # wait for commands to complete (status change to Idle)
+        self.sio_wait = False
+        # waiting for status <...> report
+        self.sio_status = False
+        self._gPending = False  # $G to send after the commands queued
+        self._lastFeed = 0
+        self._newFeed = 0
+        # the lines received and sent change the pipeline
+        self._sioLock = threading.Lock()
+
+    def startLoop(self):
+        """Reset the state of the loop for a new connection"""
+        self.sio_wait = False
+        self.sio_status = False
+        self._txbuf.clear()  # pipeline commands
+        self._txpack = SerialIO.TxPacker(self.rx_buffer_size)
+        # buffer sizes of the new connection
+        self.planner_size = 0
+        self._plannerFree = None
+        if self.rx_buffer_detect:
+            self.rx_buffer_size = RX_BUFFER_SIZE
+        self._tosend = None
+        self._gPending = False
+        self._sioLock = threading.Lock()
+
+    def emptyQueue(self):
+        while self.queue.qsize() > 0:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                break
+
+    def getBufferFill(self):
+        return self._txbuf.fill(self.rx_buffer_size)
+
+    def bufferReport(self, state, planner, rx_free):
+        """Called by the controller for every Bf: report with the free
+        planner blocks and receive buffer bytes, when Idle and with no line
+        in flight they are the sizes of the buffers
+        """
+        # each line in flight takes a planner block when it is parsed
+        self._plannerFree = planner
+        self._plannerUsed = len(self._txbuf)
+
+        if self.planner_size or self._txbuf or state != "Idle":
+            return
+
+        self.planner_size = planner
+
+        if self.rx_buffer_detect and rx_free > 0:
+            self.rx_buffer_size = rx_free
+
+        print("Buffers: RX {0} bytes, planner {1} blocks".format(
+            self.rx_buffer_size, self.planner_size))
+
+    def _bufferRoom(self, tosend):
+        """@return True if tosend can be sent to the controller"""
+        if not self._txbuf.fits(tosend, self.rx_buffer_size):
+            return False
+
+        if self.planner_fill and self._plannerFree is not None:
+            # the lines the free planner blocks can take, without a long
+            # queue in a large receive buffer delaying overrides and feed
+            # hold, the blocks executed are known at the next report
+            return self._plannerUsed < self._plannerFree
+
+        return True
+
+    def serialLine(self, line):
+        """Parse a received line, called by the SerialIO reader thread"""
+        with self._sioLock:
+            inflight = len(self._txbuf)
+
+            if not line:
+                pass
+            elif OCV.TK_MCTRL.parseLine(line, self._txbuf):
+                pass
+            else:
+                self.log.put((self.MSG_RECEIVE, line))
+
+            acked = inflight - len(self._txbuf)
+
+            if acked == 1:
+                self.metrics.ack()
+
+                # the controller has executed all, the next line is late
+                if not self._txbuf and not self.sio_wait and \
+                        not OCV.s_pause and (
+                            self._tosend is not None or
+                            self.queue.qsize() > 0):
+                    self.metrics.starve()
+
+            elif acked > 1:
+                # controller reset
+                self.metrics.clear()
+
+    def serialSend(self):
+        """Send the queued commands while the controller buffer has room,
+        called by the SerialIO writer thread when a line is received or
+        a command is queued
+        """
+        with self._sioLock:
+            while self._serialStep():
+                pass
+
+            self._serialFlush()
+
+    def _serialFlush(self):
+        """Write the lines packed by _serialStep with a single call"""
+        if not self._txpack:
+            return
+
+        self.metrics.sent(self._txpack.lines, len(self._txpack))
+        self.serial.write(self._txpack.take(OCV.TK_MCTRL.gcode_case))
+
+    def _serialStop(self):
+        """Drop the commands queued, OCV.s_stop is raised"""
+        self.emptyQueue()
+        self._tosend = None
+        self.log.put((self.MSG_CLEAR, ""))
+
+    def _serialFetch(self):
+        """Fetch the next command to send in self._tosend"""
+        try:
+            tosend = self.queue.get_nowait()
+        except Empty:
+            return
+
+        if isinstance(tosend, SendStream.Record):
+            if tosend.data is not None and (
+                    OCV.TK_MCTRL.has_override or (
+                        not OCV.CD["_OvChanged"] and
+                        OCV.CD["_OvFeed"] == 100)):
+                # prepared by comp_level, nothing to change
+                if tosend.feed is not None:
+                    self._lastFeed = tosend.feed
+                self._tosend = tosend.data
+                return
+
+            tosend = tosend.text()
+
+        if isinstance(tosend, tuple):
+            # wait to empty the grbl buffer and status is Idle
+            if tosend[0] == OCV.GSTATE_WAIT:
+                # Don't count WAIT until we are idle!
+                self.sio_wait = True
+            elif tosend[0] == OCV.GSTATE_MSG:
+                # Count executed commands as well
+                self._gcount += 1
+                if tosend[1] is not None:
+                    # show our message on machine status
+                    self._msg = tosend[1]
+            elif tosend[0] == OCV.GSTATE_UPDATE:
+                # Count executed commands as well
+                self._gcount += 1
+                self._update = tosend[1]
+            else:
+                # Count executed commands as well
+                self._gcount += 1
+
+            if OCV.DEBUG_SER is True:
+                print("SIO: tuple > ", tosend)
+            tosend = None
+
+        elif not isinstance(tosend, str):
+            try:
+                tosend = self.gcode.evaluate(tosend, self)
+                if isinstance(tosend, str):
+                    tosend += "\n"
+                else:
+                    # Count executed commands as well
+                    self._gcount += 1
+            except:
+                for s in str(sys.exc_info()[1]).splitlines():
+                    self.log.put((self.MSG_ERROR, s))
+                self._gcount += 1
+                tosend = None
+
+        if tosend is not None:
+            # All modification in tosend should be
+            # done before sending it
+
+            # Keep track of last feed
+            pat = OCV.RE_FEED.match(str(tosend))
+            if pat is not None:
+                self._lastFeed = pat.group(2)
+
+            # Modify sent g-code to reflect overrided feed
+            # for controllers without override support
+            if not OCV.TK_MCTRL.has_override:
+                if OCV.CD["_OvChanged"]:
+                    OCV.CD["_OvChanged"] = False
+                    self._newFeed = float(
+                        self._lastFeed)*OCV.CD["_OvFeed"]/100.0
+                    if pat is None and self._newFeed != 0 \
+                       and not tosend.startswith("$"):
+                        tosend = "f{0:f}{1}".format(
+                            self._newFeed,
+                            tosend)
+
+                # Apply override Feed
+                if OCV.CD["_OvFeed"] != 100 and self._newFeed != 0:
+                    pat = OCV.RE_FEED.match(tosend)
+                    if pat is not None:
+                        try:
+                            tosend = "{0}f{1:f}{2}\n".format(
+                                pat.group(1),
+                                self._newFeed,
+                                pat.group(3))
+                        except:
+                            pass
+
+        self._tosend = tosend
+
+    def _serialStep(self):
+        """Fetch and pack one command for _serialFlush
+        @return True if something was fetched or packed
+        """
+        done = False
+
+        # Fetch new command to send if...
+        if self._tosend is None and not self.sio_wait and \
+                not OCV.s_pause and self.queue.qsize() > 0:
+            self._serialFetch()
+            done = True
+
+        # Received external message to stop
+        if OCV.s_stop:
+            self._serialStop()
+            return False
+
+        tosend = self._tosend
+
+        if tosend is not None and self._bufferRoom(tosend):
+            # the case is changed by _serialFlush for all the lines
+            if self._txpack.add(tosend):
+                # Bookkeeping of the buffer
+                self._txbuf.append(tosend)
+                self._plannerUsed += 1
+            else:
+                # never acknowledged
+                self.log.put((self.MSG_ERROR, "Not sent: " + tosend))
+                self._gcount += 1
+
+            if OCV.DEBUG_SER is True:
+                print("SIO: >> ", tosend)
+
+            self.log.put((self.MSG_BUFFER, tosend))
+
+            self._tosend = None
+            done = True
+
+            # the commands of a run are followed by a $G at the end
+            if not OCV.s_running and isinstance(tosend, str) and \
+                    tosend[:1] != "$" and MODALPAT.search(tosend):
+                self._gPending = True
+
+        # a single $G after the commands queued together
+        if self._gPending and self._tosend is None and \
+                self.queue.qsize() == 0:
+            # FIXME: move to controller specific class
+            self._tosend = "$G\n"
+            self._gPending = False
+            done = True
+
+        return done
@@ -0,0 +1,225 @@
+# -*- coding: ascii -*-
+"""SendMetrics.py
+
+This module contains the counters of the lines streamed by Sender, to see
+why a job streams slowly.
+
+The serial threads count the lines and bytes written, the time from the
+write of a line to its "ok" and the starvations, when the controller has
+acknowledged every line sent while other lines were waiting in the queue,
+so its buffer was empty for the sender and not for the program.
+
+The GUI takes a sample of the counters at every refresh, with the fill of
+the controller buffer and the depth of the queues, the samples of a run
+are shown as rates over the last seconds in the Terminal page, with the
+latency of the last lines acknowledged, and can be saved as CSV or JSON.
+
+The counters are changed by the serial threads and reset or read by the
+GUI, all the methods hold the lock of the Metrics.
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import csv
+import json
+import threading
+import time
+from collections import deque
+from itertools import repeat
+
+# samples kept, an hour at the GUI refresh rate
+SAMPLES = 18000
+# seconds of the rates shown
+WINDOW = 5.0
+# acknowledged lines of the latency shown
+LATENCIES = 200
+
+# columns of the samples
+FIELDS = ("time", "lines", "bytes", "writes", "latency", "latency_max",
+          "fill", "queued", "log", "starved")
+
+
+class Metrics(object):
+    """Counters and samples of a run, see module docstring, the times are
+    in seconds from the start, the latencies in ms
+    """
+
+    def __init__(self, samples=SAMPLES):
+        self._lock = threading.Lock()
+        # write time of the lines not yet acknowledged, the oldest first
+        self._written = deque()
+        # latencies of the last lines acknowledged
+        self._recent = deque(maxlen=LATENCIES)
+        self.samples = deque(maxlen=samples)
+        self.reset()
+
+    def reset(self):
+        """Start the counters of a new run"""
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self.start = time.time()
+        self.lines = 0
+        self.bytes = 0
+        self.writes = 0
+        self.acked = 0
+        self.latency_sum = 0.
+        self.latency_max = 0.
+        self.starved = 0
+        self._written.clear()
+        self._recent.clear()
+        self.samples.clear()
+        # latencies since the last sample
+        self._count = 0
+        self._sum = 0.
+        self._max = 0.
+
+    def sent(self, lines, length):
+        """Count a write of lines, length bytes"""
+        with self._lock:
+            self.lines += lines
+            self.bytes += length
+            self.writes += 1
+            self._written.extend(repeat(time.time(), lines))
+
+    def ack(self, count=1):
+        """Count the lines acknowledged by the controller"""
+        now = time.time()
+
+        with self._lock:
+            for _ in range(count):
+                try:
+                    latency = now - self._written.popleft()
+                except IndexError:
+                    return
+
+                self.acked += 1
+                self.latency_sum += latency
+                self._recent.append(latency)
+                self._count += 1
+                self._sum += latency
+
+                if latency > self._max:
+                    self._max = latency
+                    if latency > self.latency_max:
+                        self.latency_max = latency
+
+    def clear(self):
+        """Forget the lines sent, after a reset of the controller"""
+        with self._lock:
+            self._written.clear()
+
+    def starve(self):
+        """Count a starvation of the controller"""
+        with self._lock:
+            self.starved += 1
+
+    def sample(self, fill, queued, log):
+        """Add a sample of the counters
+        @param fill percentage of the controller buffer used
+        @param queued lines waiting in the queue to the controller
+        @param log messages waiting to be shown by the GUI
+        """
+        with self._lock:
+            if self._count:
+                latency = self._sum * 1000. / self._count
+            else:
+                latency = 0.
+
+            self.samples.append((
+                round(time.time() - self.start, 3), self.lines, self.bytes,
+                self.writes, round(latency, 3), round(self._max * 1000., 3),
+                round(fill, 1), queued, log, self.starved))
+
+            self._count = 0
+            self._sum = 0.
+            self._max = 0.
+
+    def rates(self, window=WINDOW):
+        """@return lines/s and bytes/s of the samples in the last window
+        seconds
+        """
+        with self._lock:
+            if len(self.samples) < 2:
+                return 0., 0.
+
+            last = self.samples[-1]
+            first = last
+
+            for sample in reversed(self.samples):
+                if last[0] - sample[0] > window:
+                    break
+                first = sample
+
+        elapsed = last[0] - first[0]
+
+        if elapsed <= 0.:
+            return 0., 0.
+
+        return (last[1] - first[1]) / elapsed, (last[2] - first[2]) / elapsed
+
+    def latency(self):
+        """@return mean and max latency in ms of the last LATENCIES lines
+        acknowledged
+        """
+        with self._lock:
+            if not self._recent:
+                return 0., 0.
+
+            return (sum(self._recent) * 1000. / len(self._recent),
+                    max(self._recent) * 1000.)
+
+    def summary(self):
+        """@return a dictionary of the totals of the run"""
+        with self._lock:
+            return self._summary()
+
+    def _summary(self):
+        if self.acked:
+            mean = self.latency_sum * 1000. / self.acked
+        else:
+            mean = 0.
+
+        high = self.latency_max * 1000.
+        elapsed = time.time() - self.start
+
+        return {
+            "start": time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(self.start)),
+            "elapsed": round(elapsed, 3),
+            "lines": self.lines,
+            "bytes": self.bytes,
+            "writes": self.writes,
+            "acked": self.acked,
+            "latency": round(mean, 3),
+            "latency_max": round(high, 3),
+            "starved": self.starved,
+            }
+
+    def save(self, filename):
+        """Save the samples, as JSON with the summary if the file name
+        ends with .json, as CSV otherwise
+        """
+        with self._lock:
+            summary = self._summary()
+            samples = list(self.samples)
+
+        if filename.lower().endswith(".json"):
+            with open(filename, "w") as fout:
+                json.dump({
+                    "summary": summary,
+                    "fields": FIELDS,
+                    "samples": samples}, fout, indent=1)
+            return
+
+        with open(filename, "w") as fout:
+            writer = csv.writer(fout, lineterminator="\n")
+            writer.writerow(FIELDS)
+            writer.writerows(samples)
@@ -0,0 +1,82 @@
+# -*- coding: ascii -*-
+"""SendStream.py
+
+This module contains the records of the lines sent to the controller by a
+run, made by GCode.comp_level before the lines are queued, so the serial
+thread doesn't have to prepare them while streaming.
+
+A plain GCode line is a record with data, the bytes to send ready with the
+line terminator, their length, the feed found in the line (for the feed
+override of the controllers without it) and the (block, line) index of the
+source line.
+
+The lines that can be prepared only at run time are dynamic records, data
+is None and item is what comp_level queued before:
+    CodeType    python code to execute
+    list        line with [expressions] to evaluate
+    tuple       (OCV.GSTATE_xxx, args) directive
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import OCV
+
+
+class Record(object):
+    """Line of the stream, see module docstring"""
+
+    __slots__ = ("data", "length", "feed", "path", "item")
+
+    def __init__(self, data, feed=None, path=None, item=None):
+        self.data = data
+        self.length = len(data) if data is not None else 0
+        self.feed = feed
+        self.path = path
+        self.item = item
+
+    def dynamic(self):
+        """@return True if the line is prepared at run time"""
+        return self.data is None
+
+    def text(self):
+        """@return the line as queued before the records, str for the
+        GCode lines
+        """
+        if self.data is None:
+            return self.item
+        return self.data.decode("ascii")
+
+    def __repr__(self):
+        if self.data is None:
+            return "Record(item={0!r})".format(self.item)
+        return "Record({0!r})".format(self.data)
+
+
+def make(line, path=None):
+    """@return the record of a line returned by CNC.compileLine
+    @param line str without the line terminator or any other item
+    @param path (block, line) index of the source line
+    """
+    if not isinstance(line, str):
+        return Record(None, path=path, item=line)
+
+    line += "\n"
+
+    try:
+        data = line.encode("ascii")
+    except UnicodeEncodeError:
+        # left to the sender, that doesn't send it
+        return Record(None, path=path, item=line)
+
+    pat = OCV.RE_FEED.match(line)
+
+    if pat is not None:
+        return Record(data, pat.group(2), path)
+
+    return Record(data, None, path)
@@ -35,16 +35,20 @@ except ImportError:
     serial = None
 
 try:
-    from Queue import Queue, Empty
+    from Queue import Queue, Full
 except ImportError:
-    from queue import Queue, Empty
+    from queue import Queue, Full
 
 import OCV
 from CNC import CNC
 import GCode
+import GrblStatus
 #import Heuristic
 import IniFile
 import Pendant
+import SendLoop
+import SendStream
+import SerialIO
 import Utils
 
 
@@ -52,20 +56,38 @@ import Utils
 
 SERIAL_POLL = 0.125
 SERIAL_TIMEOUT = 0.10
-G_POLL = 10
-RX_BUFFER_SIZE = 128
-
-
-class Sender(object):
-    """OKKCNC Sender class"""
-    # Messages types for log Queue
-    MSG_BUFFER = 0  # write to buffer one command
-    MSG_SEND = 1  # send message
-    MSG_RECEIVE = 2  # receive message from controller
-    MSG_OK = 3  # ok response from controller, move top most command to queue
-    MSG_ERROR = 4  # error message or exception
-    MSG_RUNEND = 5  # run ended
-    MSG_CLEAR = 6  # clear buffer
+# status report interval by state, in ms, [Connection] poll<name> in the
+# ini, a state not listed is polled every SERIAL_POLL
+POLL_RATES = (
+    ("fast", 100, ("Jog", "Home")),
+    ("run", 200, ("Run",)),
+    ("hold", 500, ("Hold", "Door")),
+    ("idle", 500, ("Idle", "Check")),
+    ("alarm", 1000, ("Alarm", "Sleep")),
+    )
+# lines of a run prepared ahead of the sender, see runBackground
+RUN_QUEUE_SIZE = 4096
+
+
+class RunQueue(object):
+    """Queue passed to GCode.comp_level by the run preparing thread, put
+    waits for room in the Sender queue
+    """
+
+    def __init__(self, put):
+        self.put = put
+
+
+class Sender(SendLoop.Loop):
+    """OKKCNC Sender class, streaming with SendLoop.Loop"""
+    # Messages types for loadQueue
+    LOAD_PROGRESS = 0  # (characters read, file size)
+    LOAD_DONE = 1  # (filename, read_file result)
+    LOAD_ERROR = 2  # (filename, error message)
+    LOAD_CANCEL = 3  # (filename, None)
+    # Messages types for runQueue
+    RUN_DONE = 0  # (paths of the lines or None, lines queued)
+    RUN_CANCEL = 1  # (None, lines queued)
 
     def __init__(self):
         self._historyPos = None
@@ -81,14 +103,27 @@ class Sender(object):
         self.cnc = self.gcode.cnc
 
         self.log = Queue()  # Log queue returned from GRBL
-        # Command queue to be sent to GRBL
-        self.queue = Queue()
+        # Command queue to be sent to GRBL, bounded to stop the run
+        # preparing thread when it is too much ahead
+        self.queue = SerialIO.EventQueue(RUN_QUEUE_SIZE)
         # Command queue to be executed from buttons  or pendant
         self.pendant = Queue()
         self.serial = None
-        self.thread = None
+        # serial I/O threads
+        self.sio = None
+        # messages from the file loading thread
+        self.loadQueue = Queue()
+        self.loadThread = None
+        self._loadCancel = threading.Event()
+        # messages from the run preparing thread
+        self.runQueue = Queue()
+        self.runThread = None
+        self._runCancel = threading.Event()
 
         self._posUpdate = False  # Update position
+        # status reports copied in OCV.CD, see Application._monitorSerial
+        OCV.c_status = GrblStatus.Status(OCV.digits)
+        self._statusReports = 0
         self._probeUpdate = False  # Update probe
         self._gUpdate = False  # Update $G
         self._update = None  # Generic update
@@ -103,9 +138,12 @@ class Sender(object):
         OCV.s_pause = False    # machine is on Hold
         OCV.s_alarm = True     # Display alarm message if true
         self._msg = None
-        self._sumcline = 0
-        self._lastFeed = 0
-        self._newFeed = 0
+        self.initLoop()
+        # seconds between two status reports by state, see serialPoll
+        self.poll_rates = {}
+        self._lastPoll = 0.
+        # directory where the metrics of every run are saved, if not empty
+        self.metrics_dir = ""
 
         self._onStart = ""
         self._onStop = ""
@@ -150,8 +188,25 @@ class Sender(object):
         Pendant.port = IniFile.get_int(
             "Connection", "pendantport", Pendant.port)
         GCode.LOOP_MERGE = IniFile.get_bool("File", "dxfloopmerge")
+        GCode.MAP_SIZE = IniFile.get_int("File", "mapsize", GCode.MAP_SIZE)
+        rx_size = IniFile.get_int("Connection", "rxbuffer", 0)
+        self.rx_buffer_detect = rx_size <= 0
+        self.rx_buffer_size = \
+            rx_size if rx_size > 0 else SendLoop.RX_BUFFER_SIZE
+        self.planner_fill = IniFile.get_bool("Connection", "plannerfill")
+        self.loadPollRates()
+        self.metrics_dir = IniFile.get_str("Connection", "metricsdir")
         IniFile.loadHistory()
 
+    def loadPollRates(self):
+        """Set the status report interval of every state, in seconds"""
+        self.poll_rates = {}
+        for name, default, states in POLL_RATES:
+            rate = IniFile.get_int(
+                "Connection", "poll{0}".format(name), default)
+            for state in states:
+                self.poll_rates[state] = max(rate, 10) / 1000.
+
     def evaluate(self, line):
         """Evaluate a line for possible expressions
         can return a python exception, needs to be catched
@@ -385,6 +440,146 @@ class Sender(object):
 
         IniFile.add_recent_file(filename)
 
+    def loadBackground(self, filename, mapped=None):
+        """Read and parse a gcode file in a worker thread, the progress and
+        the result are put in loadQueue, that has to be drained from the
+        main thread, the result is set with GCode.set_file.
+        @return False if another file is loading
+        """
+        if self.loading():
+            return False
+
+        self._loadCancel.clear()
+        self.loadThread = threading.Thread(
+            target=self._loadWorker, args=(filename, mapped))
+        self.loadThread.daemon = True
+        self.loadThread.start()
+        return True
+
+    def loading(self):
+        """@return True if a file is loading"""
+        return self.loadThread is not None and self.loadThread.is_alive()
+
+    def loadCancel(self):
+        """Stop the file loading
+        @return True if a file was loading
+        """
+        if not self.loading():
+            return False
+
+        self._loadCancel.set()
+        return True
+
+    def _loadProgress(self, done, total):
+        """progress function of GCode.read_file, in the worker thread"""
+        if self._loadCancel.is_set():
+            raise GCode.LoadCancelled()
+
+        self.loadQueue.put((Sender.LOAD_PROGRESS, (done, total)))
+
+    def _loadWorker(self, filename, mapped):
+        """Body of the file loading thread"""
+        try:
+            result = self.gcode.read_file(filename, mapped, self._loadProgress)
+        except GCode.LoadCancelled:
+            self.loadQueue.put((Sender.LOAD_CANCEL, (filename, None)))
+            return
+        except Exception:
+            typ, val, trace_b = sys.exc_info()
+            traceback.print_exception(typ, val, trace_b)
+            self.loadQueue.put((Sender.LOAD_ERROR, (filename, str(val))))
+            return
+
+        if result is None:
+            self.loadQueue.put(
+                (Sender.LOAD_ERROR, (filename, "Cannot open file")))
+        else:
+            self.loadQueue.put((Sender.LOAD_DONE, (filename, result)))
+
+    def loadDone(self, filename, result):
+        """Swap in the blocks read by the loading thread"""
+        self.gcode.set_file(filename, *result)
+        IniFile.add_recent_file(filename)
+
+    def runBackground(self, lines=None):
+        """Prepare the lines of a run in a worker thread, queuing them while
+        the serial thread is already sending the first ones, a RUN_DONE or
+        RUN_CANCEL message is put in runQueue at the end
+        @param lines program to run, None for the enabled blocks of the
+            gcode, see GCode.comp_level
+        """
+        self._runCancel.clear()
+        self.runThread = threading.Thread(
+            target=self._runWorker, args=(lines,))
+        self.runThread.daemon = True
+        self.runThread.start()
+
+    def preparing(self):
+        """@return True if the lines of the run are still prepared"""
+        return self.runThread is not None and self.runThread.is_alive()
+
+    def _runStopped(self):
+        """stop function of GCode.comp_level, in the worker thread"""
+        return OCV.s_stop or self._runCancel.is_set()
+
+    def _runPut(self, item):
+        """Queue a line of the run, waiting for room in the queue"""
+        while not self._runCancel.is_set():
+            try:
+                self.queue.put(item, timeout=SERIAL_POLL)
+                return
+            except Full:
+                pass
+
+    def _runWorker(self, lines):
+        """Body of the run preparing thread"""
+        # path of every line queued, None for a program run
+        paths = None
+        count = 0
+
+        try:
+            if lines is None:
+                paths = self.gcode.comp_level(
+                    RunQueue(self._runPut), self._runStopped)
+                stopped = paths is None
+                count = len(paths) if paths is not None else 0
+            else:
+                stopped = False
+                # empty the gctos value
+                OCV.gctos = []
+                for line in CNC.compile_pgm(lines):
+                    if self._runStopped():
+                        stopped = True
+                        break
+                    if line is not None:
+                        self._runPut(SendStream.make(line))
+                        OCV.gctos.append(line)
+                        count += 1
+        except Exception:
+            typ, val, trace_b = sys.exc_info()
+            traceback.print_exception(typ, val, trace_b)
+            stopped = True
+
+        if stopped or self._runCancel.is_set():
+            self.runQueue.put((Sender.RUN_CANCEL, (None, count)))
+            return
+
+        if count or paths is None:
+            # wait at the end to become idle
+            self._runPut((OCV.GSTATE_WAIT,))
+
+        self.runQueue.put((Sender.RUN_DONE, (paths, count)))
+
+    def runCancel(self):
+        """Stop the run preparing thread and empty the queue"""
+        self._runCancel.set()
+
+        if self.preparing() and \
+                threading.current_thread() is not self.runThread:
+            self.runThread.join(1.0)
+
+        self.emptyQueue()
+
     def save(self, filename):
         """manage the saving of the file based on extension"""
         fn, ext = os.path.splitext(filename)
@@ -474,8 +669,7 @@ class Sender(object):
         self.serial_write("\n\n")
         self._gcount = 0
         OCV.s_alarm = True
-        self.thread = threading.Thread(target=self.serialIO)
-        self.thread.start()
+        self.serialIO()
         return True
 
     def close(self):
@@ -489,8 +683,14 @@ class Sender(object):
             pass
 
         self._runLines = 0
-        self.thread = None
-        time.sleep(1)
+
+        if self.sio is not None:
+            # the threads are not waited when closing from them
+            self.sio.stop()
+            self.sio = None
+
+        self.queue.listener = None
+        self._txbuf.clear()
 
         try:
             self.serial.close()
@@ -534,26 +734,17 @@ class Sender(object):
         but.config(background=OCV.STATECOLOR["Hold:0"])
         OCV.TK_MCTRL.pause(None)
 
-    def emptyQueue(self):
-        while self.queue.qsize() > 0:
-            try:
-                self.queue.get_nowait()
-            except Empty:
-                break
-
     def stopProbe(self):
         if self.gcode.probe.start:
             self.gcode.probe.clear()
 
-    def getBufferFill(self):
-        return self._sumcline * 100. / RX_BUFFER_SIZE
-
     def initRun(self):
         """Init variables to prepare program run"""
         self._quit = 0
         OCV.s_pause = False
         OCV.s_running = True
         self._paths = None
+        self.metrics.reset()
         OCV.TK_MAIN.disable()
         self.emptyQueue()
         time.sleep(1)
@@ -561,11 +752,20 @@ class Sender(object):
     def runEnded(self, msg):
         """Called when run is finished"""
         print("runEnded >> {}".format(msg))
+
+        if self.preparing():
+            self.runCancel()
         
         if OCV.s_running:
             self.log.put((Sender.MSG_RUNEND, _("Run ended")))
 
             self.log.put((Sender.MSG_RUNEND, str(OCV.CD["msg"])))
+
+            if self.metrics_dir:
+                self.saveMetrics(os.path.join(
+                    self.metrics_dir,
+                    time.strftime("run-%Y%m%d-%H%M%S.csv")))
+
             if self._onStop:
                 try:
                     os.system(self._onStop)
@@ -592,6 +792,18 @@ class Sender(object):
         print("runEnded End")
 
 
+    def saveMetrics(self, filename):
+        """Save the metrics of the last run, see SendMetrics.Metrics.save
+        @return True on success
+        """
+        try:
+            self.metrics.save(filename)
+        except (IOError, OSError):
+            self.log.put((Sender.MSG_ERROR, str(sys.exc_info()[1])))
+            return False
+
+        return True
+
     def stopRun(self, event=None):
         """Stop the current run"""
         OCV.s_stop_req = True
@@ -648,186 +860,69 @@ class Sender(object):
 		#	self.jobDone()
         
     def serialIO(self):
-        """thread performing I/O on serial line"""
-        # wait for commands to complete (status change to Idle)
-        self.sio_wait = False
-        # waiting for status <...> report
-        self.sio_status = False
-        cline = []  # length of pipeline commands
-        sline = []  # pipeline commands
-        lrcvl = ""  # last received line to not clutter debug output
-        tosend = None  # next string to send
-        tr = tg = time.time()  # last time a ? or $G was send to grbl
-
-        while self.thread:
-            t = time.time()
-            # refresh machine position?
-            if t-tr > SERIAL_POLL:
-                OCV.TK_MCTRL.viewStatusReport()
-                tr = t
-
-                # If Override change, attach feed
-                if OCV.CD["_OvChanged"]:
-                    OCV.TK_MCTRL.overrideSet()
-
-            # Fetch new command to send if...
-            if tosend is None and not self.sio_wait and \
-                    not OCV.s_pause and self.queue.qsize() > 0:
+        """Start the threads performing I/O on serial line, see SerialIO"""
+        self.startLoop()
+        self._lrcvl = ""  # last received line to not clutter debug output
+        self._lastPoll = 0.  # last time a status report was asked
+        self.sio = SerialIO.SerialIO(
+            self.serial, self.serialLine, self.serialSend, self.serialPoll,
+            self.serialError, SERIAL_POLL)
+        self.queue.listener = self.sio.wake
+        self.sio.start()
+
+    def serialPoll(self):
+        """refresh machine position, called by the SerialIO poll thread
+        @return the seconds to the next call, the interval of the state
+        """
+        interval = self.pollInterval()
+        now = time.time()
 
-                try:
-                    tosend = self.queue.get_nowait()
-                    # print( "+++",repr(tosend))
-                    if isinstance(tosend, tuple):
-                        # print "gcount tuple=",self._gcount
-                        # wait to empty the grbl buffer and status is Idle
-                        if tosend[0] == OCV.GSTATE_WAIT:
-                            # Don't count WAIT until we are idle!
-                            self.sio_wait = True
-                            print ("+++ WAIT ON")
-                            # print ("gcount=",self._gcount, self._runLines)
-                        elif tosend[0] == OCV.GSTATE_MSG:
-                            # Count executed commands as well
-                            self._gcount += 1
-                            print ("GC+ MSG")
-                            if tosend[1] is not None:
-                                # show our message on machine status
-                                self._msg = tosend[1]
-                        elif tosend[0] == OCV.GSTATE_UPDATE:
-                            # Count executed commands as well
-                            self._gcount += 1
-                            self._update = tosend[1]
-                            print ("GC+ UPD")
-                        else:
-                            # Count executed commands as well
-                            self._gcount += 1
-                            print ("GC+ ELSE")
-                        tosend = None
-
-                    elif not isinstance(tosend, str):
-                        try:
-                            tosend = self.gcode.evaluate(tosend)
-                            print("TS:NISstr")
-                            # if isinstance(tosend, list):
-                            #    cline.append(len(tosend[0]))
-                            #    sline.append(tosend[0])
-                            if isinstance(tosend, str):
-                                tosend += "\n"
-                            else:
-                                # Count executed commands as well
-                                self._gcount += 1
-                                print ("GC+ STR: ELSE")
-                                # print "gcount str=",self._gcount
-                                # print( "+++ eval=",repr(tosend),type(tosend))
-                        except:
-                            for s in str(sys.exc_info()[1]).splitlines():
-                                self.log.put((Sender.MSG_ERROR, s))
-                            self._gcount += 1
-                            print ("GC+ STR:EXCEPT")
-                            tosend = None
-                except Empty:
-                    print("SIO: Empty queue: catched")    
-                    break
-
-                if tosend is not None:
-                    # All modification in tosend should be
-                    # done before adding it to cline
-
-                    # Keep track of last feed
-                    pat = OCV.RE_FEED.match(str(tosend))
-                    if pat is not None:
-                        self._lastFeed = pat.group(2)
-
-                    # Modify sent g-code to reflect overrided feed
-                    # for controllers without override support
-                    if not OCV.TK_MCTRL.has_override:
-                        if OCV.CD["_OvChanged"]:
-                            OCV.CD["_OvChanged"] = False
-                            self._newFeed = float(
-                                self._lastFeed)*OCV.CD["_OvFeed"]/100.0
-                            if pat is None and self._newFeed != 0 \
-                               and not tosend.startswith("$"):
-                                tosend = "f{0:f}{1}".format(
-                                    self._newFeed,
-                                    tosend)
-
-                        # Apply override Feed
-                        if OCV.CD["_OvFeed"] != 100 and self._newFeed != 0:
-                            pat = OCV.RE_FEED.match(tosend)
-                            if pat is not None:
-                                try:
-                                    tosend = "{0}f{1:f}{2}\n".format(
-                                        pat.group(1),
-                                        self._newFeed,
-                                        pat.group(3))
-                                except:
-                                    pass
-
-                    # Bookkeeping of the buffers
-                    sline.append(tosend)
-                    cline.append(len(tosend))
-
-            # Anything to receive?
-            if self.serial.inWaiting() or tosend is None:
-                try:
-                    line = str(self.serial.readline().decode()).strip()
-                    if OCV.DEBUG_SER is True:
-                        if line != "" and line != lrcvl:
-                            print("SIO: Rec. line > ", line)
-                            lrcvl = line
-                except:
-                    print("SIO: serial read try failed: ")
-                    self.log.put((Sender.MSG_RECEIVE, str(sys.exc_info()[1])))
-                    self.emptyQueue()
-                    self.close()
-                    return
-#                print ("<R<",repr(line))
-#                print ("*-* stack=",sline,"sum=",sum(cline),"pause=",OCV.s_pause)
-                if not line:
-                    pass
-                elif OCV.TK_MCTRL.parseLine(line, cline, sline):
-                    pass
-                else:
-                    self.log.put((Sender.MSG_RECEIVE, line))
-
-            # Received external message to stop
-            if OCV.s_stop:
-                print("SIO: Stop Requested")
-                self.emptyQueue()
-                tosend = None
-                self.log.put((Sender.MSG_CLEAR, ""))
-                # WARNING if runLines == maxint then it means we are
-                # still preparing/sending lines from OKKCNC.run(),
-                # so don't stop
-                if self._runLines != sys.maxsize:
-                    print("SIO: OCV.s_stop and runlines != maxsize")
-                    OCV.s_stop = False
-
-#            print "tosend='%s'"%(repr(tosend)),"stack=",sline,
-#                "sum=",sum(cline),"wait=",wait,"pause=",OCV.s_pause
-            if tosend is not None and sum(cline) < RX_BUFFER_SIZE:
-                self._sumcline = sum(cline)
-#                if isinstance(tosend, list):
-#                    self.serial_write(str(tosend.pop(0)))
-#                    if not tosend: tosend = None
-
-#                print ">S>",repr(tosend),"stack=",sline,"sum=",sum(cline)
-                if OCV.TK_MCTRL.gcode_case > 0:
-                    tosend = tosend.upper()
-
-                if OCV.TK_MCTRL.gcode_case < 0:
-                    tosend = tosend.lower()
-
-                self.serial_write(tosend)
-                
-                if OCV.DEBUG_SER is True:
-                    print("SIO: >> ", tosend)
-
-                self.log.put((Sender.MSG_BUFFER, tosend))
-
-                tosend = None
-
-                if not OCV.s_running and t-tg > G_POLL:
-                    tosend = "$G\n"  # FIXME: move to controller specific class
-                    sline.append(tosend)
-                    cline.append(len(tosend))
-                    tg = t
+        # a report not yet shown by the GUI would be overwritten, wait for
+        # the DRO refresh but not more than two intervals of the state
+        if not self._posUpdate or now - self._lastPoll >= 2 * interval:
+            OCV.TK_MCTRL.viewStatusReport()
+            self._lastPoll = now
+
+        # If Override change, attach feed
+        if OCV.CD["_OvChanged"]:
+            OCV.TK_MCTRL.overrideSet()
+
+        return interval
+
+    def pollInterval(self):
+        """@return the seconds between two status reports in the machine
+        state, fast for the moves commanded by hand, as probing or goto
+        """
+        state = OCV.c_state.partition(":")[0]
+
+        if state == "Run" and not OCV.s_running:
+            state = "Jog"
+
+        return self.poll_rates.get(state, SERIAL_POLL)
+
+    def serialError(self, error):
+        """the serial port can't be used, called by the SerialIO threads"""
+        print("SIO: serial read try failed: ")
+        self.log.put((Sender.MSG_RECEIVE, str(error)))
+        self.emptyQueue()
+        self.close()
+
+    def serialLine(self, line):
+        """Parse a received line, called by the SerialIO reader thread"""
+        if OCV.DEBUG_SER is True:
+            if line != "" and line != self._lrcvl:
+                print("SIO: Rec. line > ", line)
+                self._lrcvl = line
+
+        SendLoop.Loop.serialLine(self, line)
+
+    def _serialStop(self):
+        """Drop the commands queued, OCV.s_stop is raised"""
+        print("SIO: Stop Requested")
+        SendLoop.Loop._serialStop(self)
+        # WARNING if runLines == maxint then it means we are
+        # still preparing/sending lines from OKKCNC.run(),
+        # so don't stop
+        if self._runLines != sys.maxsize:
+            print("SIO: OCV.s_stop and runlines != maxsize")
+            OCV.s_stop = False
@@ -0,0 +1,333 @@
+# -*- coding: ascii -*-
+"""SerialIO.py
+
+This module contains the serial I/O engine used by Sender, it has no
+dependency on Tk or on the rest of the program, so it can be used alone
+(see tests/bench_serial.py).
+
+Three threads are used, each one sleeping until there is something to do:
+    reader  blocks on the serial port, every line received is passed to
+            the on_line callback and then on_send is called, as an "ok"
+            can make room in the controller buffer
+    writer  waits to be woken up, by a put in an EventQueue or by wake(),
+            and calls on_send that sends what can be sent
+    poll    calls on_poll at the interval it returns, for the status
+            reports
+
+The writer is also woken up every poll interval, for the state changes
+made by flags (pause, stop) not notified with wake().
+
+TxBuffer keeps the lines sent to the controller and not yet acknowledged,
+with their total length, for the character counting protocol, TxPacker
+joins the lines that fit in the controller buffer in a single write.
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import select
+import sys
+import threading
+from collections import deque
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+# seconds between two on_poll calls, if it doesn't return the interval
+POLL = 0.125
+# maximum bytes read at once
+READ_SIZE = 4096
+
+# translation tables of the GCode case, see TxPacker.take
+UPPER = bytes(bytearray(
+    c - 32 if 97 <= c <= 122 else c for c in range(256)))
+LOWER = bytes(bytearray(
+    c + 32 if 65 <= c <= 90 else c for c in range(256)))
+
+
+class EventQueue(Queue):
+    """Queue calling listener after every put"""
+
+    def __init__(self, maxsize=0):
+        Queue.__init__(self, maxsize)
+        self.listener = None
+
+    def _put(self, item):
+        Queue._put(self, item)
+
+        if self.listener is not None:
+            self.listener()
+
+
+class TxBuffer(object):
+    """Lines sent to the controller and not yet acknowledged, the oldest
+    first, size is the number of characters they use in the controller
+    receive buffer
+    """
+
+    def __init__(self):
+        self.lines = deque()
+        self.size = 0
+
+    def append(self, line):
+        """Add a line sent"""
+        self.lines.append(line)
+        self.size += len(line)
+
+    def pop(self):
+        """Remove the oldest line, acknowledged by the controller
+        @return the line or None if the buffer is empty
+        """
+        try:
+            line = self.lines.popleft()
+        except IndexError:
+            return None
+
+        self.size -= len(line)
+        return line
+
+    def clear(self):
+        """Remove all the lines, after a reset of the controller"""
+        self.lines.clear()
+        self.size = 0
+
+    def fits(self, line, capacity):
+        """@return True if line can be sent with a receive buffer of
+        capacity characters
+        """
+        return self.size + len(line) < capacity
+
+    def fill(self, capacity):
+        """@return the percentage of the receive buffer used"""
+        return self.size * 100. / capacity
+
+    def __len__(self):
+        return len(self.lines)
+
+
+class TxPacker(object):
+    """Lines to send packed in a bytearray allocated once, written to the
+    port with a single call
+    """
+
+    def __init__(self, size=READ_SIZE):
+        self.data = bytearray(size)
+        self.length = 0
+        self.lines = 0
+
+    def add(self, line):
+        """Append a line, str or bytes
+        @return False if the line can't be encoded in ascii
+        """
+        if not isinstance(line, bytes):
+            try:
+                line = line.encode("ascii")
+            except UnicodeEncodeError:
+                return False
+
+        end = self.length + len(line)
+        # grows the bytearray only when it is too short
+        self.data[self.length:end] = line
+        self.length = end
+        self.lines += 1
+        return True
+
+    def take(self, case=0):
+        """Empty the packer
+        @param case >0 to send upper case, <0 lower case
+        @return the bytes to write, a view valid until the next add
+        """
+        data = memoryview(self.data)[:self.length]
+
+        if case > 0:
+            data = data.tobytes().translate(UPPER)
+        elif case < 0:
+            data = data.tobytes().translate(LOWER)
+
+        self.length = 0
+        self.lines = 0
+        return data
+
+    def __len__(self):
+        return self.length
+
+
+class SerialIO(object):
+    """Reader, writer and poll threads of a serial port
+    @param port pyserial port opened with a read timeout, the timeout is
+        the time needed by stop() to end the reader thread, a POSIX port
+        is read directly from its file descriptor
+    @param on_line called by the reader for every line received, without
+        the line terminator
+    @param on_send called by the writer when woken up and by the reader
+        after the lines received, it has to be thread safe
+    @param on_poll called every poll seconds, None for no polling, it can
+        return the seconds to the next call, as the machine state changes
+    @param on_error called with the exception when the port can't be
+        used, the threads are then stopped
+    """
+
+    def __init__(self, port, on_line, on_send, on_poll=None, on_error=None,
+                 poll=POLL):
+        self.port = port
+        self.on_line = on_line
+        self.on_send = on_send
+        self.on_poll = on_poll
+        self.on_error = on_error
+        self.poll = poll
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._error_lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        """Start the threads"""
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._reader, name="SerialIO.reader"),
+            threading.Thread(target=self._writer, name="SerialIO.writer")]
+
+        if self.on_poll is not None:
+            self._threads.append(
+                threading.Thread(target=self._poller, name="SerialIO.poll"))
+
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self, wait=True):
+        """Stop the threads, waiting them to end if wait is True and it is
+        not called by the callbacks
+        """
+        self._stop.set()
+        self._wake.set()
+
+        if not wait or threading.current_thread() in self._threads:
+            return
+
+        for thread in self._threads:
+            thread.join()
+
+    def running(self):
+        """@return True if the threads are running"""
+        return not self._stop.is_set() and \
+            any(thread.is_alive() for thread in self._threads)
+
+    def wake(self):
+        """Wake up the writer"""
+        self._wake.set()
+
+    def _reader(self):
+        """thread reading the lines"""
+        data = b""
+
+        while not self._stop.is_set():
+            try:
+                chunk = self._read()
+            except Exception:
+                self._error(sys.exc_info()[1])
+                break
+
+            if not chunk:
+                continue
+
+            data += chunk
+
+            if b"\n" not in data:
+                continue
+
+            lines = data.split(b"\n")
+            data = lines.pop()
+
+            for line in lines:
+                self.on_line(line.decode("utf-8", "replace").strip())
+
+            # an "ok" can make room in the controller buffer, sending from
+            # here avoids to switch to the writer thread
+            try:
+                self.on_send()
+            except Exception:
+                self._error(sys.exc_info()[1])
+                break
+
+    def _read(self):
+        """@return the bytes received, waiting at most the port timeout"""
+        fd = getattr(self.port, "fd", None)
+
+        if fd is None:
+            # not a POSIX serial port, block until at least one byte
+            chunk = self.port.read(1)
+
+            if chunk:
+                waiting = self.port.inWaiting()
+
+                if waiting:
+                    chunk += self.port.read(min(waiting, READ_SIZE))
+
+            return chunk
+
+        # a single system call for all the bytes received
+        timeout = self.port.timeout
+
+        if timeout is None:
+            timeout = self.poll
+
+        if not select.select([fd], [], [], timeout)[0]:
+            return b""
+
+        chunk = os.read(fd, READ_SIZE)
+
+        if not chunk:
+            # as pyserial does for a disconnected device
+            raise IOError("device reports readiness to read but returned "
+                          "no data (device disconnected?)")
+
+        return chunk
+
+    def _writer(self):
+        """thread sending when woken up"""
+        while not self._stop.is_set():
+            self._wake.wait(self.poll)
+            self._wake.clear()
+
+            if self._stop.is_set():
+                break
+
+            try:
+                self.on_send()
+            except Exception:
+                self._error(sys.exc_info()[1])
+                break
+
+    def _poller(self):
+        """thread calling on_poll at the interval it returns"""
+        interval = self.poll
+
+        while not self._stop.wait(interval):
+            try:
+                interval = self.on_poll()
+            except Exception:
+                self._error(sys.exc_info()[1])
+                break
+
+            if interval is None:
+                interval = self.poll
+
+    def _error(self, error):
+        """stop the threads and call on_error, only for the first error"""
+        with self._error_lock:
+            if self._stop.is_set():
+                return
+            self._stop.set()
+            self._wake.set()
+
+        if self.on_error is not None:
+            self.on_error(error)
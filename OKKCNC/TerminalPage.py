@@ -44,6 +44,19 @@ class TerminalGroup(CNCRibbon.ButtonGroup):
 
         tkExtra.Balloon.set(but, _("Clear terminal"))
 
+        but = Ribbon.LabelButton(
+            self.frame,
+            self, "<<SaveMetrics>>",
+            image=OCV.icons["stats"],
+            text=_("Metrics"),
+            compound=Tk.TOP,
+            background=OCV.COLOR_BG)
+
+        but.pack(fill=Tk.BOTH, expand=Tk.YES)
+
+        tkExtra.Balloon.set(
+            but, _("Save the streaming metrics of the last run"))
+
 
 class CommandsGroup(CNCRibbon.ButtonMenuGroup):
     """Commands Group"""
@@ -257,6 +270,13 @@ class TerminalFrame(CNCRibbon.PageFrame):
         OCV.TK_TERMBUF.bind("<<Copy>>", self.copy)
         OCV.TK_TERMBUF.bind("<Control-Key-c>", self.copy)
 
+        OCV.TK_TERMSTATS = Tk.Label(self, anchor=Tk.W, justify=Tk.LEFT)
+        OCV.TK_TERMSTATS.grid(row=2, column=0, columnspan=2, sticky=Tk.EW)
+
+        tkExtra.Balloon.set(
+            OCV.TK_TERMSTATS,
+            _("Streaming of the run, rates of the last seconds"))
+
         # ---
         self.grid_columnconfigure(0, weight=1)
         self.grid_rowconfigure(0, weight=1)
@@ -264,6 +284,17 @@ class TerminalFrame(CNCRibbon.PageFrame):
     def clear(self, event=None):
         OCV.TK_TERMINAL.delete(0, Tk.END)
 
+    def showMetrics(self, metrics, fill, log):
+        """Show the rolling view of the metrics of the run"""
+        lines, nbytes = metrics.rates()
+        mean, high = metrics.latency()
+
+        OCV.TK_TERMSTATS.config(text=_(
+            "{0:.1f} lines/s  {1:.0f} bytes/s  ok in {2:.1f} ms "
+            "(max {3:.1f})  buffer {4:.0f}%  starved {5}  "
+            "log {6}").format(
+                lines, nbytes, mean, high, fill, metrics.starved, log))
+
     def copy(self, event):
         self.clipboard_clear()
         self.clipboard_append("\n".join(
@@ -0,0 +1,291 @@
+# -*- coding: ascii -*-
+"""Tokenizer.py
+
+This module contains the GCode line tokenizer used by CNC.compileLine and
+CNC.breakLine.
+
+The line is scanned in a single pass using precompiled regular expressions,
+instead of walking it character by character, the return values are the
+same of the old CNC.compileLine:
+    None        empty line or comment
+    str         plain GCode line without spaces
+    list        mixed list of str and [expressions] compiled by Expression
+    CodeType    python code to execute (assignments and % lines)
+    tuple       (OCV.GSTATE_xxx, args) for the %wait %msg %update directives
+
+Most of the lines of a machine generated file contains only words, they
+are recognized with a single regex search and returned without any further
+processing.
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import re
+import types
+
+import OCV
+import Expression
+
+# characters that need the full scan of the line, lines without them are
+# plain GCode words and optional spaces
+RE_SPECIAL = re.compile(r"[()\[\];=]")
+# tokens are the special characters or runs of any other character
+RE_TOKEN = re.compile(r"[()\[\];=]|[^()\[\];=]+")
+# a word is a letter sequence followed by its value, not letter characters
+# at the start of line or after a space are returned as they are
+RE_WORD = re.compile(r"[A-Za-z]+[^A-Za-z\s]*|[^A-Za-z\s]+")
+# characters that make a "cmd=" sequence not to be an assignment
+ASSIGN_BREAK = " ()-+*/^$"
+# replace the constant [expressions] with their value, see join_constants
+JOIN_CONSTANTS = True
+
+
+def compile_line(line, space=False):
+    """Tokenize and compile a GCode line
+    @return None, str, list, CodeType or tuple see module docstring
+    OCV.comment is set to the comment found in the line
+    """
+    cmd, comment = compile_comment(line, space)
+
+    if comment is not None:
+        OCV.comment = comment
+
+    return cmd
+
+
+def compile_comment(line, space=False):
+    """compile_line without touching OCV.comment, safe in any thread
+    @return (cmd, comment), comment is None for the empty and $ lines
+    that leave OCV.comment as it is
+    """
+    line = line.strip()
+
+    if not line:
+        return None, None
+
+    if line[0] == "$":
+        return line, None
+
+    # to accept #nnn variables as _nnn internally
+    line = line.replace('#', '_')
+
+    # execute literally the line after the first character
+    if line[0] == '%':
+        return compile_directive(line), ""
+
+    # most probably an assignment like  #nnn = expr
+    if line[0] == '_':
+        try:
+            return compile(line, "", "exec"), ""
+        except Exception as e:
+            print("Compile line error: \n")
+            print(e)
+            return None, ""
+
+    # commented line
+    if line[0] == ';':
+        return None, line[1:].strip()
+
+    # plain words, the most common case
+    if RE_SPECIAL.search(line) is None:
+        if space:
+            return line, ""
+        return line.replace(" ", ""), ""
+
+    return compile_tokens(line, space)
+
+
+def compile_directive(line):
+    """Compile a line starting with '%' see compile_line"""
+    pat = OCV.RE_AUX.match(line)
+
+    if pat:
+        cmd = pat.group(1)
+        args = pat.group(2)
+    else:
+        cmd = None
+        args = None
+
+    if cmd == "%wait":
+        return (OCV.GSTATE_WAIT,)
+    elif cmd == "%msg":
+        if not args:
+            args = None
+
+        return (OCV.GSTATE_MSG, args)
+    elif cmd == "%update":
+        return (OCV.GSTATE_UPDATE, args)
+    elif line.startswith("%if running") and not OCV.CD["running"]:
+        # ignore if running lines when not running
+        return None
+    else:
+        try:
+            return compile(line[1:], "", "exec")
+        except Exception:
+            # FIXME show the error!!!!
+            return None
+
+
+def compile_tokens(line, space):
+    """Scan a line containing comments, expressions or assignments
+    @return (cmd, comment) see compile_comment
+    """
+    out = []  # output list of commands
+    cmd = []  # cmd string pieces
+    expr = []  # expression string pieces
+    comment = []  # comment string pieces
+    braket = 0  # bracket count []
+    paren = 0  # parenthesis count ()
+    in_comment = False
+
+    for tok in RE_TOKEN.finditer(line):
+        txt = tok.group()
+
+        if txt == '(':
+            # comment start?
+            paren += 1
+            in_comment = (braket == 0)
+
+            if not in_comment:
+                expr.append(txt)
+
+        elif txt == ')':
+            # comment end?
+            paren -= 1
+
+            if not in_comment:
+                expr.append(txt)
+
+            if paren == 0 and in_comment:
+                in_comment = False
+
+        elif txt == '[':
+            # expression start?
+            if in_comment:
+                comment.append(txt)
+                continue
+
+            braket += 1
+
+            if braket == 1:
+                if cmd:
+                    out.append("".join(cmd))
+                    cmd = []
+            elif OCV.stdexpr:
+                expr.append('(')
+            else:
+                expr.append(txt)
+
+        elif txt == ']':
+            # expression end?
+            if in_comment:
+                comment.append(txt)
+                continue
+
+            braket -= 1
+
+            if braket == 0:
+                try:
+                    out.append(Expression.compile_expr("".join(expr)))
+                except Exception:
+                    # FIXME show the error!!!!
+                    pass
+                expr = []
+            elif OCV.stdexpr:
+                expr.append(')')
+            else:
+                expr.append(txt)
+
+        elif txt == '=':
+            if braket > 0:
+                expr.append(txt)
+            elif in_comment:
+                comment.append(txt)
+            elif not out and paren == 0:
+                # check for assignments (FIXME very bad)
+                cmd_s = "".join(cmd)
+                for c in ASSIGN_BREAK:
+                    if c in cmd_s:
+                        cmd.append(txt)
+                        break
+                else:
+                    try:
+                        return compile(line, "", "exec"), ""
+                    except Exception:
+                        # FIXME show the error!!!!
+                        return None, ""
+
+        elif txt == ';':
+            # Skip everything after the semicolon on normal lines
+            if not in_comment and paren == 0 and braket == 0:
+                comment.append(line[tok.end():])
+                break
+            elif in_comment:
+                comment.append(txt)
+            else:
+                expr.append(txt)
+
+        elif braket > 0:
+            expr.append(txt)
+
+        elif in_comment:
+            comment.append(txt)
+
+        elif space:
+            cmd.append(txt)
+
+        else:
+            cmd.append(txt.replace(" ", ""))
+
+    comment = "".join(comment)
+
+    if cmd:
+        cmd_s = "".join(cmd)
+        if cmd_s:
+            out.append(cmd_s)
+
+    # return output commands
+    if not out:
+        return None, comment
+    if len(out) > 1 and JOIN_CONSTANTS:
+        return join_constants(out), comment
+    if len(out) > 1:
+        return out, comment
+    return out[0], comment
+
+
+def join_constants(out):
+    """Replace the constant expressions with their text, as
+    GCode.evaluate would do, and join the adjacent strings
+    @return the list or a str if all the expressions are constants
+    """
+    joined = []
+
+    for item in out:
+        if isinstance(item, types.CodeType):
+            value = Expression.constant(item)
+
+            if value is not Expression.MISSING:
+                item = Expression.format_value(value)
+
+        if isinstance(item, str) and joined and isinstance(joined[-1], str):
+            joined[-1] += item
+        else:
+            joined.append(item)
+
+    if len(joined) > 1:
+        return joined
+    return joined[0]
+
+
+def split_words(line):
+    """Break a line into words, a space is inserted before every letter
+    sequence and the line is splitted on spaces, as CNC.breakLine did.
+    """
+    return RE_WORD.findall(line)
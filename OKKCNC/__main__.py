@@ -67,6 +67,7 @@ IniFile.conf_file_load()
 import rexx
 import tkExtra
 import bFileDialog
+import BlockPool
 import tkDialogs
 import CAMGen
 import CNCCanvas
@@ -75,8 +76,6 @@ import GCode
 import Heuristic
 import Interface
 
-from CNC import CNC
-
 # import Ribbon
 import Pendant
 from Sender import Sender
@@ -93,8 +92,6 @@ _baud = None
 MONITOR_AFTER = 200 # ms
 DRAW_AFTER = 300 # ms
 
-RX_BUFFER_SIZE = 128
-
 MAX_HISTORY = 500
 
 FILETYPES = [
@@ -200,6 +197,7 @@ class Application(Tk.Toplevel, Sender):
                 i_wdg.bind("<Escape>", self.canvasFocus)
 
         self.bind('<<TerminalClear>>', Page.frames["Terminal"].clear)
+        self.bind('<<SaveMetrics>>', self.saveMetricsDialog)
 
         #--- Probe Bindings
         frame = Page.frames["Probe:Tool"]
@@ -222,7 +220,11 @@ class Application(Tk.Toplevel, Sender):
         OCV.c_state = OCV.STATE_NOT_CONN
         OCV.CD["color"] = OCV.STATECOLOR[OCV.STATE_NOT_CONN]
         self._pendantFileUploaded = None
+        # file being loaded by the Sender loading thread
+        self._loadFilename = None
+        self._loadAutoloaded = False
         self._drawAfter = None  # after handle for modification
+        self._drawPending = False  # draw deferred while a run is prepared
         self._inFocus = False
         #  END - insertCount lines where ok was applied to for $xxx commands
         self._insertCount = 0
@@ -479,6 +481,11 @@ class Application(Tk.Toplevel, Sender):
 
     def draw(self):
         """Draw Canvas"""
+        if self.preparing():
+            # the canvas would change the modal state used by comp_level
+            self._drawPending = True
+            return
+
         view = CNCCanvas.VIEWS.index(OCV.TK_CANVAS_F.view.get())
         OCV.TK_CANVAS_F.canvas.draw(view)
         self.selectionChange()
@@ -640,6 +647,7 @@ class Application(Tk.Toplevel, Sender):
             return
 
         OCV.TK_CANVAS_F.canvas.cameraOff()
+        BlockPool.close()
         Sender.quit(self)
         self.saveConfig()
         self.destroy()
@@ -684,7 +692,11 @@ class Application(Tk.Toplevel, Sender):
             return "break"
 
     def unselectAll(self, event=None):
-        """Editor Unselect All"""
+        """Editor Unselect All, or cancel the file loading"""
+        if Sender.loadCancel(self):
+            self.setStatus(_("Cancelling file loading ..."))
+            return "break"
+
         focus = self.focus_get()
         if focus in (OCV.TK_CANVAS_F.canvas, OCV.TK_EDITOR):
             OCV.TK_RIBBON.changePage("Editor")
@@ -1443,6 +1455,21 @@ class Application(Tk.Toplevel, Sender):
 
         return "break"
 
+    def saveMetricsDialog(self, event=None):
+        """Save the streaming metrics of the last run as CSV or JSON"""
+        filename = bFileDialog.asksaveasfilename(
+            master=self,
+            title=_("Save metrics"),
+            initialfile=time.strftime("run-%Y%m%d-%H%M%S.csv"),
+            filetypes=[(_("CSV"), "*.csv"),
+                       (_("JSON"), "*.json"),
+                       (_("All"), "*")])
+
+        if filename:
+            self.saveMetrics(filename)
+
+        return "break"
+
     def fileModified(self):
         """Ask to save the file if Gcode is modified after loaded"""
         if self.gcode.isModified():
@@ -1491,6 +1518,18 @@ class Application(Tk.Toplevel, Sender):
                 if ans == tkMessageBox.YES or ans is True:
                     self.gcode.probe.init()
 
+        if ext not in (".probe", ".orient"):
+            # gcode is read in the Sender loading thread, the interface is
+            # updated by _monitorLoad when it is done
+            if not Sender.loadBackground(self, filename):
+                self.setStatus(_("Another file is loading"))
+                return
+
+            self._loadFilename = filename
+            self._loadAutoloaded = autoloaded
+            self.setStatus(_("Loading: {0} ...").format(filename), True)
+            return
+
         self.setStatus(_("Loading: {0} ...").format(filename), True)
         Sender.load(self, filename)
 
@@ -1504,11 +1543,10 @@ class Application(Tk.Toplevel, Sender):
             self.event_generate("<<OrientSelect>>", data=0)
             self.event_generate("<<OrientUpdate>>")
 
-        else:
-            OCV.TK_EDITOR.selectClear()
-            self.reset_canvas()
-            Page.frames["Tools"].populate()
+        self.loadEnded(filename, autoloaded)
 
+    def loadEnded(self, filename, autoloaded=False):
+        """Show the loaded file in status and title"""
         if autoloaded:
             self.setStatus(
                 _("'{0}' reloaded at '{1}'").format(
@@ -1556,8 +1594,11 @@ class Application(Tk.Toplevel, Sender):
         if filename:
             fn, ext = os.path.splitext(filename)
             ext = ext.lower()
-            gcode = GCode.GCode()
-            gcode.load(filename)
+            result = self.gcode.read_file(filename, False)
+
+            if result is None:
+                return
+
             sel = OCV.TK_EDITOR.getSelectedBlocks()
 
             if not sel:
@@ -1565,8 +1606,7 @@ class Application(Tk.Toplevel, Sender):
             else:
                 pos = sel[-1]
 
-            self.addUndo(self.gcode.insBlocksUndo(pos, gcode.blocks))
-            del gcode
+            self.addUndo(self.gcode.insBlocksUndo(pos, result[0]))
             self.reset_canvas()
 
     def clear_gcode(self):
@@ -1617,19 +1657,6 @@ class Application(Tk.Toplevel, Sender):
 
     #--- Run GCode
 
-    def checkStop(self):
-        """An entry function should be called periodically during compiling
-        to check if the Pause or Stop buttons are pressed
-        @return true if the compile has to abort
-        """
-
-        try:
-            self.update()  # very tricky function of Tk
-        except Tk.TclError:
-            pass
-        
-        return OCV.s_stop
-
     def run(self, lines=None):
         """Send enabled gcode file to CNC machine """
 
@@ -1650,6 +1677,10 @@ class Application(Tk.Toplevel, Sender):
                 parent=self)
             return
 
+        if Sender.loading(self):
+            self.setStatus(_("Wait the end of file loading"))
+            return
+
         # probably is better to assign cleanAfter here, as there are changes
         # that the two conditiong above reject the run request
         self.cleanAfter = True  # Clean when this operation stops
@@ -1679,68 +1710,14 @@ class Application(Tk.Toplevel, Sender):
             except:
                 pass
 
-        if lines is None:
-            OCV.TK_STATUSBAR.setLimits(0, 9999)
-            OCV.TK_STATUSBAR.setProgress(0, 0)
-
-            self._paths = self.gcode.comp_level(self.queue, self.checkStop)
-
-            if self._paths is None:
-                self.emptyQueue()
-                self.jobDone("R")
-                return
-            elif not self._paths:
-                self.runEnded("run No GCode Loaded")
-                tkMessageBox.showerror(
-                    _("Empty gcode"),
-                    _("No gcode file was loaded"),
-                    parent=self)
-                return
-
-            # reset colors
-            before = time.time()
-            for ij in self._paths:  # Slow loop
-
-                if not ij:
-                    continue
-
-                path = self.gcode[ij[0]].path(ij[1])
-
-                if path:
-                    color = OCV.TK_CANVAS_F.canvas.itemcget(path, "fill")
-                    if color != OCV.COLOR_ENABLE:
-                        OCV.TK_CANVAS_F.canvas.itemconfig(
-                            path,
-                            width=1,
-                            fill=OCV.COLOR_ENABLE)
-                    # Force a periodic update since this loop can take time
-                    if time.time() - before > 0.25:
-                        self.update()
-                        before = time.time()
-
-            # the buffer of the machine should be empty?
-            self._runLines = len(self._paths) + 1  # plus the wait
-            #print("DBG: runlines assigned by path")
-        else:
-            # empty the gctos value
-            OCV.gctos = []
-            n = 1        # including one wait command
-            for line in CNC.compile_pgm(lines):
-                if line is not None:
-                    if isinstance(line, str):
-                        self.queue.put(line + "\n")
-                        OCV.gctos.append(line)
-                    else:
-                        self.queue.put(line)
-                        OCV.gctos.append(line)
-                    n += 1
-            self._runLines = n  # set it at the end to be sure that all lines are queued
-
-        self.queue.put((OCV.GSTATE_WAIT,))  # wait at the end to become idle
+        # the lines are prepared by a Sender thread while the first ones
+        # are already sent, see _monitorRun
+        OCV.TK_STATUSBAR.setLimits(0, 9999)
+        OCV.TK_STATUSBAR.setProgress(0, 0)
+        Sender.runBackground(self, lines)
 
         self.setStatus(_("Running..."))
 
-        OCV.TK_STATUSBAR.setLimits(0, self._runLines)
         OCV.TK_STATUSBAR.configText(fill="White")
         OCV.TK_STATUSBAR.config(background=COLOR_BG_RUN)
 
@@ -1814,7 +1791,7 @@ class Application(Tk.Toplevel, Sender):
             return Sender.open(self, device, baudrate)
         except:
             OCV.serial_open = False
-            self.thread = None
+            self.sio = None
             tkMessageBox.showerror(
                 _("Error opening serial"),
                 sys.exc_info()[1],
@@ -1838,10 +1815,15 @@ class Application(Tk.Toplevel, Sender):
         # dump in the terminal what ever you can in less than 0.1s
         inserted = False
         _last_sent = ""
+        # messages waiting, for the metrics
+        logs = self.log.qsize()
 
         while self.log.qsize() > 0 and time.time()-t < 0.1:
             try:
                 msg, line = self.log.get_nowait()
+                if isinstance(line, bytes):
+                    # SendStream records are sent as bytes
+                    line = line.decode("ascii", "replace")
                 line = str(line).rstrip("\n")
                 inserted = True
                 #print("msg >> ", msg)
@@ -1920,6 +1902,18 @@ class Application(Tk.Toplevel, Sender):
         if inserted:
             OCV.TK_TERMINAL.see(Tk.END)
 
+        # Sample the streaming of the run
+        if OCV.s_running:
+            fill = self.getBufferFill()
+            self.metrics.sample(fill, self.queue.qsize(), logs)
+            Page.frames["Terminal"].showMetrics(self.metrics, fill, logs)
+
+        # Check file loading thread
+        self._monitorLoad()
+
+        # Check run preparing thread
+        self._monitorRun()
+
         # Check pendant/buttons queue
         try:
             cmd = self.pendant.get_nowait()
@@ -1934,6 +1928,11 @@ class Application(Tk.Toplevel, Sender):
 
         # Update position if needed
         if self._posUpdate:
+            if OCV.c_status.reports != self._statusReports:
+                # values of the status reports parsed by GrblStatus
+                self._statusReports = OCV.c_status.reports
+                OCV.c_status.update_dict(OCV.CD)
+
             try:
                 OCV.CD["color"] = OCV.STATECOLOR[OCV.c_state]
             except KeyError:
@@ -1982,8 +1981,14 @@ class Application(Tk.Toplevel, Sender):
             self._update = None
 
         if OCV.s_running:
-            self.proc_line_n = self._runLines - self.queue.qsize()
-            OCV.TK_STATUSBAR.setProgress(self.proc_line_n, self._gcount)
+            if self._runLines == sys.maxsize:
+                # still preparing, the number of lines is not known
+                OCV.TK_STATUSBAR.setProgress(
+                    0, 0, _("Preparing... {0:d} lines done").format(
+                        self._gcount))
+            else:
+                self.proc_line_n = self._runLines - self.queue.qsize()
+                OCV.TK_STATUSBAR.setProgress(self.proc_line_n, self._gcount)
             OCV.CD["msg"] = OCV.TK_STATUSBAR.msg
             b_fill = Sender.getBufferFill(self)
             OCV.TK_BUFFERBAR.setProgress(b_fill)
@@ -1997,20 +2002,17 @@ class Application(Tk.Toplevel, Sender):
                 print("match ", _last_sent, show_line)
 
             if self._selectI >= 0 and self._paths:
+                done = []
                 while self._selectI <= self._gcount and\
                         self._selectI < len(self._paths):
 
                     if self._paths[self._selectI]:
-                        i, j = self._paths[self._selectI]
-                        path = self.gcode[i].path(j)
-                        if path:
-                            OCV.TK_CANVAS_F.canvas.itemconfig(
-                                path,
-                                width=2,
-                                fill=OCV.COLOR_PROCESS)
+                        done.append(self._paths[self._selectI])
 
                     self._selectI += 1
 
+                OCV.TK_CANVAS_F.canvas.processPaths(done)
+
             if self._gcount >= self._runLines:
                 self.runEnded("_SM")
                 self.jobDone("_SM")
@@ -2020,6 +2022,100 @@ class Application(Tk.Toplevel, Sender):
                 self.runEnded("_PE")
                 self.jobDone("_PE")
 
+    def _monitorLoad(self):
+        """Drain the messages of the Sender file loading thread"""
+        while self.loadQueue.qsize() > 0:
+            try:
+                msg, data = self.loadQueue.get_nowait()
+            except Empty:
+                break
+
+            if msg == Sender.LOAD_PROGRESS:
+                done, total = data
+                if total > 0:
+                    self.setStatus(_("Loading: {0} ... {1:d}%").format(
+                        self._loadFilename, int(100.0 * done / total)))
+
+            elif msg == Sender.LOAD_DONE:
+                filename, result = data
+                Sender.loadDone(self, filename, result)
+                OCV.TK_EDITOR.selectClear()
+                self.reset_canvas()
+                Page.frames["Tools"].populate()
+                self.loadEnded(filename, self._loadAutoloaded)
+
+            elif msg == Sender.LOAD_CANCEL:
+                self.setStatus(
+                    _("Loading of '{0}' cancelled").format(data[0]))
+
+            elif msg == Sender.LOAD_ERROR:
+                self.setStatus(
+                    _("Error loading '{0}': {1}").format(*data))
+
+    def _monitorRun(self):
+        """Drain the messages of the Sender run preparing thread"""
+        if self._drawPending and not self.preparing():
+            self._drawPending = False
+            self.draw()
+
+        while self.runQueue.qsize() > 0:
+            try:
+                msg, data = self.runQueue.get_nowait()
+            except Empty:
+                break
+
+            if not OCV.s_running or self._runLines != sys.maxsize:
+                # run ended before the end of the preparation
+                continue
+
+            paths, count = data
+
+            if msg == Sender.RUN_CANCEL:
+                self.emptyQueue()
+                self.jobDone("R")
+
+            elif paths is not None and not paths:
+                self.runEnded("run No GCode Loaded")
+                tkMessageBox.showerror(
+                    _("Empty gcode"),
+                    _("No gcode file was loaded"),
+                    parent=self)
+
+            else:
+                if paths is not None:
+                    self._resetPathColors(paths)
+                    self._paths = paths
+
+                # the buffer of the machine should be empty?
+                self._runLines = count + 1  # plus the wait
+                OCV.TK_STATUSBAR.setLimits(0, self._runLines)
+
+    def _resetPathColors(self, paths):
+        """Reset the colors of the paths of a run"""
+        OCV.TK_CANVAS_F.canvas.resetProcess()
+        before = time.time()
+        done = set()
+        for ij in paths:  # Slow loop
+
+            if not ij:
+                continue
+
+            path = self.gcode[ij[0]].path(ij[1])
+
+            # the lines of a merged path share its item
+            if path and path not in done:
+                done.add(path)
+                color = OCV.TK_CANVAS_F.canvas.itemcget(path, "fill")
+                if color != OCV.COLOR_ENABLE:
+                    OCV.TK_CANVAS_F.canvas.itemconfig(
+                        path,
+                        width=1,
+                        fill=OCV.COLOR_ENABLE)
+                # Force a periodic update since this loop can take time
+                if time.time() - before > 0.25:
+                    self.update()
+                    before = time.time()
+
     def monitorSerial(self):
         """'thread' timed function looking for messages in the serial thread
         and reporting back in the terminal
@@ -17,7 +17,7 @@ class Controller(_GenericGRBL):
         self.master = master
         #print("grbl0 loaded")
 
-    def parseBracketAngle(self, line, cline):
+    def parseBracketAngle(self, line, txbuf):
         self.master.sio_status = False
         pat = STATUSPAT.match(line)
         if pat:
@@ -38,9 +38,9 @@ class Controller(_GenericGRBL):
 
             # Machine is Idle buffer is empty
             # stop waiting and go on
-            #print "<<< WAIT=",wait,sline,pat.group(1),sum(cline)
+            #print "<<< WAIT=",wait,txbuf.lines,pat.group(1),txbuf.size
             #print ">>>", line
-            if self.master.sio_wait and not cline and pat.group(1) not in ("Run", "Jog", "Hold"):
+            if self.master.sio_wait and not txbuf and pat.group(1) not in ("Run", "Jog", "Hold"):
                 #print ">>>",line
                 self.master.sio_wait = False
                 #print "<<< NO MORE WAIT"
@@ -4,6 +4,7 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import OCV
+import GrblStatus
 from _GenericGRBL import _GenericGRBL
 from _GenericController import STATUSPAT, POSPAT, TLOPAT, DOLLARPAT, SPLITPAT, VARPAT
 
@@ -48,7 +49,8 @@ class Controller(_GenericGRBL):
     def overrideSet(self):
         OCV.CD["_OvChanged"] = False  # Temporary
         # Check feed
-        diff = OCV.CD["_OvFeed"] - OCV.CD["OvFeed"]
+        # the values of the last report, OCV.CD is updated by the GUI
+        diff = OCV.CD["_OvFeed"] - OCV.c_status.ovfeed
         if diff == 0:
             pass
         elif OCV.CD["_OvFeed"] == 100:
@@ -67,7 +69,7 @@ class Controller(_GenericGRBL):
             OCV.CD["_OvChanged"] = diff < -1
         # Check rapid
         target = OCV.CD["_OvRapid"]
-        current = OCV.CD["OvRapid"]
+        current = OCV.c_status.ovrapid
         if target == current:
             pass
         elif target == 100:
@@ -81,7 +83,7 @@ class Controller(_GenericGRBL):
         elif target == 25:
             self.master.serial_write_byte(OV_RAPID_25)
         # Check Spindle
-        diff = OCV.CD["_OvSpindle"] - OCV.CD["OvSpindle"]
+        diff = OCV.CD["_OvSpindle"] - OCV.c_status.ovspindle
         if diff == 0:
             pass
         elif OCV.CD["_OvSpindle"] == 100:
@@ -99,88 +101,41 @@ class Controller(_GenericGRBL):
             self.master.serial_write_byte(OV_SPINDLE_d1)
             OCV.CD["_OvChanged"] = diff < -1
 
-    def parseBracketAngle(self, line, cline):
+    def parseBracketAngle(self, line, txbuf):
         self.master.sio_status = False
-        fields = line[1:-1].split("|")
-        OCV.CD["pins"] = ""
+        status = OCV.c_status
+        status.digits = OCV.digits
+        valid = status.parse(line)
+        state = status.state
 
         # Report if state has changed
-        if OCV.c_state != fields[0] or OCV.s_runningPrev != OCV.s_running:
-            self.master.controllerStateChange(fields[0])
+        if OCV.c_state != state or OCV.s_runningPrev != OCV.s_running:
+            self.master.controllerStateChange(state)
         OCV.s_runningPrev = OCV.s_running
-        OCV.c_state = fields[0]
-
-        for field in fields[1:]:
-            word = SPLITPAT.split(field)
-            if word[0] == "MPos":
-                try:
-                    OCV.CD["mx"] = float(word[1])
-                    OCV.CD["my"] = float(word[2])
-                    OCV.CD["mz"] = float(word[3])
-                    OCV.CD["wx"] = round(OCV.CD["mx"]-OCV.CD["wcox"], OCV.digits)
-                    OCV.CD["wy"] = round(OCV.CD["my"]-OCV.CD["wcoy"], OCV.digits)
-                    OCV.CD["wz"] = round(OCV.CD["mz"]-OCV.CD["wcoz"], OCV.digits)
-                    self.master._posUpdate = True
-                except (ValueError,IndexError):
-                    OCV.c_state = W_MSG1.format(word[0], line)
-                    self.master.log.put((self.master.MSG_RECEIVE, OCV.c_state))
-                    break
-            elif word[0] == "F":
-                try:
-                    OCV.CD["curfeed"] = float(word[1])
-                except (ValueError, IndexError):
-                    OCV.c_state = W_MSG1.format(word[0], line)
-                    self.master.log.put((self.master.MSG_RECEIVE, OCV.c_state))
-                    break
-            elif word[0] == "FS":
-                try:
-                    OCV.CD["curfeed"]    = float(word[1])
-                    OCV.CD["curspindle"] = float(word[2])
-                except (ValueError, IndexError):
-                    OCV.c_state = W_MSG1.format(word[0], line)
-                    self.master.log.put((self.master.MSG_RECEIVE, OCV.c_state))
-                    break
-            elif word[0] == "Bf":
-                try:
-                    OCV.CD["planner"] = int(word[1])
-                    OCV.CD["rxbytes"] = int(word[2])
-                except (ValueError, IndexError):
-                    OCV.c_state = W_MSG1.format(word[0], line)
-                    self.master.log.put((self.master.MSG_RECEIVE, OCV.c_state))
-                    break
-            elif word[0] == "Ov":
-                try:
-                    OCV.CD["OvFeed"]    = int(word[1])
-                    OCV.CD["OvRapid"]   = int(word[2])
-                    OCV.CD["OvSpindle"] = int(word[3])
-                except (ValueError, IndexError):
-                    OCV.c_state = W_MSG1.format(word[0], line)
-                    self.master.log.put((self.master.MSG_RECEIVE, OCV.c_state))
-                    break
-            elif word[0] == "WCO":
-                try:
-                    OCV.CD["wcox"] = float(word[1])
-                    OCV.CD["wcoy"] = float(word[2])
-                    OCV.CD["wcoz"] = float(word[3])
-                except (ValueError,IndexError):
-                    OCV.c_state = W_MSG1.format(word[0],line)
-                    self.master.log.put((self.master.MSG_RECEIVE, OCV.c_state))
-                    break
-            elif word[0] == "Pn":
-                try:
-                    OCV.CD["pins"] = word[1]
-                    if 'S' in word[1]:
-                        if OCV.c_state == 'Idle' and not OCV.s_running:
-                            print("Stream requested by CYCLE START machine button")
-                            self.master.event_generate("<<Run>>", when = 'tail')
-                        else:
-                            print("Ignoring machine stream request, because of state: ",
-                                    OCV.c_state, OCV.s_running)
-                except (ValueError,IndexError):
-                    break
+        OCV.c_state = state
+
+        fields = status.fields
+
+        if fields & (GrblStatus.MPOS | GrblStatus.WPOS):
+            self.master._posUpdate = True
+
+        if fields & GrblStatus.BF:
+            self.master.bufferReport(state, status.planner, status.rxbytes)
+
+        if fields & GrblStatus.PN and 'S' in status.pins:
+            if state == 'Idle' and not OCV.s_running:
+                print("Stream requested by CYCLE START machine button")
+                self.master.event_generate("<<Run>>", when = 'tail')
+            else:
+                print("Ignoring machine stream request, because of state: ",
+                        state, OCV.s_running)
+
+        if not valid:
+            OCV.c_state = W_MSG1.format(status.error, line)
+            self.master.log.put((self.master.MSG_RECEIVE, OCV.c_state))
 
         # Machine is Idle buffer is empty stop waiting and go on
-        if self.master.sio_wait and not cline and fields[0] not in ("Run", "Jog", "Hold"):
+        if self.master.sio_wait and not txbuf and state not in ("Run", "Jog", "Hold"):
             self.master.sio_wait = False
             self.master._gcount += 1
             print("GC+ GRBL1 buffer Idle")
@@ -194,9 +149,9 @@ class Controller(_GenericGRBL):
             OCV.CD["prbz"] = float(word[3])
 
             self.master.gcode.probe.add(
-                 OCV.CD["prbx"]-OCV.CD["wcox"],
-                 OCV.CD["prby"]-OCV.CD["wcoy"],
-                 OCV.CD["prbz"]-OCV.CD["wcoz"])
+                 OCV.CD["prbx"]-OCV.c_status.wcox,
+                 OCV.CD["prby"]-OCV.c_status.wcoy,
+                 OCV.CD["prbz"]-OCV.c_status.wcoz)
             self.master._probeUpdate = True
             OCV.CD[word[0]] = word[1:]
         if word[0] == "G92":
@@ -44,7 +44,7 @@ class Controller(_GenericController):
 	def grblHelp(self):
 		self.master.serial_write("help\n")
 
-	def parseBracketAngle(self, line, cline):
+	def parseBracketAngle(self, line, txbuf):
 		# <Idle|MPos:68.9980,-49.9240,40.0000,12.3456|WPos:68.9980,-49.9240,40.0000|F:12345.12|S:1.2>
 		ln= line[1:-1] # strip off < .. >
 
@@ -71,7 +71,7 @@ class Controller(_GenericController):
 
 		# Machine is Idle buffer is empty
 		# stop waiting and go on
-		if self.master.sio_wait and not cline and l[0] not in ("Run","Jog", "Hold"):
+		if self.master.sio_wait and not txbuf and l[0] not in ("Run","Jog", "Hold"):
 		        self.master.sio_wait = False
 		        self.master._gcount += 1
 
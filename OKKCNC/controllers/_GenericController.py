@@ -202,7 +202,11 @@ class _GenericController:
         self.master.sendGCode("G43.1 Z{0}".format(TLO))  # restore TLO
         self.viewState()
 
-    def parseLine(self, line, cline, sline):
+    def parseLine(self, line, txbuf):
+        """Parse a line received from the controller, an "ok" or an error
+        remove the oldest line from txbuf, the SerialIO.TxBuffer of the
+        lines sent and not yet acknowledged
+        """
         if not line:
             return True
 
@@ -210,7 +214,7 @@ class _GenericController:
             if not self.master.sio_status:
                 self.master.log.put((self.master.MSG_RECEIVE, line))
             else:
-                self.parseBracketAngle(line, cline)
+                self.parseBracketAngle(line, txbuf)
 
         elif line[0] == "[":
             self.master.log.put((self.master.MSG_RECEIVE, line))
@@ -221,11 +225,11 @@ class _GenericController:
             self.master.log.put((self.master.MSG_ERROR, line))
             self.master._gcount += 1
             print("GC+ ERROR or ALARM")
-            if cline:
-                del cline[0]
-
-            if sline:
-                OCV.CD["errline"] = sline.pop(0)
+            if txbuf:
+                errline = txbuf.pop()
+                if isinstance(errline, bytes):
+                    errline = errline.decode("ascii")
+                OCV.CD["errline"] = errline
 
             if not OCV.s_alarm:
                 self.master._posUpdate = True
@@ -240,10 +244,7 @@ class _GenericController:
         elif line.find("ok")>=0:
             self.master.log.put((self.master.MSG_OK, line))
             self.master._gcount += 1
-            if cline:
-                del cline[0]
-            if sline:
-                del sline[0]
+            txbuf.pop()
 
 
         elif line[0] == "$":
@@ -256,8 +257,7 @@ class _GenericController:
             #tg = time.time()
             self.master.log.put((self.master.MSG_RECEIVE, line))
             OCV.s_stop = True
-            del cline[:]  # After reset clear the buffer counters
-            del sline[:]
+            txbuf.clear()  # After reset clear the buffer counters
             OCV.CD["version"] = line.split()[1]
             # Detect controller
             if self.master.controller in ("GRBL0", "GRBL1"):
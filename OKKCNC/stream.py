@@ -0,0 +1,508 @@
+# -*- coding: ascii -*-
+"""stream.py
+
+Headless streaming of a GCode file without Tk, for a small computer next
+to the machine, as a Raspberry Pi:
+
+    python -m OKKCNC.stream [options] file.ngc
+
+The file is read and prepared by GCode, with the probe map of the
+autolevel if given, and sent by SerialIO through the controller plugin
+set in the ini. Streamer plays for the plugin the part of Sender, without
+the GUI: the feed override of the controllers without it and the
+commands of the GUI are not supported.
+
+The progress is printed every second, the exit code is 0 when the run is
+completed, 1 on errors and 2 when stopped by Ctrl-C, that sends a feed
+hold and a soft reset to the controller.
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import getopt
+import gettext
+import os
+import sys
+import threading
+import time
+
+try:
+    import __builtin__
+except ImportError:
+    import builtins as __builtin__
+
+try:
+    import ConfigParser
+except ImportError:
+    import configparser as ConfigParser
+
+PRGPATH = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(PRGPATH)
+sys.path.append(os.path.join(PRGPATH, 'lib'))
+sys.path.append(os.path.join(PRGPATH, 'controllers'))
+
+import OCV
+
+# as IniFile does, that can't be imported without Tk
+__builtin__._ = gettext.translation(
+    'OKKCNC',
+    os.path.join(OCV.PRG_PATH, 'locale'),
+    fallback=True).gettext
+
+__builtin__.N_ = lambda message: message
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+from CNC import CNC
+import GCode
+import GrblStatus
+import SendLoop
+import SerialIO
+
+SERIAL_TIMEOUT = 0.10
+# seconds between two status reports
+STATUS_POLL = 0.25
+# seconds between two progress lines
+PROGRESS = 1.0
+# seconds waited for the controller after the reset
+WELCOME_WAIT = 5.0
+# lines of the run prepared ahead of the sender
+RUN_QUEUE_SIZE = 4096
+
+
+class Log(object):
+    """Log queue of Sender, printing the messages instead of showing
+    them in the Terminal page
+    """
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+
+    def put(self, item):
+        msg, line = item
+
+        if isinstance(line, bytes):
+            line = line.decode("ascii", "replace")
+
+        line = str(line).rstrip("\n")
+
+        if msg == Streamer.MSG_ERROR:
+            sys.stderr.write("\n{0}\n".format(line))
+        elif line[:1] == "<":
+            # status report not asked, shown by the progress
+            pass
+        elif msg == Streamer.MSG_RECEIVE or self.verbose:
+            sys.stdout.write("{0}\n".format(line))
+
+
+class Streamer(SendLoop.Loop):
+    """Master of the controller plugin in place of Sender, sending a
+    program with SerialIO and the streaming loop of Sender
+    """
+
+    def __init__(self, controller, verbose=False):
+        self.log = Log(verbose)
+        self.queue = SerialIO.EventQueue(RUN_QUEUE_SIZE)
+        self.gcode = GCode.GCode()
+        self.serial = None
+        self.sio = None
+        self.error = None
+        self.controllers = {}
+        self.controller = None
+        self.initLoop()
+        # flags of the controller plugin
+        self._gcount = 0
+        self._posUpdate = False
+        self._probeUpdate = False
+        self._gUpdate = False
+        self._msg = None
+        self._update = None
+        # lines to acknowledge at the end of the run, see _prepare
+        self._total = None
+        self._welcome = threading.Event()
+        OCV.c_status = GrblStatus.Status(OCV.digits)
+        self.controllerSet(controller)
+
+    def controllerSet(self, ctl):
+        """Set the controller plugin as OCV.TK_MCTRL
+        @return False if it doesn't exist
+        """
+        if ctl not in self.controllers:
+            try:
+                module = __import__(ctl)
+            except ImportError:
+                return False
+
+            self.controllers[ctl] = module.Controller(self)
+
+        self.controller = ctl
+        OCV.CD["controller"] = ctl
+        OCV.TK_MCTRL = self.controllers[ctl]
+        return True
+
+    def load(self, filename, probe=None):
+        """Load the program and the probe map for the autolevel
+        @return an error message or None
+        """
+        if not self.gcode.load(filename):
+            return "Cannot open file {0}".format(filename)
+
+        if probe:
+            try:
+                self.gcode.probe.load(probe)
+            except (IOError, OSError, ValueError):
+                return "Cannot load probe {0}: {1}".format(
+                    probe, sys.exc_info()[1])
+
+        return None
+
+    def open(self, device, baudrate):
+        """Open the serial port resetting the controller, as Sender.open
+        @return True if the controller has answered
+        """
+        self.serial = serial.serial_for_url(
+            device.replace('\\', '\\\\'),  # Escape for windows
+            baudrate,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            timeout=SERIAL_TIMEOUT,
+            xonxoff=False,
+            rtscts=False)
+        # Toggle DTR to reset Arduino
+        try:
+            self.serial.setDTR(0)
+        except IOError:
+            pass
+        time.sleep(1)
+        self.serial.flushInput()
+        try:
+            self.serial.setDTR(1)
+        except IOError:
+            pass
+
+        self._welcome.clear()
+        OCV.c_state = ""
+        self.startLoop()
+        self.sio = SerialIO.SerialIO(
+            self.serial, self.serialLine, self.serialSend, self.serialPoll,
+            self.serialError, STATUS_POLL)
+        self.queue.listener = self.sio.wake
+        self.sio.start()
+        self.serial_write("\n\n")
+
+        if not self._welcome.wait(WELCOME_WAIT):
+            # not reset by DTR, as on a serial to network bridge
+            self.serial_write("\x18")
+            if not self._welcome.wait(WELCOME_WAIT):
+                return False
+
+        # the reset message has stopped the run, see parseLine
+        OCV.s_stop = False
+        return True
+
+    def close(self):
+        """Stop the threads and close the serial port"""
+        if self.sio is not None:
+            self.sio.stop()
+            self.sio = None
+
+        self.queue.listener = None
+
+        if self.serial is not None:
+            try:
+                self.serial.close()
+            except Exception:
+                pass
+
+            self.serial = None
+
+    def run(self):
+        """Stream the loaded program
+        @return the exit code, 0 if completed
+        """
+        # the state of a status report after the reset
+        deadline = time.time() + WELCOME_WAIT
+        while not OCV.c_state and time.time() < deadline:
+            time.sleep(STATUS_POLL)
+
+        if OCV.c_state.upper().startswith("ALARM"):
+            sys.stderr.write("Controller in alarm, home or unlock it\n")
+            return 1
+
+        OCV.s_running = True
+        OCV.CD["running"] = True
+        self._gcount = 0
+        self._total = None
+        self.metrics.reset()
+
+        worker = threading.Thread(target=self._prepare)
+        worker.daemon = True
+        worker.start()
+
+        last = 0.
+
+        while True:
+            time.sleep(0.1)
+
+            if self.error is not None:
+                return 1
+
+            if OCV.s_stop:
+                sys.stderr.write("\nRun stopped\n")
+                return 1
+
+            done = self._total is not None and self._gcount >= self._total
+            now = time.time()
+
+            if done or now - last >= PROGRESS:
+                last = now
+                self.progress()
+
+            if done:
+                break
+
+        OCV.s_running = False
+        OCV.CD["running"] = False
+        sys.stdout.write("\nRun completed in {0:.1f} s\n".format(
+            time.time() - self.metrics.start))
+        return 0
+
+    def abort(self):
+        """Stop the run with a feed hold and a soft reset"""
+        OCV.s_stop = True
+        if self.serial is None:
+            return
+
+        self.serial_write("!")
+        time.sleep(0.5)
+        self.serial_write("\x18")
+        time.sleep(0.5)
+
+    def progress(self):
+        """Print the lines done and the position"""
+        if self._msg is not None:
+            # message of the program
+            self.log.put((Streamer.MSG_RECEIVE, self._msg))
+            self._msg = None
+
+        self.metrics.sample(self.getBufferFill(), self.queue.qsize(), 0)
+        lines, nbytes = self.metrics.rates()
+        status = OCV.c_status
+        total = "?" if self._total is None else self._total
+
+        sys.stdout.write(
+            "\r{0}/{1} lines {2:.0f} lines/s {3:.0f} bytes/s {4} "
+            "X{5:.3f} Y{6:.3f} Z{7:.3f}  ".format(
+                self._gcount, total, lines, nbytes, status.state,
+                status.wx, status.wy, status.wz))
+        sys.stdout.flush()
+
+    def _prepare(self):
+        """Body of the thread queuing the lines of the run, the queue is
+        bounded so the thread waits for the sender
+        """
+        try:
+            paths = self.gcode.comp_level(self.queue, self._stopped)
+        except Exception:
+            self.serialError(sys.exc_info()[1])
+            return
+
+        if paths is None:
+            return
+
+        # wait at the end to become idle
+        self.queue.put((OCV.GSTATE_WAIT,))
+        self._total = len(paths) + 1
+
+    def _stopped(self):
+        """stop function of GCode.comp_level"""
+        return OCV.s_stop
+
+    # ----------------------------------------------------------------------
+    # called by the controller plugin
+    # ----------------------------------------------------------------------
+    def serial_write(self, data):
+        """Serial write"""
+        return self.serial.write(data.encode('ascii'))
+
+    def serial_write_byte(self, data):
+        """Serial write a byte character > 128 decimal"""
+        return self.serial.write(data)
+
+    def sendGCode(self, cmd):
+        """Queue a command, a single line"""
+        if isinstance(cmd, tuple):
+            self.queue.put(cmd)
+        else:
+            self.queue.put(cmd + "\n")
+
+    def controllerStateChange(self, state):
+        pass
+
+    def event_generate(self, *args, **kwargs):
+        pass
+
+    def runEnded(self, msg):
+        OCV.s_running = False
+
+    def stopProbe(self):
+        pass
+
+    def busy(self):
+        pass
+
+    def notBusy(self):
+        pass
+
+    # ----------------------------------------------------------------------
+    # called by the SerialIO threads
+    # ----------------------------------------------------------------------
+    def serialLine(self, line):
+        """Parse a received line, the welcome message after a reset is
+        waited by open
+        """
+        SendLoop.Loop.serialLine(self, line)
+
+        if line[:4] == "Grbl" or line[:13] == "CarbideMotion":
+            self._welcome.set()
+
+    def serialPoll(self):
+        """Ask a status report"""
+        OCV.TK_MCTRL.viewStatusReport()
+        return STATUS_POLL
+
+    def serialError(self, error):
+        """The serial port can't be used"""
+        self.error = error
+        self.log.put((Streamer.MSG_ERROR, str(error)))
+
+
+def usage(ret_code):
+    """Print on console the usage message"""
+    sys.stdout.write(
+        "{0} V{1} [{2}]\n".format(OCV.PRG_NAME, OCV.PRG_VER, OCV.PRG_DATE))
+    sys.stdout.write("Usage: python -m OKKCNC.stream [options] file\n\n")
+    sys.stdout.write("Options:\n")
+    sys.stdout.write("\t-b # | --baud #\t\tSet the baud rate\n")
+    sys.stdout.write("\t-c # | --controller #\tController plugin\n")
+    sys.stdout.write("\t-h | -? | --help\tThis help page\n")
+    sys.stdout.write("\t-i # | --ini #\t\tAlternative ini file\n")
+    sys.stdout.write("\t-l # | --level #\tProbe file for the autolevel\n")
+    sys.stdout.write("\t-m # | --metrics #\tSave the metrics, CSV or JSON\n")
+    sys.stdout.write("\t-p # | --port #\t\tSerial port\n")
+    sys.stdout.write("\t-v | --verbose\t\tPrint the lines sent and the oks\n")
+    sys.stdout.write("\n")
+    sys.exit(ret_code)
+
+
+def main(args=None):
+    """main method"""
+    if args is None:
+        args = sys.argv[1:]
+
+    try:
+        optlist, args = getopt.getopt(
+            args,
+            '?b:c:hi:l:m:p:v',
+            ['help', 'baud=', 'controller=', 'ini=', 'level=', 'metrics=',
+             'port=', 'verbose'])
+    except getopt.GetoptError:
+        usage(1)
+
+    options = {}
+    for opt, val in optlist:
+        if opt in ("-h", "-?", "--help"):
+            usage(0)
+        options[opt.lstrip("-")[0]] = val
+
+    if len(args) != 1:
+        usage(1)
+
+    if serial is None:
+        sys.stderr.write("pyserial is not installed\n")
+        return 1
+
+    OCV.USER_CONFIG = options.get("i", OCV.USER_CONFIG)
+    if not os.path.isfile(OCV.USER_CONFIG):
+        sys.stderr.write(
+            "Configuration file {0} not found\n".format(OCV.USER_CONFIG))
+        return 1
+
+    # the sections missing in the user file are read from the system one
+    OCV.config = ConfigParser.ConfigParser()
+    OCV.config.read([OCV.SYS_CONFIG, OCV.USER_CONFIG])
+
+    try:
+        CNC.loadConfig(OCV.config)
+    except ConfigParser.Error as exc:
+        sys.stderr.write(
+            "Error in configuration file {0}: {1}\n".format(
+                OCV.USER_CONFIG, exc))
+        return 1
+
+    def get(name, default):
+        try:
+            return OCV.config.get("Connection", name)
+        except Exception:
+            return default
+
+    port = options.get("p", get("port", ""))
+    if not port:
+        sys.stderr.write("No serial port, use --port\n")
+        return 1
+
+    streamer = Streamer(
+        options.get("c", get("controller", "GRBL1")), "v" in options)
+
+    if streamer.controller is None:
+        sys.stderr.write("Unknown controller\n")
+        return 1
+
+    try:
+        rx_size = int(get("rxbuffer", 0))
+    except ValueError:
+        rx_size = 0
+
+    if rx_size > 0:
+        streamer.rx_buffer_size = rx_size
+        streamer.rx_buffer_detect = False
+
+    error = streamer.load(args[0], options.get("l"))
+    if error is not None:
+        sys.stderr.write(error + "\n")
+        return 1
+
+    try:
+        if not streamer.open(port, int(options.get("b", get("baud", 115200)))):
+            sys.stderr.write("No answer from the controller\n")
+            streamer.close()
+            return 1
+
+        ret_code = streamer.run()
+    except KeyboardInterrupt:
+        streamer.abort()
+        ret_code = 2
+    except (IOError, OSError, ValueError):
+        sys.stderr.write("{0}\n".format(sys.exc_info()[1]))
+        ret_code = 1
+
+    streamer.close()
+
+    if "m" in options:
+        streamer.metrics.save(options["m"])
+
+    return ret_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
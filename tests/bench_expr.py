@@ -0,0 +1,154 @@
+# -*- coding: ascii -*-
+"""bench_expr.py
+
+Measure the [expressions] of a parametric GCode program, as the lines are
+compiled and evaluated by the draw and the send, comparing compile() and
+eval() of every expression, as done before, with the code objects cached
+by Expression and the constant expressions joined by Tokenizer.
+
+The results of the two ways are checked to be the same.
+
+Usage:
+    python tests/bench_expr.py [-n lines] [-r repeat]
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import time
+import types
+
+TESTPATH = os.path.dirname(os.path.abspath(__file__))
+PRGPATH = os.path.join(os.path.dirname(TESTPATH), "OKKCNC")
+sys.path.append(PRGPATH)
+sys.path.append(os.path.join(PRGPATH, "lib"))
+
+import OCV
+import Expression
+import ParseCache
+import Tokenizer
+from CNC import CNC
+from GCode import GCode
+
+HEADER = (
+    "#100 = 2.5",
+    "#101 = 0.75",
+    "#102 = 10.0",
+    )
+
+# lines with expressions as found in a parametric program
+LINES = (
+    "G1 X[#102 + {0}*#101] Y[#102 - {0}*#101] F[#100*400]",
+    "G1 Z[-#101*{0} / 4] F[500]",
+    "G2 X[#102*2 + {0}] Y[#102] I[#100] J[0]",
+    "G0 X[{0} * 25.4 / 2] Y[wy + #100]",
+    "G1 X[abs(#101 - {0})] Y[#101 if {0} > 5 else -#101]",
+    )
+
+
+def program(count):
+    """@return the text of the lines of a parametric program"""
+    return [LINES[i % len(LINES)].format(i % 100) for i in range(count)]
+
+
+def run_eval(lines, gcode):
+    """the lines compiled and evaluated as before Expression"""
+    ParseCache.clear()
+    out = []
+    for line in lines:
+        line = CNC.compileLine(line)
+        for i, expr in enumerate(line):
+            if not isinstance(expr, str):
+                result = eval(expr, OCV.CD, gcode.vars)
+                if isinstance(result, float):
+                    line[i] = str(round(result, OCV.digits))
+                else:
+                    line[i] = str(result)
+        out.append("".join(line))
+    return out
+
+
+def run_compiled(lines, gcode):
+    """the lines compiled by CNC.compileLine and evaluated by
+    GCode.evaluate, the caches are cleared as for a new program
+    """
+    ParseCache.clear()
+    Expression._CACHE.clear()
+    Expression._CONSTANTS.clear()
+    out = []
+    for line in lines:
+        line = CNC.compileLine(line)
+        if isinstance(line, list):
+            line = gcode.evaluate(line)
+        out.append(line)
+    return out
+
+
+def measure(func, lines, gcode, repeat):
+    """@return best time of repeat runs and the result"""
+    best = None
+    for _ in range(repeat):
+        t_0 = time.time()
+        result = func(lines, gcode)
+        elapsed = time.time() - t_0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def main(args):
+    count = 100000
+    repeat = 3
+
+    while args:
+        arg = args.pop(0)
+        if arg == "-n":
+            count = int(args.pop(0))
+        elif arg == "-r":
+            repeat = int(args.pop(0))
+
+    gcode = GCode()
+    for line in HEADER:
+        gcode.evaluate(CNC.compileLine(line))
+
+    lines = program(count)
+    compiled = [CNC.compileLine(line) for line in lines]
+    left = sum(
+        isinstance(expr, types.CodeType) for line in compiled
+        if isinstance(line, list) for expr in line)
+
+    # the lines as compiled before, without the expressions cache and
+    # the constants, ParseCache was already there
+    Tokenizer.JOIN_CONSTANTS = False
+    compile_expr = Expression.compile_expr
+    Expression.compile_expr = lambda source: compile(source, "", "eval")
+    exprs = sum(
+        isinstance(expr, types.CodeType) for line in lines
+        for expr in Tokenizer.compile_line(line))
+    t_eval, r_eval = measure(run_eval, lines, gcode, repeat)
+    Expression.compile_expr = compile_expr
+    Tokenizer.JOIN_CONSTANTS = True
+
+    t_comp, r_comp = measure(run_compiled, lines, gcode, repeat)
+
+    print("Lines           {0:10d}".format(count))
+    print("Expressions     {0:10d}".format(exprs))
+    print("Not constants   {0:10d}".format(left))
+    print("compile, eval() {0:10.3f} s".format(t_eval))
+    print("cached, joined  {0:10.3f} s".format(t_comp))
+    print("Speedup         {0:10.2f} x".format(t_eval / max(t_comp, 1e-9)))
+    print("Same results    {0:>10}".format(str(r_eval == r_comp)))
+
+    if r_eval != r_comp:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
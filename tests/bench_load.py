@@ -0,0 +1,158 @@
+# -*- coding: ascii -*-
+"""bench_load.py
+
+Measure the time and the peak memory (RSS) of GCode.load on a big file.
+
+The file is streamed through GCode.parse_gcode, the peak RSS has to grow
+with the size of the blocks, not with the size of the file plus the blocks
+as when all the lines were read in OCV.gcodelines before parsing.
+
+Usage:
+    python tests/bench_load.py [file.ngc] [-s size_MB] [--cambam] [--keep]
+                               [--mapped]
+
+without a file a plain GCode file of size_MB (default 500) is generated in
+the temporary directory, with --cambam it contains the CamBam-OKK marker
+and the MOP comments to exercise the Heuristic event processing, --keep
+does not delete the generated file, --mapped loads it read only memory
+mapped (the mapped pages are counted in the RSS only when read).
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import resource
+import sys
+import tempfile
+import time
+
+TESTPATH = os.path.dirname(os.path.abspath(__file__))
+PRGPATH = os.path.join(os.path.dirname(TESTPATH), "OKKCNC")
+sys.path.append(PRGPATH)
+sys.path.append(os.path.join(PRGPATH, "lib"))
+
+import OCV
+from GCode import GCode
+
+
+def peak_rss():
+    """@return peak resident set size in MB"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # bytes on Mac OS, kilobytes on Linux
+        return rss / 1048576.0
+    return rss / 1024.0
+
+
+def write_mop(f_handle, mop, cambam):
+    """Write a contour with two Z passes"""
+    x0 = (mop % 100) * 10.0
+    y0 = (mop // 100 % 100) * 10.0
+
+    if cambam:
+        f_handle.write("(MOP Start: Profile {0} )\n".format(mop))
+
+    f_handle.write("G0 Z3.0\n")
+    f_handle.write("G0 X{0:.4f} Y{1:.4f}\n".format(x0, y0))
+    f_handle.write("G0 Z1.0\n")
+
+    for z_pass in (-1.0, -2.0):
+        f_handle.write("G1 F500.0 Z{0:.1f}\n".format(z_pass))
+        f_handle.write("G1 F2000.0 X{0:.4f} Y{1:.4f}\n".format(x0 + 8.0, y0))
+        f_handle.write("X{0:.4f} Y{1:.4f}\n".format(x0 + 8.0, y0 + 8.0))
+        f_handle.write("G2 X{0:.4f} Y{1:.4f} I-4.0 J0.0\n".format(
+            x0, y0 + 8.0))
+        f_handle.write("G1 X{0:.4f} Y{1:.4f}\n".format(x0, y0))
+
+    f_handle.write("G0 Z3.0\n")
+
+    if cambam:
+        f_handle.write("(MOP End: Profile {0} )\n".format(mop))
+
+
+def generate(filename, size, cambam):
+    """Generate a GCode file of about size bytes"""
+    with open(filename, "w") as f_handle:
+        if cambam:
+            f_handle.write("( Made using CamBam - http://www.cambam.co.uk )\n")
+            f_handle.write("( Grbl Post Processor )\n")
+            f_handle.write("( ver: okk-1.1 )\n")
+        f_handle.write("G21 G90\n")
+        f_handle.write("M3 S10000\n")
+
+        mop = 0
+        while f_handle.tell() < size:
+            write_mop(f_handle, mop, cambam)
+            mop += 1
+
+        f_handle.write("G0 Z10.0\n")
+        f_handle.write("M5\n")
+        f_handle.write("M30\n")
+
+
+def main(args):
+    size = 500
+    cambam = False
+    keep = False
+    mapped = False
+    filename = None
+
+    while args:
+        arg = args.pop(0)
+        if arg == "-s":
+            size = float(args.pop(0))
+        elif arg == "--cambam":
+            cambam = True
+        elif arg == "--keep":
+            keep = True
+        elif arg == "--mapped":
+            mapped = True
+        else:
+            filename = arg
+
+    generated = filename is None
+
+    if generated:
+        fd, filename = tempfile.mkstemp(suffix=".ngc")
+        os.close(fd)
+        t_0 = time.time()
+        generate(filename, int(size * 1048576), cambam)
+        print("Generated {0} in {1:.1f}s".format(filename, time.time() - t_0))
+
+    # no debug output while loading
+    OCV.DEBUG_PAR = False
+    OCV.DEBUG_HEUR = 0
+
+    try:
+        file_size = os.path.getsize(filename) / 1048576.0
+        rss_0 = peak_rss()
+
+        gcode = GCode()
+        t_0 = time.time()
+        gcode.load(filename, mapped)
+        elapsed = time.time() - t_0
+
+        rss_1 = peak_rss()
+        lines = sum(len(block) for block in OCV.blocks)
+
+        print("File size       {0:10.1f} MB".format(file_size))
+        print("Blocks          {0:10d}".format(len(OCV.blocks)))
+        print("Lines           {0:10d}".format(lines))
+        print("Load time       {0:10.1f} s".format(elapsed))
+        print("Lines/s         {0:10.0f}".format(lines / max(elapsed, 1e-9)))
+        print("Peak RSS before {0:10.1f} MB".format(rss_0))
+        print("Peak RSS after  {0:10.1f} MB".format(rss_1))
+        print("Peak RSS load   {0:10.1f} MB".format(rss_1 - rss_0))
+    finally:
+        if generated and not keep:
+            os.remove(filename)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,331 @@
+# -*- coding: ascii -*-
+"""bench_serial.py
+
+Measure the idle CPU use, the lines per second and the latency between an
+"ok" of the controller and the next line sent, with the serial loop used
+before by Sender.serialIO (polling inWaiting() and readline() with a
+timeout), with the SerialIO threads writing a line at a time and writing
+all the lines that fit in the buffer at once with a TxPacker.
+
+A fake GRBL runs in a child process on the master side of a pseudo
+terminal, it answers "ok" to every line and a status report to "?", with
+a RX buffer of 128 characters. The lines are long enough to fill the
+buffer, so after every "ok" the sender has to send the next line, with
+--short the lines are short 3D segments and several fit in the buffer.
+
+Usage:
+    python tests/bench_serial.py [-n lines] [-i idle_seconds] [-d ms]
+                                 [--short] [--legacy | --sio | --batch]
+
+-d is the time to execute a line in the fake GRBL (default 2 ms), the
+round trip of single commands, as from the MDI, is measured too.
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import multiprocessing
+import os
+import select
+import sys
+import threading
+import time
+from collections import deque
+
+TESTPATH = os.path.dirname(os.path.abspath(__file__))
+PRGPATH = os.path.join(os.path.dirname(TESTPATH), "OKKCNC")
+sys.path.append(PRGPATH)
+sys.path.append(os.path.join(PRGPATH, "lib"))
+
+import serial
+
+import SerialIO
+
+RX_BUFFER_SIZE = 128
+SERIAL_POLL = 0.125
+SERIAL_TIMEOUT = 0.10
+STATUS = b"<Idle|MPos:0.000,0.000,0.000|FS:0,0>\r\n"
+# single commands sent to measure the round trip
+COMMANDS = 20
+
+
+def fake_grbl(master, conn, delay):
+    """answer to the sender until a "quit" is received from conn, the "ok"
+    of a line is sent delay seconds after the previous one, as the time
+    to execute it
+    the latencies between an "ok" and the next line byte are sent back
+    """
+    data = b""
+    ok_time = None
+    latencies = []
+    # times to send the "ok" of the lines received
+    pending = deque()
+
+    while not conn.poll():
+        now = time.time()
+
+        while pending and pending[0] <= now:
+            pending.popleft()
+            os.write(master, b"ok\r\n")
+            ok_time = time.time()
+
+        if pending:
+            timeout = max(0.0, pending[0] - now)
+        else:
+            timeout = 0.05
+
+        if not select.select([master], [], [], timeout)[0]:
+            continue
+
+        try:
+            chunk = os.read(master, 4096)
+        except OSError:
+            break
+
+        now = time.time()
+
+        for char in bytearray(chunk):
+            if char == ord("?"):
+                os.write(master, STATUS)
+                continue
+
+            if ok_time is not None:
+                latencies.append(now - ok_time)
+                ok_time = None
+
+            if char == ord("\n"):
+                if data.strip():
+                    last = pending[-1] if pending else now
+                    pending.append(max(now, last) + delay)
+                data = b""
+            else:
+                data += bytes(bytearray([char]))
+
+    conn.recv()
+    conn.send(latencies)
+
+
+class Streamer(object):
+    """Send the lines counting the characters in the controller buffer"""
+
+    def __init__(self, port, lines, batch=False):
+        self.port = port
+        self.packer = SerialIO.TxPacker(RX_BUFFER_SIZE) if batch else None
+        self.queue = SerialIO.EventQueue()
+        self.cline = deque()
+        self.tosend = None
+        self.total = len(lines)
+        self.acked = 0
+        # write calls of the lines
+        self.writes = 0
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+        for line in lines:
+            self.queue.put(line)
+
+    def received(self, line):
+        if line == "ok":
+            with self.lock:
+                if self.cline:
+                    self.cline.popleft()
+                self.acked += 1
+                if self.acked == self.total:
+                    self.done.set()
+
+    def fetch(self):
+        if self.tosend is None and self.queue.qsize() > 0:
+            self.tosend = self.queue.get_nowait()
+            self.cline.append(len(self.tosend))
+
+    def send(self):
+        """@return True if a line was sent"""
+        if self.tosend is not None and sum(self.cline) < RX_BUFFER_SIZE:
+            if self.packer is not None:
+                self.packer.add(self.tosend)
+            else:
+                self.port.write(self.tosend.encode())
+                self.writes += 1
+            self.tosend = None
+            return True
+        return False
+
+    def sio_send(self):
+        with self.lock:
+            while True:
+                self.fetch()
+                if not self.send():
+                    break
+
+            if self.packer:
+                self.port.write(self.packer.take())
+                self.writes += 1
+
+    def poll(self):
+        self.port.write(b"?")
+
+
+def legacy_loop(streamer, stop):
+    """The I/O loop of Sender.serialIO before SerialIO"""
+    port = streamer.port
+    tr = time.time()
+
+    while not stop.is_set():
+        t = time.time()
+        if t - tr > SERIAL_POLL:
+            streamer.poll()
+            tr = t
+
+        with streamer.lock:
+            streamer.fetch()
+
+        if port.inWaiting() or streamer.tosend is None:
+            line = str(port.readline().decode()).strip()
+            if line:
+                streamer.received(line)
+
+        with streamer.lock:
+            streamer.send()
+
+
+def cpu_time():
+    """@return user + system time of this process"""
+    times = os.times()
+    return times[0] + times[1]
+
+
+def run(mode, count, idle, delay, short):
+    """@return idle CPU %, command round trip, stream time, stream CPU %,
+    lines acknowledged, write calls, latencies
+    """
+    master, slave = os.openpty()
+    parent, child = multiprocessing.Pipe()
+    fake = multiprocessing.Process(
+        target=fake_grbl, args=(master, child, delay))
+    fake.start()
+
+    port = serial.serial_for_url(
+        os.ttyname(slave), 115200, timeout=SERIAL_TIMEOUT)
+    if short:
+        line = "G1X{0:.3f}Y{0:.3f}Z0.1\n"
+    else:
+        line = "G1 X{0:08.3f} Y{0:08.3f} Z{0:08.3f} F{0:08.3f} ({1})\n"
+    lines = [line.format(i * 0.001, "x" * 20) for i in range(count)]
+    streamer = Streamer(port, [], mode == "batch")
+    stop = threading.Event()
+
+    if mode == "legacy":
+        engine = threading.Thread(target=legacy_loop, args=(streamer, stop))
+        engine.daemon = True
+        engine.start()
+    else:
+        engine = SerialIO.SerialIO(
+            port, streamer.received, streamer.sio_send, streamer.poll,
+            None, SERIAL_POLL)
+        streamer.queue.listener = engine.wake
+        engine.start()
+
+    # idle, only the status polling
+    time.sleep(0.5)
+    c_0 = cpu_time()
+    t_0 = time.time()
+    time.sleep(idle)
+    idle_cpu = (cpu_time() - c_0) / (time.time() - t_0) * 100.0
+
+    # single commands as from the MDI or the jog buttons
+    round_trip = []
+
+    for i in range(COMMANDS):
+        streamer.done.clear()
+        streamer.total = streamer.acked + 1
+        t_0 = time.time()
+        streamer.queue.put("G91 G0 X0.1\n")
+        streamer.done.wait(1.0)
+        round_trip.append(time.time() - t_0)
+        time.sleep(0.05)
+
+    # streaming
+    streamer.done.clear()
+    streamer.acked = 0
+    streamer.writes = 0
+    streamer.total = count
+    c_0 = cpu_time()
+    t_0 = time.time()
+
+    for line in lines:
+        streamer.queue.put(line)
+
+    streamer.done.wait(count)
+    elapsed = time.time() - t_0
+    stream_cpu = (cpu_time() - c_0) / elapsed * 100.0
+
+    if mode == "legacy":
+        stop.set()
+        engine.join()
+    else:
+        engine.stop()
+
+    parent.send("quit")
+    latencies = parent.recv()
+    fake.join()
+    port.close()
+    os.close(master)
+
+    return idle_cpu, round_trip, elapsed, stream_cpu, streamer.acked, \
+        streamer.writes, latencies
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def main(args):
+    count = 2000
+    idle = 3.0
+    delay = 0.002
+    short = False
+    modes = ["legacy", "sio", "batch"]
+
+    while args:
+        arg = args.pop(0)
+        if arg == "-n":
+            count = int(args.pop(0))
+        elif arg == "-i":
+            idle = float(args.pop(0))
+        elif arg == "-d":
+            delay = float(args.pop(0)) / 1000.0
+        elif arg == "--legacy":
+            modes = ["legacy"]
+        elif arg == "--sio":
+            modes = ["sio"]
+        elif arg == "--batch":
+            modes = ["batch"]
+        elif arg == "--short":
+            short = True
+
+    print("{0:8} {1:>9} {2:>10} {3:>7} {4:>8} {5:>7} {6:>7} {7:>9} "
+          "{8:>9}".format(
+              "engine", "idle CPU", "cmd 50%", "lines", "lines/s", "CPU",
+              "writes", "ok 50%", "ok 95%"))
+
+    for mode in modes:
+        idle_cpu, round_trip, elapsed, stream_cpu, acked, writes, \
+            latencies = run(mode, count, idle, delay, short)
+        print("{0:8} {1:8.1f}% {2:8.2f}ms {3:7d} {4:8.0f} {5:6.1f}% {6:7d} "
+              "{7:7.2f}ms {8:7.2f}ms".format(
+                  mode, idle_cpu, percentile(round_trip, 50) * 1000.0,
+                  acked, acked / elapsed, stream_cpu, writes,
+                  percentile(latencies, 50) * 1000.0,
+                  percentile(latencies, 95) * 1000.0))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,262 @@
+# -*- coding: ascii -*-
+"""bench_status.py
+
+Compare GrblStatus.Status.parse with the parsing of the status reports
+done before by GRBL1.parseBracketAngle, kept here as the reference
+implementation writing the values in a dictionary as OCV.CD.
+
+The reports are status lines captured from GRBL 1.1 and grblHAL, during
+jogs, runs, holds and alarms. The values parsed by the two ways are checked
+to be the same, then the lines are mutated at random (characters changed,
+removed, fields truncated) to check that Status.parse never raises.
+
+Usage:
+    python tests/bench_status.py [-n repeat] [-f fuzz_lines] [-s seed]
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import random
+import re
+import sys
+import time
+
+TESTPATH = os.path.dirname(os.path.abspath(__file__))
+PRGPATH = os.path.join(os.path.dirname(TESTPATH), "OKKCNC")
+sys.path.append(PRGPATH)
+sys.path.append(os.path.join(PRGPATH, "lib"))
+
+import GrblStatus
+
+SPLITPAT = re.compile(r"[:,]")
+DIGITS = 4
+
+# status reports captured from the controllers
+REPORTS = (
+    "<Idle|MPos:0.000,0.000,0.000|FS:0,0|WCO:0.000,0.000,0.000>",
+    "<Idle|MPos:0.000,0.000,0.000|FS:0,0|Ov:100,100,100>",
+    "<Idle|MPos:0.000,0.000,0.000|FS:0,0>",
+    "<Idle|MPos:-10.000,-20.000,-3.000|Bf:15,128|FS:0,0|"
+    "WCO:-110.000,-95.500,-42.120>",
+    "<Jog|MPos:-12.340,-20.000,-3.000|Bf:14,107|FS:1000,0>",
+    "<Jog|MPos:-15.872,-20.000,-3.000|Bf:15,128|FS:1000,0|Ov:100,100,100>",
+    "<Run|MPos:-84.271,-61.904,-44.000|Bf:0,98|FS:1200,12000>",
+    "<Run|MPos:-84.998,-61.104,-44.000|Bf:1,64|FS:1200,12000|Pn:Z>",
+    "<Run|MPos:-85.002,-60.553,-44.000|Bf:0,54|FS:1200,12000|"
+    "Ov:120,100,90|A:SF>",
+    "<Run|MPos:-85.500,-60.000,-44.500|Bf:2,121|FS:600,12000|"
+    "WCO:-110.000,-95.500,-42.120>",
+    "<Run|MPos:12.500,3.000,-1.000|Bf:3,111|Ln:1234|FS:800,10000|A:S>",
+    "<Run|MPos:12.500,3.000,-1.000|F:800>",
+    "<Hold:0|MPos:-85.500,-60.000,-44.500|Bf:0,128|FS:0,12000>",
+    "<Hold:1|MPos:-85.500,-60.000,-44.500|Bf:0,128|FS:0,0|Pn:H>",
+    "<Door:1|MPos:-85.500,-60.000,-44.500|Bf:0,128|FS:0,0|Pn:D>",
+    "<Alarm|MPos:0.000,0.000,0.000|Bf:15,128|FS:0,0|Pn:XYZ>",
+    "<Home|MPos:-1.000,-1.000,-1.000|Bf:15,128|FS:500,0|Pn:XY>",
+    "<Check|MPos:0.000,0.000,0.000|Bf:15,128|FS:0,0>",
+    "<Idle|WPos:25.000,14.500,-1.880|Bf:15,128|FS:0,0|"
+    "WCO:-110.000,-95.500,-42.120>",
+    "<Idle|WPos:25.000,14.500,-1.880|FS:0,0>",
+    # grblHAL, 1023 bytes buffer and extra fields
+    "<Idle|MPos:0.000,0.000,0.000|Bf:35,1023|FS:0,0|WCO:0.000,0.000,0.000>",
+    "<Run|MPos:3.250,1.125,-0.500|Bf:12,902|FS:3000,18000|Ov:100,100,100|"
+    "A:SM>",
+    "<Idle|MPos:0.000,0.000,0.000|Bf:35,1023|FS:0,0|Pn:P|WCO:1.0,2.0,3.0>",
+    "<Idle:0|MPos:0.000,0.000,0.000|Bf:35,1023|FS:0,0|H:1|T:2>",
+    )
+
+# fields compared between the reference and Status
+COMPARE = (
+    ("mx", "mx"), ("my", "my"), ("mz", "mz"),
+    ("wx", "wx"), ("wy", "wy"), ("wz", "wz"),
+    ("wcox", "wcox"), ("wcoy", "wcoy"), ("wcoz", "wcoz"),
+    ("curfeed", "feed"), ("curspindle", "spindle"),
+    ("planner", "planner"), ("rxbytes", "rxbytes"),
+    ("OvFeed", "ovfeed"), ("OvRapid", "ovrapid"), ("OvSpindle", "ovspindle"),
+    ("pins", "pins"),
+    )
+
+
+def reference(line, values):
+    """The parsing of GRBL1.parseBracketAngle before GrblStatus, with the
+    work position computed after the whole report as Status does
+    @return the state
+    """
+    fields = line[1:-1].split("|")
+    values["pins"] = ""
+
+    for field in fields[1:]:
+        word = SPLITPAT.split(field)
+        if word[0] == "MPos":
+            values["mx"] = float(word[1])
+            values["my"] = float(word[2])
+            values["mz"] = float(word[3])
+        elif word[0] == "F":
+            values["curfeed"] = float(word[1])
+        elif word[0] == "FS":
+            values["curfeed"] = float(word[1])
+            values["curspindle"] = float(word[2])
+        elif word[0] == "Bf":
+            values["planner"] = int(word[1])
+            values["rxbytes"] = int(word[2])
+        elif word[0] == "Ov":
+            values["OvFeed"] = int(word[1])
+            values["OvRapid"] = int(word[2])
+            values["OvSpindle"] = int(word[3])
+        elif word[0] == "WCO":
+            values["wcox"] = float(word[1])
+            values["wcoy"] = float(word[2])
+            values["wcoz"] = float(word[3])
+        elif word[0] == "WPos":
+            values["wx"] = float(word[1])
+            values["wy"] = float(word[2])
+            values["wz"] = float(word[3])
+            values["mx"] = round(values["wx"] + values["wcox"], DIGITS)
+            values["my"] = round(values["wy"] + values["wcoy"], DIGITS)
+            values["mz"] = round(values["wz"] + values["wcoz"], DIGITS)
+        elif word[0] == "Pn":
+            values["pins"] = word[1]
+
+    if "MPos" in line:
+        values["wx"] = round(values["mx"] - values["wcox"], DIGITS)
+        values["wy"] = round(values["my"] - values["wcoy"], DIGITS)
+        values["wz"] = round(values["mz"] - values["wcoz"], DIGITS)
+
+    return fields[0]
+
+
+def new_values():
+    """@return the dictionary of the reference with the initial values"""
+    status = GrblStatus.Status()
+    values = {}
+    status.update_dict(values)
+    return values
+
+
+def check(reports):
+    """@return the number of reports parsed with different values"""
+    status = GrblStatus.Status(DIGITS)
+    values = new_values()
+    errors = 0
+
+    for line in reports:
+        state = reference(line, values)
+        status.parse(line)
+
+        diff = [(name, values[name], getattr(status, attr))
+                for name, attr in COMPARE
+                if values[name] != getattr(status, attr)]
+
+        if state != status.state or diff:
+            errors += 1
+            print("Different: {0}\n    {1}".format(line, diff))
+
+    return errors
+
+
+def mutate(line, rnd):
+    """@return the line with a random damage, as a noisy serial line"""
+    kind = rnd.randint(0, 4)
+    pos = rnd.randint(0, len(line) - 1)
+
+    if kind == 0:
+        # changed character
+        return line[:pos] + chr(rnd.randint(32, 126)) + line[pos + 1:]
+    elif kind == 1:
+        # lost character
+        return line[:pos] + line[pos + 1:]
+    elif kind == 2:
+        # truncated line
+        return line[:pos] + ">"
+    elif kind == 3:
+        # field without values
+        return line.replace(":", ":|", 1)
+    return line[:pos] + "|" + line[pos:]
+
+
+def fuzz(count, seed):
+    """@return the number of mutated reports detected as not valid"""
+    rnd = random.Random(seed)
+    status = GrblStatus.Status(DIGITS)
+    invalid = 0
+
+    for _ in range(count):
+        line = mutate(rnd.choice(REPORTS), rnd)
+
+        try:
+            if not status.parse(line):
+                invalid += 1
+        except Exception:
+            print("Exception parsing: {0!r}".format(line))
+            raise
+
+    return invalid
+
+
+def measure(func, repeat):
+    """@return the best time of repeat runs of func on all the reports"""
+    best = None
+    for _ in range(repeat):
+        t_0 = time.time()
+        func()
+        elapsed = time.time() - t_0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(args):
+    repeat = 2000
+    count = 100000
+    seed = 1
+
+    while args:
+        arg = args.pop(0)
+        if arg == "-n":
+            repeat = int(args.pop(0))
+        elif arg == "-f":
+            count = int(args.pop(0))
+        elif arg == "-s":
+            seed = int(args.pop(0))
+
+    errors = check(REPORTS)
+    invalid = fuzz(count, seed)
+
+    values = new_values()
+    status = GrblStatus.Status(DIGITS)
+
+    def run_reference():
+        for line in REPORTS:
+            reference(line, values)
+
+    def run_status():
+        for line in REPORTS:
+            status.parse(line)
+
+    t_ref = measure(run_reference, repeat)
+    t_new = measure(run_status, repeat)
+    reports = len(REPORTS)
+
+    print("Reports          {0:10d}".format(reports))
+    print("Different        {0:10d}".format(errors))
+    print("Fuzzed           {0:10d}".format(count))
+    print("Fuzzed invalid   {0:10d}".format(invalid))
+    print("Reference        {0:10.2f} us/report".format(
+        t_ref / reports * 1e6))
+    print("Status.parse     {0:10.2f} us/report".format(
+        t_new / reports * 1e6))
+    print("Speedup          {0:10.2f} x".format(t_ref / max(t_new, 1e-9)))
+
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
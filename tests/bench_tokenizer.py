@@ -0,0 +1,334 @@
+# -*- coding: ascii -*-
+"""bench_tokenizer.py
+
+Compare the Tokenizer module with the per character loop previously used
+by CNC.compileLine and CNC.breakLine, the old code is kept here as the
+reference implementation.
+
+Usage:
+    python tests/bench_tokenizer.py [file.ngc ...] [-n repeat]
+
+without files all the .ngc files in the tests directory are used, plus a
+set of lines with comments, expressions and assignments.
+
+The differences printed for ';' and '=' inside comments and expressions
+are expected, the old loop dropped '=' and moved ';' into the expression.
+
+@author: carlo.dormeletti@gmail.com
+
+    https://github.com/onekk/OKKCNC
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import glob
+import os
+import sys
+import time
+
+TESTPATH = os.path.dirname(os.path.abspath(__file__))
+PRGPATH = os.path.join(os.path.dirname(TESTPATH), "OKKCNC")
+sys.path.append(PRGPATH)
+sys.path.append(os.path.join(PRGPATH, "lib"))
+
+import OCV
+import Tokenizer
+
+# lines that exercise the slow path of the tokenizer
+EXTRA_LINES = [
+    "G1 X[_x+1] Y[_y*2] (move [to] corner)",
+    "G0 X10 ; comment with (parens) and = sign",
+    "(comment only line)",
+    "_100 = 5",
+    "#101 = [#100 * 2]",
+    "G1 X[[1+2]*3] F1000",
+    "M3 S[_s] (spindle ; on)",
+    "%wait",
+    "%msg hello",
+    "a=1",
+    "G1 X1 Y2 (a) Z3 (b)",
+    "  g1   x1.5  y-2.25  ",
+    "$H",
+    ";only comment",
+]
+
+
+def ref_compile_line(line, space=False):
+    """
+     @return line,comment
+    line s breaking a line containing list of commands,
+    None,"" if empty or comment
+    else compiled expressions,""
+    """
+    line = line.strip()
+
+    if not line:
+        return None
+
+    if line[0] == "$":
+        return line
+
+    # to accept #nnn variables as _nnn internally
+    line = line.replace('#', '_')
+    OCV.comment = ""
+
+    # execute literally the line after the first character
+    if line[0] == '%':
+        # special command
+        pat = OCV.RE_AUX.match(line.strip())
+
+        if pat:
+            cmd = pat.group(1)
+            args = pat.group(2)
+        else:
+            cmd = None
+            args = None
+
+        if cmd == "%wait":
+            return (OCV.GSTATE_WAIT,)
+        elif cmd == "%msg":
+
+            if not args:
+                args = None
+
+            return (OCV.GSTATE_MSG, args)
+        elif cmd == "%update":
+            return (OCV.GSTATE_UPDATE, args)
+        elif line.startswith("%if running") and not OCV.CD["running"]:
+            # ignore if running lines when not running
+            return None
+        else:
+            try:
+                return compile(line[1:], "", "exec")
+            except Exception:
+                # FIXME show the error!!!!
+                return None
+
+    # most probably an assignment like  #nnn = expr
+    if line[0] == '_':
+        try:
+            return compile(line, "", "exec")
+        except Exception as e:
+            print("Compile line error: \n")
+            print(e)
+            return None
+
+    # commented line
+    if line[0] == ';':
+        OCV.comment = line[1:].strip()
+        return None
+
+    out = []  # output list of commands
+    braket = 0  # bracket count []
+    paren = 0  # parenthesis count ()
+    expr = ""  # expression string
+    cmd = ""  # cmd string
+    inComment = False  # inside inComment
+    for i, ch in enumerate(line):
+        if ch == '(':
+            # comment start?
+            paren += 1
+            inComment = (braket == 0)
+
+            if not inComment:
+                expr += ch
+
+        elif ch == ')':
+            # comment end?
+            paren -= 1
+            if not inComment:
+                expr += ch
+
+            if paren == 0 and inComment:
+                inComment = False
+        elif ch == '[':
+            # expression start?
+            if not inComment:
+
+                if OCV.stdexpr:
+                    ch = '('
+
+                braket += 1
+
+                if braket == 1:
+                    if cmd:
+                        out.append(cmd)
+                        cmd = ""
+                else:
+                    expr += ch
+            else:
+                OCV.comment += ch
+
+        elif ch == ']':
+            # expression end?
+            if not inComment:
+
+                if OCV.stdexpr:
+                    ch = ')'
+                braket -= 1
+
+                if braket == 0:
+                    try:
+                        out.append(compile(expr, "", "eval"))
+                    except Exception:
+                        # FIXME show the error!!!!
+                        pass
+                    # out.append("<<"+expr+">>")
+                    expr = ""
+                else:
+                    expr += ch
+
+            else:
+                OCV.comment += ch
+
+        elif ch == '=':
+            # check for assignments (FIXME very bad)
+            if not out and braket == 0 and paren == 0:
+                for i in " ()-+*/^$":
+                    if i in cmd:
+                        cmd += ch
+                        break
+                else:
+                    try:
+                        return compile(line, "", "exec")
+                    except Exception:
+                        # FIXME show the error!!!!
+                        return None
+        elif ch == ';':
+            # Skip everything after the semicolon on normal lines
+            if not inComment and paren == 0 and braket == 0:
+                OCV.comment += line[i+1:]
+                break
+            else:
+                expr += ch
+
+        elif braket > 0:
+            expr += ch
+
+        elif not inComment:
+            if ch == ' ':
+                if space:
+                    cmd += ch
+            else:
+                cmd += ch
+
+        elif inComment:
+            OCV.comment += ch
+
+    if cmd:
+        out.append(cmd)
+
+    # return output commands
+    if len(out) == 0:
+        return None
+    if len(out) > 1:
+        return out
+    return out[0]
+
+def ref_break_line(line):
+    """Break line into commands"""
+    if line is None:
+        return None
+    # Insert space before each command
+    line = OCV.RE_CMD.sub(r" \1", line).lstrip()
+    return line.split()
+
+
+def ref_tokens(lines, space=False):
+    """Tokenize lines with the reference implementation"""
+    result = []
+    for line in lines:
+        cmd = ref_compile_line(line, space)
+        words = ref_break_line(cmd) if isinstance(cmd, str) else None
+        result.append((cmd, OCV.comment, words))
+    return result
+
+
+def new_tokens(lines, space=False):
+    """Tokenize lines with the Tokenizer module"""
+    result = []
+    for line in lines:
+        cmd = Tokenizer.compile_line(line, space)
+        words = Tokenizer.split_words(cmd) if isinstance(cmd, str) else None
+        result.append((cmd, OCV.comment, words))
+    return result
+
+
+def comparable(cmd):
+    """Make code objects comparable"""
+    if isinstance(cmd, list):
+        return [comparable(x) for x in cmd]
+    if hasattr(cmd, "co_code"):
+        return (cmd.co_code, cmd.co_consts, cmd.co_names)
+    return cmd
+
+
+def check(lines):
+    """Return the lines where the two implementations differ"""
+    diff = []
+    for space in (False, True):
+        ref = ref_tokens(lines, space)
+        new = new_tokens(lines, space)
+        for line, r, n in zip(lines, ref, new):
+            if (comparable(r[0]), r[1], r[2]) != \
+                    (comparable(n[0]), n[1], n[2]):
+                diff.append((line, space, r, n))
+    return diff
+
+
+def timeit(func, lines, repeat):
+    """Best time of repeat runs"""
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        func(lines)
+        dt = time.time() - t0
+        if best is None or dt < best:
+            best = dt
+    return best
+
+
+def main(argv):
+    repeat = 5
+    files = []
+    i = 0
+    while i < len(argv):
+        if argv[i] == "-n":
+            i += 1
+            repeat = int(argv[i])
+        else:
+            files.append(argv[i])
+        i += 1
+
+    if not files:
+        files = sorted(glob.glob(os.path.join(TESTPATH, "*.ngc")))
+
+    lines = []
+    for fn in files:
+        with open(fn, "r") as f:
+            lines.extend(f.read().splitlines())
+
+    print("Files: {0}  lines: {1}".format(len(files), len(lines)))
+
+    for line, space, r, n in check(lines + EXTRA_LINES):
+        print("DIFF space={0} {1!r}\n  old: {2!r}\n  new: {3!r}".format(
+            space, line, r, n))
+
+    # scale to a size where the timing is meaningful
+    mult = max(1, 200000 // max(1, len(lines)))
+    lines = lines * mult
+
+    t_ref = timeit(ref_tokens, lines, repeat)
+    t_new = timeit(new_tokens, lines, repeat)
+    print("{0} lines".format(len(lines)))
+    print("reference: {0:.3f}s  {1:.0f} lines/s".format(
+        t_ref, len(lines) / t_ref))
+    print("tokenizer: {0:.3f}s  {1:.0f} lines/s".format(
+        t_new, len(lines) / t_new))
+    print("speedup:   {0:.2f}x".format(t_ref / t_new))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])